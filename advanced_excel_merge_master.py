@@ -2,17 +2,18 @@ import streamlit as st
 import pandas as pd
 import io
 import openpyxl
-from excel_utils import clean_columns_values, rename_columns_to_standard, convert_quantity_columns
-
-def clean_value(value, delete_enabled, custom_chars):
-    if isinstance(value, str):
-        unwanted = [" m2", " m3", " m", "Nicht klassifiziert", "---"]
-        if delete_enabled and custom_chars.strip():
-            custom_list = [x.strip() for x in custom_chars.split(",") if x.strip()]
-            unwanted.extend(custom_list)
-        for u in unwanted:
-            value = value.replace(u, "")
-    return value
+from excel_utils import (
+    apply_column_schema,
+    clean_columns_values,
+    rename_columns_to_standard,
+    convert_quantity_columns,
+    unwanted_tokens_pattern,
+    remove_unwanted_tokens,
+    iter_parallel,
+    get_worker_count,
+    render_number_format_report,
+    NumberFormatReport,
+)
 
 def detect_header(sheet, max_rows_check=10):
     best_row_idx = None
@@ -26,6 +27,37 @@ def detect_header(sheet, max_rows_check=10):
             best_header = [str(cell).strip() if cell else "" for cell in row]
     return best_row_idx, best_header
 
+def _read_master_sheet(sheet, header_row, headers, pattern):
+    """Ein Blatt ab der Header-Zeile als DataFrame, Tokens spaltenweise entfernt."""
+    rows = [
+        row for row in sheet.iter_rows(min_row=header_row + 1, values_only=True)
+        if not all(cell is None for cell in row)
+    ]
+    if not rows:
+        return None
+    width = len(headers)
+    df = pd.DataFrame([row[:width] for row in rows])
+    df = df.reindex(columns=range(width))
+    df.columns = headers
+    # doppelte Header: wie beim Dict-Aufbau gewinnt die letzte Spalte
+    df = df.loc[:, ~df.columns.duplicated(keep="last")]
+    df = apply_column_schema(remove_unwanted_tokens(df, pattern))
+    df.insert(0, "SheetName", sheet.title)
+    return df
+
+def _load_master_sheet(data, sheet_name, delete_enabled, custom_chars):
+    """Worker: Arbeitsmappe read-only öffnen, ein Blatt lesen. Rückgabe: (header_row, df)."""
+    wb = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        sheet = wb[sheet_name]
+        header_row, headers = detect_header(sheet)
+        if not header_row:
+            return None, None
+        pattern = unwanted_tokens_pattern(delete_enabled, custom_chars)
+        return header_row, _read_master_sheet(sheet, header_row, headers, pattern)
+    finally:
+        wb.close()
+
 def app(supplement_name, delete_enabled, custom_chars):
     st.header("Master Table")
     st.markdown("Fasst ausgewählte Arbeitsblätter einer Excel-Datei zu einer Mastertabelle zusammen.")
@@ -35,51 +67,53 @@ def app(supplement_name, delete_enabled, custom_chars):
         return
 
     try:
-        wb = openpyxl.load_workbook(uploaded_file, data_only=True)
+        wb = openpyxl.load_workbook(uploaded_file, read_only=True, data_only=True)
+        sheets = wb.sheetnames
+        wb.close()
     except Exception as e:
         st.error(f"Fehler beim Laden der Arbeitsmappe: {e}")
         return
 
-    sheets = wb.sheetnames
     selected_sheets = st.multiselect("Arbeitsblätter auswählen", sheets, key="master_sheet_select")
     if not selected_sheets:
         st.info("Bitte wählen Sie mindestens ein Arbeitsblatt aus.")
         return
 
-    merged_data = []
-    all_columns = set()
+    frames = []
     progress_bar = st.progress(0)
-    total = len(selected_sheets)
 
-    for i, sheet_name in enumerate(selected_sheets):
-        sheet = wb[sheet_name]
-        header_row, headers = detect_header(sheet)
+    # Blätter unabhängig voneinander (parallel) lesen, Ergebnis in Blatt-Reihenfolge
+    data = uploaded_file.getvalue()
+    jobs = [(data, sheet_name, delete_enabled, custom_chars) for sheet_name in selected_sheets]
+    results = iter_parallel(
+        _load_master_sheet, jobs, get_worker_count(),
+        on_progress=lambda done, n: progress_bar.progress(done / n)
+    )
+    for i, res, err in results:
+        sheet_name = selected_sheets[i]
+        if err is not None:
+            st.error(f"Fehler in '{sheet_name}': {err}")
+            continue
+        header_row, df_sheet = res
         if not header_row:
             st.error(f"Kein Header in '{sheet_name}' gefunden.")
             continue
-        for row in sheet.iter_rows(min_row=header_row + 1, values_only=True):
-            if all(cell is None for cell in row):
-                continue
-            row_dict = {col: clean_value(val, delete_enabled, custom_chars) for col, val in zip(headers, row)}
-            row_dict["SheetName"] = sheet_name
-            merged_data.append(row_dict)
-            all_columns.update(row_dict.keys())
-        progress_bar.progress((i + 1) / total)
+        if df_sheet is not None:
+            frames.append(df_sheet)
 
-    if not merged_data:
+    if not frames:
         st.error("Keine Daten zusammengeführt.")
         return
 
-    sorted_columns = list(all_columns)
-    if "SheetName" in sorted_columns:
-        sorted_columns.remove("SheetName")
-        sorted_columns = ["SheetName"] + sorted_columns
-
-    df_master = pd.DataFrame(merged_data, columns=sorted_columns)
+    # Spalten in Reihenfolge des ersten Auftretens, SheetName vorne
+    df_master = pd.concat(frames, ignore_index=True)
+    frames.clear()
     df_master = rename_columns_to_standard(df_master)
-    df_master = clean_columns_values(df_master, delete_enabled, custom_chars)
+    number_report = NumberFormatReport()
+    df_master = clean_columns_values(df_master, delete_enabled, custom_chars, report=number_report)
 
-    df_export = convert_quantity_columns(df_master.copy())
+    df_export = convert_quantity_columns(df_master.copy(), number_report)
+    render_number_format_report(number_report)
     output = io.BytesIO()
     with pd.ExcelWriter(output, engine="openpyxl") as writer:
         df_export.to_excel(writer, index=False, sheet_name="MasterTable")
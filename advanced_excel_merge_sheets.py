@@ -1,19 +1,79 @@
 import streamlit as st
-import pandas as pd
 import io
+import os
+import pickle
+import re
+import tempfile
 import openpyxl
 from openpyxl import Workbook
-from excel_utils import clean_columns_values, rename_columns_to_standard
-
-def clean_value(value, delete_enabled, custom_chars):
-    if isinstance(value, str):
-        unwanted = [" m2", " m3", " m", "Nicht klassifiziert", "---"]
-        if delete_enabled and custom_chars.strip():
-            custom_list = [x.strip() for x in custom_chars.split(",") if x.strip()]
-            unwanted.extend(custom_list)
-        for u in unwanted:
-            value = value.replace(u, "")
-    return value
+from excel_utils import (
+    unwanted_tokens_pattern,
+    iter_parallel,
+    get_worker_count,
+)
+
+# Excel: max. 31 Zeichen, keine []:*?/\ im Blattnamen
+INVALID_SHEET_CHARS = re.compile(r"[\[\]:*?/\\]")
+# Zeilen je gepickeltem Block in der Worker-Auslagerung
+SPILL_BATCH_ROWS = 5000
+
+def _unique_sheet_name(file_name, used):
+    """
+    Blattname aus dem Dateinamen (bis zum ersten Punkt, max. 30 Zeichen).
+    Kollisionen (Excel vergleicht ohne Gross-/Kleinschreibung) werden
+    deterministisch mit _2, _3, ... innerhalb von 31 Zeichen aufgelöst.
+    """
+    base = INVALID_SHEET_CHARS.sub("_", file_name.split('.')[0])[:30].strip("'") or "Sheet"
+    name = base
+    n = 1
+    while name.lower() in used:
+        n += 1
+        suffix = f"_{n}"
+        name = base[:31 - len(suffix)] + suffix
+    used.add(name.lower())
+    return name
+
+def _iter_clean_rows(data, pattern):
+    """Aktives Blatt read-only zeilenweise lesen, Tokens aus Textzellen entfernen."""
+    wb = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        for row in wb.active.iter_rows(values_only=True):
+            yield [pattern.sub("", cell) if isinstance(cell, str) else cell for cell in row]
+    finally:
+        wb.close()
+
+def _spill_active_sheet_rows(data, delete_enabled, custom_chars):
+    """
+    Worker: aktives Blatt lesen, Zellen bereinigen und blockweise in eine temporaere
+    Datei pickeln, statt das ganze Blatt an den Hauptprozess zurueckzugeben.
+    Rückgabe: Pfad der Datei (der Aufrufer loescht sie).
+    """
+    pattern = unwanted_tokens_pattern(delete_enabled, custom_chars)
+    fd, path = tempfile.mkstemp(suffix=".rows")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            batch = []
+            for row in _iter_clean_rows(data, pattern):
+                batch.append(row)
+                if len(batch) >= SPILL_BATCH_ROWS:
+                    pickle.dump(batch, fh, protocol=pickle.HIGHEST_PROTOCOL)
+                    batch = []
+            if batch:
+                pickle.dump(batch, fh, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+def _iter_spilled_rows(path):
+    """Zeilen aus _spill_active_sheet_rows blockweise zurücklesen."""
+    with open(path, "rb") as fh:
+        while True:
+            try:
+                batch = pickle.load(fh)
+            except EOFError:
+                return
+            yield from batch
 
 def app(supplement_name, delete_enabled, custom_chars):
     st.header("Merge to Sheets")
@@ -24,24 +84,61 @@ def app(supplement_name, delete_enabled, custom_chars):
         return
 
     progress_bar = st.progress(0)
-    merged_wb = Workbook()
-    if "Sheet" in merged_wb.sheetnames:
-        merged_wb.remove(merged_wb["Sheet"])
+    # write-only: Zeilen werden direkt serialisiert, nichts bleibt im Speicher
+    merged_wb = Workbook(write_only=True)
+    used_names = set()
+    written = 0
+
+    workers = get_worker_count()
     total = len(uploaded_files)
+    if workers > 1:
+        # Worker lagern ihr Blatt auf die Platte aus: im Hauptprozess warten nur Pfade
+        jobs = [(f.getvalue(), delete_enabled, custom_chars) for f in uploaded_files]
+        results = iter_parallel(
+            _spill_active_sheet_rows, jobs, workers,
+            on_progress=lambda done, n: progress_bar.progress(done / n)
+        )
+    else:
+        # sequentiell: Zeilen direkt von der Eingabe in die Ausgabe pipen
+        pattern = unwanted_tokens_pattern(delete_enabled, custom_chars)
+        results = (
+            (idx, _iter_clean_rows(f.getvalue(), pattern), None)
+            for idx, f in enumerate(uploaded_files)
+        )
 
-    for idx, uploaded_file in enumerate(uploaded_files, start=1):
+    for idx, rows, err in results:
+        uploaded_file = uploaded_files[idx]
+        if err is not None:
+            st.error(f"Fehler bei {uploaded_file.name}: {err}")
+            continue
+        spill_path = None
+        if workers > 1:
+            spill_path, rows = rows, _iter_spilled_rows(rows)
+        new_sheet = None
         try:
-            wb = openpyxl.load_workbook(uploaded_file, data_only=True)
-            sheet = wb.active
-            sheet_name = uploaded_file.name.split('.')[0][:30]
+            sheet_name = _unique_sheet_name(uploaded_file.name, used_names)
             new_sheet = merged_wb.create_sheet(title=sheet_name)
-            for row in sheet.iter_rows(values_only=True):
-                cleaned_row = [clean_value(cell, delete_enabled, custom_chars) for cell in row]
+            for cleaned_row in rows:
                 new_sheet.append(cleaned_row)
-            progress_bar.progress(idx / total)
+            written += 1
         except Exception as e:
-            st.error(f"Fehler bei {uploaded_file.name}: {e}")
+            # Datei bricht mitten im Lesen ab: angefangenes Blatt nicht ausliefern
+            if new_sheet is not None:
+                new_sheet.close()
+                merged_wb.remove(new_sheet)
+                used_names.discard(sheet_name.lower())
+            st.error(f"Fehler bei {uploaded_file.name}: {e} – Blatt wurde verworfen.")
             continue
+        finally:
+            if spill_path is not None:
+                rows.close()
+                os.remove(spill_path)
+            if workers <= 1:
+                progress_bar.progress((idx + 1) / total)
+
+    if not written:
+        st.error("Keine Blätter zusammengeführt.")
+        return
 
     output = io.BytesIO()
     merged_wb.save(output)
@@ -1,15 +1,194 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import io
+import pickle
+import tempfile
 from collections import Counter
-from openpyxl.styles import PatternFill
 from excel_utils import (
+    apply_column_schema,
     clean_columns_values,
     rename_columns_to_standard,
     convert_quantity_columns,
     detect_header_row,
+    detect_sheet_header,
+    iter_sheet_chunks,
+    hash_values,
+    StreamingTableWriter,
+    RowLimitError,
+    write_highlighted_excel,
+    render_duplicate_review,
+    render_number_format_report,
+    NumberFormatReport,
+    iter_parallel,
+    get_worker_count,
+    COLUMN_PRESET,
+    pq,
 )
 
+# nur master_cols fixieren, measure_cols ignorieren
+MASTER_COLS = [
+    "Teilprojekt", "Gebäude", "Baufeld", "Geschoss",
+    "eBKP-H", "Umbaustatus", "Unter Terrain", "Beschreibung",
+    "Material", "Typ", "Name", "Ergänzung", "ING", "GUID"
+]
+
+
+def _order_columns(columns) -> list:
+    """Zuerst vorhandene MASTER_COLS, danach alle übrigen Spalten."""
+    ordered = [col for col in MASTER_COLS if col in columns]
+    ordered += [col for col in columns if col not in ordered]
+    return ordered
+
+
+def _read_table_file(data: bytes):
+    """Worker: Datei einlesen mit erkanntem Header. Rückgabe: (df, header_row)."""
+    # Rohdaten ohne Header laden
+    df_raw = pd.read_excel(io.BytesIO(data), header=None)
+
+    # Header-Zeile automatisch erkennen
+    header_row = detect_header_row(df_raw)
+
+    # Datei mit erkanntem Header einlesen
+    df = pd.read_excel(io.BytesIO(data), header=header_row)
+
+    # Ungültige Platzhalterwerte ersetzen
+    df.replace({"---": None, "": None}, inplace=True)
+    return apply_column_schema(df), header_row
+
+
+def _spill_file(file, header_row, cols, cols_sorted, rename_map, ordered,
+                delete_enabled, custom_chars, seen_guids, spill):
+    """
+    Eine Datei chunkweise bereinigen und als (chunk, dup_mask) in `spill` pickeln.
+    `seen_guids` wird nur gelesen. Rueckgabe: (Anzahl Chunks, neue GUID-Hashes,
+    doppelte GUID-Hashes, markierte Zeilen) – anzuwenden erst, wenn die Datei fertig ist.
+    """
+    n_chunks = 0
+    file_guids = set()
+    dup_guids = set()
+    dup_rows = 0
+    for chunk in iter_sheet_chunks(file, header_row=header_row, columns=cols):
+        chunk = chunk.replace({"---": None, "": None})
+        chunk = chunk.reindex(columns=cols_sorted).rename(columns=rename_map)
+        chunk = clean_columns_values(chunk, delete_enabled, custom_chars, warn_empty=False)
+        chunk = convert_quantity_columns(chunk.reindex(columns=ordered))
+
+        dup_mask = None
+        if "GUID" in chunk.columns:
+            has_guid = chunk["GUID"].notna().to_numpy()
+            hashes = hash_values(chunk["GUID"])
+            dup_mask = pd.Series(hashes).duplicated().to_numpy()
+            dup_mask |= np.fromiter(
+                (h in seen_guids or h in file_guids for h in hashes.tolist()), bool, len(hashes)
+            )
+            dup_mask &= has_guid
+            file_guids.update(hashes[has_guid].tolist())
+            dup_rows += int(dup_mask.sum())
+            dup_guids.update(hashes[dup_mask].tolist())
+        pickle.dump((chunk, dup_mask), spill, protocol=pickle.HIGHEST_PROTOCOL)
+        n_chunks += 1
+    return n_chunks, file_guids, dup_guids, dup_rows
+
+
+def _stream_merge(uploaded_files, supplement_name, delete_enabled, custom_chars, fmt):
+    """
+    Zwei-Pass-Merge fuer sehr viele Dateien mit konstantem Speicher.
+    Pass 1: nur Header lesen ⇒ Spaltenreihenfolge + Umbenennung.
+    Pass 2: Zeilen chunkweise bereinigen, je Datei in eine temporaere Datei auslagern
+    und erst nach vollstaendigem Lesen in den Writer streamen. Bricht eine Datei ab,
+    landet nichts von ihr in der Ausgabe oder im GUID-Set.
+    GUID-Duplikate ueber ein Set aus 64-bit Hashes (Folge-Vorkommen markiert).
+    """
+    progress = st.progress(0)
+    total = len(uploaded_files)
+
+    # Pass 1: Header
+    headers = []
+    column_freq = Counter()
+    for idx, file in enumerate(uploaded_files, start=1):
+        try:
+            header_row, cols = detect_sheet_header(file)
+            headers.append((file, header_row, cols))
+            column_freq.update(cols)
+        except Exception as e:
+            st.error(f"Fehler bei {file.name}: {e}")
+        progress.progress(idx / (2 * total))
+
+    if not headers:
+        st.error("Keine gültigen Daten gefunden.")
+        return
+
+    cols_sorted = [col for col, _ in column_freq.most_common()]
+    schema = rename_columns_to_standard(pd.DataFrame(columns=cols_sorted))
+    rename_map = dict(zip(cols_sorted, schema.columns))
+    schema = clean_columns_values(schema, delete_enabled, custom_chars, warn_empty=False)
+    ordered = _order_columns(list(schema.columns))
+    numeric = [c for c in ordered if c in COLUMN_PRESET]
+
+    # Pass 2: Zeilen streamen
+    out = io.BytesIO()
+    seen_guids = set()
+    dup_rows = 0
+    dup_guids = set()
+    try:
+        with StreamingTableWriter(
+            out, ordered, sheet_name=supplement_name or "Merged", fmt=fmt,
+            mark_column="GUID-Duplikat", numeric_columns=numeric
+        ) as writer:
+            for idx, (file, header_row, cols) in enumerate(headers, start=1):
+                with tempfile.TemporaryFile() as spill:
+                    try:
+                        n_chunks, file_guids, file_dups, file_dup_rows = _spill_file(
+                            file, header_row, cols, cols_sorted, rename_map, ordered,
+                            delete_enabled, custom_chars, seen_guids, spill
+                        )
+                    except Exception as e:
+                        st.error(f"Fehler bei {file.name}: {e} – Datei wurde nicht übernommen.")
+                        progress.progress((total + idx) / (2 * total))
+                        continue
+                    spill.seek(0)
+                    for _ in range(n_chunks):
+                        chunk, dup_mask = pickle.load(spill)
+                        writer.append(chunk, row_mask=dup_mask)
+                # Datei vollstaendig uebernommen: erst jetzt GUID-Zustand fortschreiben
+                seen_guids.update(file_guids)
+                dup_rows += file_dup_rows
+                dup_guids.update(file_dups)
+                st.success(f"{file.name}: Header in Zeile {header_row+1} erkannt.")
+                progress.progress((total + idx) / (2 * total))
+    except RowLimitError as e:
+        # Writer-Ueberlauf betrifft den ganzen Merge: kein abgeschnittenes Ergebnis ausliefern
+        st.error(f"Merge abgebrochen: {e}")
+        return
+
+    if "GUID" not in ordered:
+        st.info("Spalte 'GUID' nicht gefunden.")
+    elif dup_rows:
+        st.warning(
+            f"{len(dup_guids)} GUIDs mehrfach vorhanden: {dup_rows} Folge-Zeilen markiert "
+            "(erstes Vorkommen bleibt unmarkiert)."
+        )
+    else:
+        st.success("Keine GUID-Duplikate gefunden.")
+
+    out.seek(0)
+    st.success(f"Streaming-Merge abgeschlossen: {writer.rows_written} Zeilen.")
+    if fmt == "parquet":
+        file_name = f"{supplement_name or 'merged'}_merged_table.parquet"
+        mime = "application/octet-stream"
+    else:
+        file_name = f"{supplement_name or 'merged'}_merged_table.xlsx"
+        mime = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    st.download_button(
+        "Download Merged Table",
+        data=out,
+        file_name=file_name,
+        mime=mime,
+        key="table_stream_download_button"
+    )
+
+
 def app(supplement_name, delete_enabled, custom_chars):
     st.header("Merge to Table")
     st.markdown(
@@ -29,81 +208,68 @@ def app(supplement_name, delete_enabled, custom_chars):
     if not uploaded_files:
         return
 
+    streaming = st.checkbox(
+        "Streaming-Modus (sehr viele Dateien, konstanter Speicher)",
+        value=False,
+        key="table_streaming",
+        help="Liest zuerst nur die Header, danach werden die Zeilen chunkweise direkt in die Ausgabe geschrieben."
+    )
+    if streaming:
+        formats = ["xlsx", "parquet"] if pq is not None else ["xlsx"]
+        fmt = st.radio("Ausgabeformat", formats, horizontal=True, key="table_stream_format")
+        if st.button("Streaming-Merge starten", key="table_stream_run"):
+            _stream_merge(uploaded_files, supplement_name, delete_enabled, custom_chars, fmt)
+        return
+
     progress = st.progress(0)
-    merged_rows = []
+    frames = []
     column_freq = Counter()
-    total = len(uploaded_files)
 
-    # 1) Lesen und Häufigkeit zählen
-    for idx, file in enumerate(uploaded_files, start=1):
-        try:
-            # Rohdaten ohne Header laden
-            df_raw = pd.read_excel(file, header=None)
-
-            # Header-Zeile automatisch erkennen
-            header_row = detect_header_row(df_raw)
-
-            # Datei mit erkanntem Header einlesen
-            df = pd.read_excel(file, header=header_row)
-
-            # Ungültige Platzhalterwerte ersetzen
-            df.replace({"---": None, "": None}, inplace=True)
-
-            column_freq.update(df.columns)
-            merged_rows.extend(df.to_dict("records"))
-
-            st.success(f"{file.name}: Header in Zeile {header_row+1} erkannt.")
-
-        except Exception as e:
-            st.error(f"Fehler bei {file.name}: {e}")
-        progress.progress(idx / total)
+    # 1) Lesen (parallel je Datei) und Häufigkeit zählen
+    jobs = [(file.getvalue(),) for file in uploaded_files]
+    results = iter_parallel(
+        _read_table_file, jobs, get_worker_count(),
+        on_progress=lambda done, n: progress.progress(done / n)
+    )
+    for idx, res, err in results:
+        file = uploaded_files[idx]
+        if err is not None:
+            st.error(f"Fehler bei {file.name}: {err}")
+            continue
+        df, header_row = res
+        column_freq.update(df.columns)
+        frames.append(df)
+        st.success(f"{file.name}: Header in Zeile {header_row+1} erkannt.")
 
-    if not merged_rows:
+    if not frames:
         st.error("Keine gültigen Daten gefunden.")
         return
 
-    # 2) DataFrame erstellen mit Spalten nach Häufigkeit
+    # 2) DataFrame erstellen mit Spalten nach Häufigkeit:
+    #    jede Datei auf das gemeinsame Schema ausrichten, einmal concat
     cols_sorted = [col for col, _ in column_freq.most_common()]
-    df = pd.DataFrame(merged_rows, columns=cols_sorted)
+    df = pd.concat(
+        [f.reindex(columns=cols_sorted) for f in frames],
+        ignore_index=True
+    )
+    frames.clear()
 
     # 3) Spalten umbenennen und grundlegend bereinigen
     df = rename_columns_to_standard(df)
-    df = clean_columns_values(df, delete_enabled, custom_chars)
+    number_report = NumberFormatReport()
+    df = clean_columns_values(df, delete_enabled, custom_chars, report=number_report)
 
     # 3.1) Spalten-Reihenfolge anpassen
-    # nur master_cols fixieren, measure_cols ignorieren
-    master_cols = [
-        "Teilprojekt", "Gebäude", "Baufeld", "Geschoss",
-        "eBKP-H", "Umbaustatus", "Unter Terrain", "Beschreibung",
-        "Material", "Typ", "Name", "Ergänzung", "ING", "GUID"
-    ]
-    
-    ordered = []
-    # zuerst alle vorhandenen master_cols
-    for col in master_cols:
-        if col in df.columns:
-            ordered.append(col)
-    
-    # danach alle übrigen Spalten, aber nur falls sie im DataFrame vorkommen
-    for col in df.columns:
-        if col not in ordered:
-            ordered.append(col)
-    
-    df = df[ordered]
+    df = df[_order_columns(list(df.columns))]
 
     # 4) GUID-Duplikate erkennen
     dup_mask = None
     if "GUID" in df.columns:
-        dup_mask = df.duplicated(subset=["GUID"], keep=False)
+        dup_mask = df["GUID"].notna() & df.duplicated(subset=["GUID"], keep=False)
         dup_count = dup_mask.sum()
         if dup_count:
             st.warning(f"{dup_count} Zeilen mit doppelter GUID gefunden und markiert")
-            def highlight_dup(val):
-                return 'background-color: yellow' if val else ''
-            styled = df.style.apply(
-                lambda row: [highlight_dup(flag) for flag in dup_mask],
-                axis=1
-            )
+            render_duplicate_review(df, "GUID", key="table_dup_review")
         else:
             st.success("Keine GUID-Duplikate gefunden.")
             st.dataframe(df.head(15))
@@ -112,20 +278,15 @@ def app(supplement_name, delete_enabled, custom_chars):
         st.dataframe(df.head(15))
 
     # 5) Download mit Markierung im Excel
-    df_export = convert_quantity_columns(df.copy())
+    df_export = convert_quantity_columns(df.copy(), number_report)
+    render_number_format_report(number_report)
     out = io.BytesIO()
-    with pd.ExcelWriter(out, engine="openpyxl") as writer:
-        df_export.to_excel(writer, index=False, sheet_name=supplement_name or "Merged")
-        wb = writer.book
-        ws = wb[supplement_name or "Merged"]
-
-        if dup_mask is not None and dup_mask.any():
-            fill = PatternFill(fill_type="solid", fgColor="FFFF00")
-            for excel_row, is_dup in enumerate(dup_mask, start=2):
-                if is_dup:
-                    for col_idx in range(1, ws.max_column + 1):
-                        ws.cell(row=excel_row, column=col_idx).fill = fill
-
+    write_highlighted_excel(
+        df_export,
+        out,
+        sheet_name=supplement_name or "Merged",
+        row_mask=dup_mask if dup_mask is not None and dup_mask.any() else None
+    )
     out.seek(0)
     st.download_button(
         "Download Merged Table Excel",
@@ -2,9 +2,11 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 from excel_utils import (
+    apply_column_schema,
     detect_header_row,
     prepend_values_cleaning,
-    convert_quantity_columns
+    convert_quantity_columns,
+    write_highlighted_excel
 )
 import io
 import logging
@@ -14,9 +16,183 @@ import traceback
 logging.basicConfig(level=logging.ERROR)
 logger = logging.getLogger(__name__)
 
+# Blocking-Schluessel und Mengen fuer den Abgleich ohne GUID
+BLOCK_COLS = ["Geschoss", "eBKP-H", "Material"]
+MATCH_MEASURE_COLS = ["Volumen (m3)", "Fläche (m2)", "Länge (m)", "Dicke (m)", "Höhe (m)"]
+
+
+def _quantity_matrix(df: pd.DataFrame, measure_cols: list[str]) -> np.ndarray:
+    """Mengenspalten als float-Matrix (n, k); nicht numerisch ⇒ NaN."""
+    if not measure_cols:
+        return np.empty((len(df), 0), dtype=float)
+    return np.column_stack([
+        pd.to_numeric(df[c], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+        for c in measure_cols
+    ])
+
+
+def _pair_distance(q_new: np.ndarray, q_old: np.ndarray) -> np.ndarray:
+    """
+    Relative Mengendistanz je Kandidatenpaar (0 = identisch, 1 = komplett verschieden).
+    Mengen, die auf beiden Seiten fehlen, zaehlen nicht; fehlt eine Seite, gilt 1.
+    Ohne vergleichbare Menge wird 0.5 angenommen.
+    """
+    both_nan = np.isnan(q_new) & np.isnan(q_old)
+    one_nan = np.isnan(q_new) ^ np.isnan(q_old)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        scale = np.maximum(np.abs(q_new), np.abs(q_old))
+        rel = np.abs(q_new - q_old) / np.where(scale > 0, scale, 1.0)
+    rel = np.where(one_nan, 1.0, rel)
+    rel = np.where(both_nan, 0.0, np.minimum(rel, 1.0))
+    n_cmp = (~both_nan).sum(axis=-1)
+    dist = rel.sum(axis=-1) / np.maximum(n_cmp, 1)
+    return np.where(n_cmp > 0, dist, 0.5)
+
+
+def _tie_ranks(codes: np.ndarray, q: np.ndarray, side: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Gleichstands-Gruppen ueber Block-Code + alle Mengen (NaN gilt als Wert).
+    Rueckgabe: (Gruppen-Id, laufende Nummer je Gruppe und Seite alt/neu).
+    """
+    keys = pd.DataFrame(q).assign(_code=codes)
+    tie = keys.groupby(list(keys.columns), sort=False, dropna=False).ngroup().to_numpy()
+    within = pd.DataFrame({"tie": tie, "side": side}).groupby(["tie", "side"], sort=False).cumcount().to_numpy()
+    return tie, within
+
+
+def match_elements_without_guid(df_old: pd.DataFrame,
+                                df_new: pd.DataFrame,
+                                block_cols: list[str],
+                                measure_cols: list[str],
+                                window: int = 4,
+                                max_rounds: int = 8) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Ordnet Elemente ohne GUID einander zu (Fallback nach Revit/IFC-Roundtrip).
+
+    - Blocking: nur Elemente mit identischem Schluessel aus `block_cols`
+      (getrimmt, lower) kommen als Partner in Frage.
+    - Zuerst exakte Paare: gleicher Block und identische Mengen, in Reihenfolge
+      (k-tes neues zum k-ten alten Element).
+    - Rest: innerhalb eines Blocks sortiert nach erster vorhandener Menge, dann allen
+      Mengen der Reihe nach. Je neuem Element werden nur die `window` naechsten alten
+      Elemente links und rechts bewertet, einmal um die Position nach Mengenwert und
+      einmal um die gleiche Rangposition im Block (fuer Beinahe-Gleichstaende).
+      Aufwand O(n log n + n * window) statt O(n²).
+    - Zuordnung 1:1, gierig nach kleinster Mengendistanz in hoechstens `max_rounds` Runden.
+
+    Returns
+    -------
+    (old_pos, confidence)
+        old_pos[i]: Zeilenposition in df_old fuer Zeile i in df_new (-1 = kein Partner).
+        confidence[i]: 0..1, 1 - relative Mengendistanz (0 ohne Partner).
+    """
+    n_old, n_new = len(df_old), len(df_new)
+    old_pos = np.full(n_new, -1, dtype=np.int64)
+    confidence = np.zeros(n_new, dtype=float)
+    if n_old == 0 or n_new == 0:
+        return old_pos, confidence
+
+    # Block-Codes gemeinsam fuer alt und neu
+    keys = pd.concat([df_old[block_cols], df_new[block_cols]], ignore_index=True)
+    keys = keys.apply(lambda s: s.fillna("").astype(str).str.strip().str.lower())
+    codes = keys.groupby(block_cols, sort=False).ngroup().to_numpy(dtype=np.int64)
+    code_old, code_new = codes[:n_old], codes[n_old:]
+
+    q_old = _quantity_matrix(df_old, measure_cols)
+    q_new = _quantity_matrix(df_new, measure_cols)
+    side = np.r_[np.zeros(n_old, dtype=np.int8), np.ones(n_new, dtype=np.int8)]
+
+    # 1) Exakte Paare: gleiche Gleichstands-Gruppe und gleiche laufende Nummer
+    tie, within = _tie_ranks(codes, np.vstack([q_old, q_new]), side)
+    pair_key = pd.Series(np.arange(n_old), index=pd.MultiIndex.from_arrays([tie[:n_old], within[:n_old]]))
+    hit = pair_key.reindex(pd.MultiIndex.from_arrays([tie[n_old:], within[n_old:]])).to_numpy()
+    exact = ~np.isnan(hit)
+    exact_new = np.flatnonzero(exact)
+    exact_old = hit[exact].astype(np.int64)
+    old_pos[exact_new] = exact_old
+    confidence[exact_new] = 1.0 - _pair_distance(q_new[exact_new], q_old[exact_old])
+
+    # 2) Rest: Fenster-Suche nur ueber die noch freien Elemente
+    rest_old = np.setdiff1d(np.arange(n_old), exact_old)
+    rest_new = np.flatnonzero(~exact)
+    if rest_old.size == 0 or rest_new.size == 0:
+        return old_pos, confidence
+    code_old, code_new = code_old[rest_old], code_new[rest_new]
+    ro_q, rn_q = q_old[rest_old], q_new[rest_new]
+    r_old, r_new = rest_old.size, rest_new.size
+
+    # Sortierschluessel: Block, erste vorhandene Menge, dann alle Mengen der Reihe nach
+    q = np.vstack([ro_q, rn_q])
+    if q.shape[1]:
+        primary = q[np.arange(len(q)), (~np.isnan(q)).argmax(axis=1)]
+    else:
+        primary = np.zeros(len(q))
+    order = np.lexsort((*q.T[::-1], primary, np.r_[code_old, code_new]))
+    composite = np.empty(len(q), dtype=np.int64)
+    composite[order] = np.arange(len(q))
+    comp_old, comp_new = composite[:r_old], composite[r_old:]
+
+    order_old = np.argsort(comp_old, kind="stable")
+    comp_old_sorted = comp_old[order_old]
+    code_old_sorted = code_old[order_old]
+
+    block_lo = np.searchsorted(code_old_sorted, code_new, side="left")
+    block_hi = np.searchsorted(code_old_sorted, code_new, side="right")
+    pos = np.searchsorted(comp_old_sorted, comp_new)
+
+    # Rangposition: k-tes neues Element eines Blocks ~ entsprechend skaliertes altes Element
+    order_new = np.argsort(comp_new, kind="stable")
+    code_new_sorted = code_new[order_new]
+    new_lo = np.searchsorted(code_new_sorted, code_new, side="left")
+    new_hi = np.searchsorted(code_new_sorted, code_new, side="right")
+    rank_new = np.empty(r_new, dtype=np.int64)
+    rank_new[order_new] = np.arange(r_new)
+    rank_new -= new_lo
+    center = block_lo + (rank_new * (block_hi - block_lo)) // np.maximum(new_hi - new_lo, 1)
+
+    # Kandidaten (n_new, 4*window) innerhalb des eigenen Blocks
+    offsets = np.arange(-window, window)
+    cand = np.hstack([pos[:, None] + offsets[None, :], center[:, None] + offsets[None, :]])
+    valid = (cand >= block_lo[:, None]) & (cand < block_hi[:, None])
+    cand = np.clip(cand, 0, r_old - 1)
+    cand_old = order_old[cand]
+
+    dist = _pair_distance(rn_q[:, None, :], ro_q[cand_old])
+    dist = np.where(valid, dist, np.inf)
+
+    # Gierige 1:1-Zuordnung in Runden: je neuem Element bester freier Kandidat,
+    # Konflikte auf demselben alten Element gewinnt die kleinste Distanz.
+    taken = np.zeros(r_old, dtype=bool)
+    open_new = np.arange(r_new)
+    for _ in range(max_rounds):
+        if open_new.size == 0:
+            break
+        d = dist[open_new]
+        d = np.where(taken[cand_old[open_new]], np.inf, d)
+        best = d.argmin(axis=1)
+        best_d = d[np.arange(open_new.size), best]
+        has = np.isfinite(best_d)
+        if not has.any():
+            break
+        rows = open_new[has]
+        olds = cand_old[rows, best[has]]
+        dists = best_d[has]
+        by_dist = np.lexsort((dists, olds))
+        first = np.ones(by_dist.size, dtype=bool)
+        first[1:] = olds[by_dist][1:] != olds[by_dist][:-1]
+        win = by_dist[first]
+        old_pos[rest_new[rows[win]]] = rest_old[olds[win]]
+        confidence[rest_new[rows[win]]] = 1.0 - dists[win]
+        taken[olds[win]] = True
+        open_new = np.setdiff1d(open_new, rows[win], assume_unique=True)
+
+    return old_pos, confidence
+
+
 def app(supplement_name: str, delete_enabled: bool, custom_chars: str):
     """
     Vergleicht zwei Excel-Dateien anhand GUID, behandelt alle Spalten als Text (lower).
+    Ohne GUID: Zuordnung über Geschoss + eBKP-H + Material und naechste Mengen (mit Konfidenz).
     Gibt neue Datei mit farblicher Hervorhebung zurück: graue Zeilen, gelbe Zellen.
     Zeigt Fortschritt und aktuelle Zeileneinträge.
     Fehler werden geloggt und dem Nutzer angezeigt.
@@ -49,14 +225,24 @@ def app(supplement_name: str, delete_enabled: bool, custom_chars: str):
         def load_and_clean(file, name):
             raw = pd.read_excel(file, sheet_name=name, header=None, engine="openpyxl")
             hdr = detect_header_row(raw)
-            df = pd.read_excel(file, sheet_name=name, header=hdr, engine="openpyxl")
+            df = apply_column_schema(pd.read_excel(file, sheet_name=name, header=hdr, engine="openpyxl"))
             return prepend_values_cleaning(df, delete_enabled, custom_chars)
 
         df_old = load_and_clean(old_file, sheet)
         df_new = load_and_clean(new_file, sheet)
-        if "GUID" not in df_old.columns or "GUID" not in df_new.columns:
-            st.error("Spalte 'GUID' nicht in beiden Tabellen gefunden.")
-            return
+        use_guid = "GUID" in df_old.columns and "GUID" in df_new.columns
+        if not use_guid:
+            block_cols = [c for c in BLOCK_COLS if c in df_old.columns and c in df_new.columns]
+            if not block_cols:
+                st.error(
+                    "Spalte 'GUID' nicht in beiden Tabellen gefunden und keine Blocking-Spalten "
+                    f"({', '.join(BLOCK_COLS)}) für den Abgleich ohne GUID vorhanden."
+                )
+                return
+            st.warning(
+                "Spalte 'GUID' nicht in beiden Tabellen gefunden. "
+                f"Elemente werden über {', '.join(block_cols)} und Mengen zugeordnet."
+            )
 
         # Definierte Spalten
         master_cols = [
@@ -73,11 +259,31 @@ def app(supplement_name: str, delete_enabled: bool, custom_chars: str):
             st.error("Keine gemeinsamen Spalten zum Vergleichen gefunden.")
             return
 
-        # Merge DataFrames auf GUID
-        df_cmp = df_new.merge(
-            df_old[['GUID'] + compare],
-            on='GUID', how='left', suffixes=('', '_old')
-        )
+        if use_guid:
+            # Merge DataFrames auf GUID
+            df_cmp = df_new.merge(
+                df_old[['GUID'] + compare],
+                on='GUID', how='left', suffixes=('', '_old')
+            )
+        else:
+            # Fallback: Zuordnung ueber Blocking-Schluessel + naechste Mengen
+            measure_match = [c for c in MATCH_MEASURE_COLS if c in df_old.columns and c in df_new.columns]
+            status_match = st.empty()
+            status_match.text("Ordne Elemente ohne GUID zu ...")
+            old_pos, conf = match_elements_without_guid(df_old, df_new, block_cols, measure_match)
+            status_match.empty()
+
+            old_part = df_old[compare].reset_index(drop=True).reindex(old_pos)
+            old_part.columns = [f"{c}_old" for c in compare]
+            df_new = df_new.reset_index(drop=True)
+            df_new["Match-Konfidenz"] = np.round(conf, 3)
+            df_cmp = pd.concat([df_new, old_part.reset_index(drop=True)], axis=1)
+
+            matched = old_pos >= 0
+            m1, m2, m3 = st.columns(3)
+            m1.metric("Zugeordnet", int(matched.sum()))
+            m2.metric("Ohne Partner (neu)", int((~matched).sum()))
+            m3.metric("Ø Konfidenz", f"{conf[matched].mean():.2f}" if matched.any() else "–")
 
         nrows = len(df_cmp)
         diffs = np.zeros((nrows, len(compare)), dtype=bool)
@@ -91,36 +297,24 @@ def app(supplement_name: str, delete_enabled: bool, custom_chars: str):
             diffs[:, j] = new_series != old_series
         row_mask = diffs.any(axis=1)
 
-        # Excel-Ausgabe mit XlsxWriter (nan_inf_to_errors aktiviert)
+        # Excel-Ausgabe: graue Zeilen, gelbe Zellen direkt beim Schreiben
+        df_export = convert_quantity_columns(df_new.copy())
+        col_idx = {col: idx for idx, col in enumerate(df_export.columns)}
+        cell_mask = np.zeros((nrows, len(df_export.columns)), dtype=bool)
+        for j, col in enumerate(compare):
+            cell_mask[:, col_idx[col]] = diffs[:, j]
+        status.text(f"Schreibe {nrows} Zeilen mit Markierungen ...")
         buffer = io.BytesIO()
-        writer = pd.ExcelWriter(
+        write_highlighted_excel(
+            df_export,
             buffer,
-            engine='xlsxwriter',
-            engine_kwargs={'options': {'nan_inf_to_errors': True}}
+            sheet_name=sheet,
+            row_mask=row_mask,
+            cell_mask=cell_mask,
+            row_color="#DDDDDD",
+            cell_color="#FFFF00"
         )
-        df_export = convert_quantity_columns(df_new.copy())
-        with writer:
-            df_export.to_excel(writer, sheet_name=sheet, index=False)
-            workbook = writer.book
-            worksheet = writer.sheets[sheet]
-
-            grey = workbook.add_format({'bg_color': '#DDDDDD'})
-            yellow = workbook.add_format({'bg_color': '#FFFF00'})
-            col_idx = {col: idx for idx, col in enumerate(df_new.columns)}
-
-            # Zeilen und Zellen formatieren
-            for i, changed in enumerate(row_mask, start=1):
-                status.text(f"Verarbeite Zeile {i}/{nrows}")
-                if changed:
-                    worksheet.set_row(i, None, grey)
-                    for j, col in enumerate(compare):
-                        if diffs[i-1, j]:
-                            colnum = col_idx[col]
-                            val = df_new.iat[i-1, colnum]
-                            if not isinstance(val, (int, float, str, bool)):
-                                val = str(val)
-                            worksheet.write(i, colnum, val, yellow)
-            status.text("Fertig mit Formatierung.")
+        status.text("Fertig mit Formatierung.")
 
         buffer.seek(0)
         filename = f"vergleich_{supplement_name or sheet}.xlsx"
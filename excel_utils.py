@@ -1,6 +1,26 @@
 import pandas as pd
+import numpy as np
 import streamlit as st
 import re
+import openpyxl
+import xlsxwriter
+import multiprocessing
+import contextvars
+import hashlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from ito_schema import load_ito_templates
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet-Ausgabe optional
+    pa = None
+    pc = None
+    pq = None
 
 # Preset für Mengenspalten
 COLUMN_PRESET = {
@@ -11,6 +31,72 @@ COLUMN_PRESET = {
     "Höhe (m)":    ["Höhe", "Hoehe", "Höhe BQ", "Höhe Solibri"]
 }
 
+# Typ-Registry bekannter Solibri-Spalten (Roh- und Standardnamen)
+# "text": wenige Auspraegungen, "guid": eindeutige IDs, "measure": Mengen in m/m2/m3
+_TEXT_COLUMNS = [
+    "Teilprojekt", "Gebäude", "Gebaeude", "Baufeld", "Geschoss", "Unter Terrain",
+    "eBKP-H", "Umbaustatus", "Material", "Typ", "Beschreibung", "ING",
+]
+COLUMN_SCHEMA = {
+    **{c: "text" for c in _TEXT_COLUMNS},
+    **{f"{c} Sub": "text" for c in _TEXT_COLUMNS},
+    "GUID": "guid", "GUID Sub": "guid", "GUID Gruppe": "guid",
+    **{c: "measure" for std, aliases in COLUMN_PRESET.items() for c in [std, *aliases]},
+    **{f"{c} Sub": "measure" for aliases in COLUMN_PRESET.values() for c in aliases},
+}
+
+# Arrow-Strings (kompakt, schnelle .str-Operationen), sonst Python-Strings
+_STRING_DTYPE = pd.StringDtype("pyarrow" if pa is not None else "python")
+SCHEMA_DTYPES = {"text": _STRING_DTYPE, "guid": _STRING_DTYPE, "measure": np.dtype("float64")}
+# object-Spalten aus reinen Zahlen (z. B. aus read-only Zeilen gebaut)
+_NUMERIC_INFERRED = ("integer", "floating", "mixed-integer-float", "decimal")
+
+
+def apply_column_schema(df: pd.DataFrame, schema: dict = None) -> pd.DataFrame:
+    """
+    Setzt die dtypes aus COLUMN_SCHEMA direkt nach dem Einlesen (in place, gibt df zurueck).
+    Fuer die Leser, die Spalten nur lesen (Merge zu Tabelle/Master/Flow, Spalten-Merger,
+    Vergleich); Vererbung/Mehrschichtig bleiben untypisiert, da sie Werte zurueckschreiben
+    und jede Zuweisung in String-Spalten validiert wird (dort langsamer als object).
+    Passt der Header zu einer ITO-Vorlage, gilt deren vorberechnetes Schema.
+    - text/guid ⇒ String-dtype, aber nur wenn alle Werte Strings sind
+    - measure ⇒ float64, wenn die Spalte numerisch ist oder nur Zahlen enthaelt
+      (Texte mit Einheiten parsen weiterhin convert_size_to_m / coalesce_measures)
+    Spalten, die nicht passen, bleiben unveraendert.
+    """
+    if schema is None:
+        template = match_ito_template(df.columns)
+        schema = template.dtypes if template is not None else COLUMN_SCHEMA
+    for j, col in enumerate(df.columns):
+        kind = schema.get(col)
+        if kind is None:
+            continue
+        s = df.iloc[:, j]
+        target = SCHEMA_DTYPES[kind]
+        if s.dtype == target:
+            continue
+        if kind == "measure":
+            if pd.api.types.is_bool_dtype(s.dtype):
+                continue
+            if pd.api.types.is_numeric_dtype(s.dtype):
+                df.isetitem(j, s.to_numpy(dtype="float64", na_value=np.nan))
+            elif s.dtype == object and pd.api.types.infer_dtype(s, skipna=True) in _NUMERIC_INFERRED:
+                df.isetitem(j, pd.to_numeric(s).to_numpy(dtype="float64", na_value=np.nan))
+        elif s.dtype == object and pd.api.types.infer_dtype(s, skipna=True) in ("string", "empty"):
+            df.isetitem(j, s.astype(target))
+    return df
+
+
+def _size_unit_factor(unit: str) -> float:
+    """Faktor nach m/m2/m3 fuer mm, cm, dm, m mit optionaler Potenz (z. B. 'cm2')."""
+    unit = unit.lower()
+    if unit.endswith(("2", "3")):
+        base, exp = unit[:-1], int(unit[-1])
+    else:
+        base, exp = unit, 1
+    return {"mm": 0.001, "cm": 0.01, "dm": 0.1, "m": 1}[base] ** exp
+
+
 def convert_size_to_m(x):
     """
     Wandelt Strings mit Einheiten (mm, cm, dm, m sowie mm2, cm2, dm2, m2, mm3, cm3, dm3, m3)
@@ -27,17 +113,16 @@ def convert_size_to_m(x):
     )
     if m:
         num_str, unit = m.groups()
-        num = float(num_str.replace(",", "."))
-        # Neu: bei num == 0 direkt None
-        if num == 0:
-            return pd.NA
-        unit = unit.lower()
-        if unit.endswith(("2", "3")):
-            base, exp = unit[:-1], int(unit[-1])
-        else:
-            base, exp = unit, 1
-        factor = {"mm": 0.001, "cm": 0.01, "dm": 0.1, "m": 1}[base] ** exp
-        return num * factor
+        try:
+            num = float(num_str.replace(",", "."))
+        except ValueError:
+            # z. B. '1.234,5 m': unten als ungueltiges Format melden
+            num = None
+        if num is not None:
+            # Neu: bei num == 0 direkt None
+            if num == 0:
+                return pd.NA
+            return num * _size_unit_factor(unit)
 
     # 1) Einheit hinten (falls vorhanden) abtrennen und Dezimal vereinheitlichen
     s1 = s.replace("\xa0", " ").strip()
@@ -57,16 +142,303 @@ def convert_size_to_m(x):
         val = float(cleaned)
         return pd.NA if val == 0 else val
     except Exception:
-        st.warning(f"Ungültiges Format in Zelle: '{s}'")
+        show_warning(f"Ungültiges Format in Zelle: '{s}'")
         return pd.NA
 
 
+def _parse_num(x):
+    """Zahl aus Text mit Tausender-/Dezimalzeichen und Einheit (ohne Umrechnung); leer ⇒ NaN."""
+    if pd.isna(x):
+        return np.nan
+    s = str(x).strip()
+    if s == "":
+        return np.nan
+
+    # Tausenderzeichen entfernen, Dezimal vereinheitlichen
+    s = s.replace("\xa0", "").replace(" ", "").replace("’", "").replace("'", "")
+    if "," in s and "." in s:
+        if s.rfind(",") > s.rfind("."):
+            s = s.replace(".", "").replace(",", ".")
+        else:
+            s = s.replace(",", "")
+    else:
+        if "," in s:
+            s = s.replace(",", ".")
+
+    # Einheiten am Ende entfernen (verhindert 'E-43' durch 'm3')
+    s = re.sub(r"(mm2|cm2|dm2|m2|mm3|cm3|dm3|m3|mm|cm|dm|m|qm|cbm|lm|lfm|kg|t|stk|stueck|stück|l)$",
+               "", s, flags=re.IGNORECASE)
+
+    # Direktversuch: unterstützt 1.23E-4
+    try:
+        return float(s)
+    except ValueError:
+        pass
+
+    # Fallback: harte Bereinigung, Exponenten zulassen
+    s = re.sub(r"[^0-9eE\.\+\-]", "", s)
+    try:
+        return float(s) if s not in ("", "-", ".", "+", "e", "E") else np.nan
+    except ValueError:
+        return np.nan
+
+
+# ========= Zahlenformat je Spalte: Profil ⇒ vektorisiertes Parsen =========
+# Einheiten, die convert_size_to_m umrechnet ("size") bzw. _parse_num nur abschneidet ("number")
+_SIZE_UNITS = ["mm2", "cm2", "dm2", "m2", "mm3", "cm3", "dm3", "m3", "mm", "cm", "dm", "m"]
+_NUMBER_UNITS = _SIZE_UNITS + ["qm", "cbm", "lm", "lfm", "kg", "t", "stk", "stueck", "stück", "l"]
+_UNIT_SUFFIX_RE = re.compile(r"(?i)[0-9 ]([a-zäöü]+[23]?)$")
+_PROFILE_SAMPLE = 256
+
+
+@dataclass(frozen=True)
+class NumberFormat:
+    """
+    Zahlenformat einer Mengenspalte, z. B. 1'234.5 m2: Dezimal- und Tausenderzeichen,
+    Einheit und Faktor nach m/m2/m3. `mode` legt die Semantik fest:
+    "size" wie convert_size_to_m (umrechnen, 0 ⇒ leer), "number" wie _parse_num.
+    """
+    mode: str
+    decimal: str = "."
+    thousands: str = ""
+    unit: str = ""
+
+    @property
+    def factor(self) -> float:
+        return _size_unit_factor(self.unit) if self.mode == "size" and self.unit else 1.0
+
+    @property
+    def pattern(self) -> str:
+        """
+        Regex (eine Gruppe: Zahl) fuer Zellen, die exakt so geparst werden wie vom
+        langsamen Pfad. Alles andere faellt auf convert_size_to_m / _parse_num zurueck.
+        """
+        d, t = re.escape(self.decimal), re.escape(self.thousands)
+        if not self.thousands:
+            num = rf"[0-9]+(?:{d}[0-9]+)?"
+        elif self.thousands in ".,":
+            # _parse_num liest ein einzelnes '.'/',' immer als Dezimalzeichen
+            num = rf"[0-9]{{1,3}}(?:{t}[0-9]{{3}})+{d}[0-9]+|[0-9]+(?:{d}[0-9]+)?"
+        else:
+            num = rf"[0-9]{{1,3}}(?:{t}[0-9]{{3}})*(?:{d}[0-9]+)?"
+        unit = rf" *(?i:{re.escape(self.unit)})" if self.unit else ""
+        return rf"^(?P<num>{num}){unit}$"
+
+    def __str__(self) -> str:
+        example = f"1{self.thousands}234{self.decimal}5" if self.thousands else f"1234{self.decimal}5"
+        return f"{example} {self.unit}".strip()
+
+
+def _format_candidates(samples: list, mode: str) -> list:
+    units = _SIZE_UNITS if mode == "size" else _NUMBER_UNITS
+    found = pd.Series([m.group(1).lower() for v in samples if (m := _UNIT_SUFFIX_RE.search(v))])
+    unit_options = [u for u in found.value_counts().index if u in units][:3] + [""]
+    # convert_size_to_m kennt nur ' ’ und Leerzeichen als Tausenderzeichen, und nur ohne Umrechnung
+    thousands = ["", "'", "’", " "] if mode == "size" else ["", "'", "’", " ", ".", ","]
+    candidates = []
+    for unit in unit_options:
+        for dec in (".", ","):
+            for th in thousands:
+                if th == dec:
+                    continue
+                fmt = NumberFormat(mode, dec, th, unit)
+                if mode == "size" and th and fmt.factor != 1:
+                    continue
+                candidates.append(fmt)
+    return candidates
+
+
+def profile_number_format(values, mode: str = "size") -> "NumberFormat | None":
+    """
+    Bestimmt aus einer Stichprobe (gleichmaessig verteilt, max. 256 Texte) das Format,
+    das die meisten Zellen exakt beschreibt. Keine passende Zelle ⇒ None.
+    """
+    values = [v for v in values if isinstance(v, str)]
+    if len(values) > _PROFILE_SAMPLE:
+        idx = np.linspace(0, len(values) - 1, _PROFILE_SAMPLE).astype(int)
+        values = [values[i] for i in idx]
+    values = [v.strip() for v in values if v.strip()]
+    if not values:
+        return None
+    best, best_hits = None, 0
+    for fmt in _format_candidates(values, mode):
+        regex = re.compile(fmt.pattern)
+        hits = sum(1 for v in values if regex.match(v))
+        if hits > best_hits:
+            best, best_hits = fmt, hits
+    return best
+
 
-def convert_quantity_columns(df: pd.DataFrame) -> pd.DataFrame:
+class NumberFormatReport:
+    """
+    Sammelt je Spalte das erkannte Format, die Anzahl vektorisiert geparster Zellen
+    und die Texte, die dem Format nicht entsprachen (einzeln geparst). Chunk-faehig.
+    """
+
+    def __init__(self, max_examples: int = 5):
+        self.max_examples = max_examples
+        self.columns = {}
+
+    def add(self, column, fmt, n_fast: int, fallback) -> None:
+        entry = self.columns.setdefault(
+            column, {"Format": None, "Vektorisiert": 0, "Einzeln": 0, "Beispiele": []}
+        )
+        if fmt is not None and entry["Format"] is None:
+            entry["Format"] = str(fmt)
+        entry["Vektorisiert"] += int(n_fast)
+        entry["Einzeln"] += len(fallback)
+        for v in fallback:
+            if len(entry["Beispiele"]) >= self.max_examples:
+                break
+            if v not in entry["Beispiele"]:
+                entry["Beispiele"].append(v)
+
+    @property
+    def n_fallback(self) -> int:
+        return sum(e["Einzeln"] for e in self.columns.values())
+
+    def frame(self) -> pd.DataFrame:
+        rows = [
+            {"Spalte": col, **{**e, "Beispiele": ", ".join(map(repr, e["Beispiele"]))}}
+            for col, e in self.columns.items()
+        ]
+        return pd.DataFrame(rows, columns=["Spalte", "Format", "Vektorisiert", "Einzeln", "Beispiele"])
+
+
+def _extract_numbers(texts: np.ndarray, fmt: NumberFormat) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Vektorisiert: Maske der Texte, die fmt.pattern erfuellen, und deren Zahlenwerte
+    (ohne Faktor). Mit pyarrow per Arrow-Kernel, sonst ueber pandas .str.
+    """
+    if pc is not None:
+        # nur ASCII-Whitespace trimmen (str.strip trimmt mindestens diese)
+        arr = pc.utf8_trim(pa.array(texts, type=pa.string()), characters=" \t\n\r\x0b\x0c")
+        num = pc.struct_field(pc.extract_regex(arr, fmt.pattern), [0])
+        ok = pc.is_valid(num).to_numpy(zero_copy_only=False)
+        num = num.filter(ok)
+        if fmt.thousands:
+            num = pc.replace_substring(num, fmt.thousands, "")
+        if fmt.decimal != ".":
+            num = pc.replace_substring(num, fmt.decimal, ".")
+        return ok, pc.cast(num, pa.float64()).to_numpy(zero_copy_only=False)
+    num = pd.Series(texts, dtype=object).str.strip().str.extract(fmt.pattern, expand=False)
+    ok = num.notna().to_numpy(dtype=bool)
+    num = num[ok]
+    if fmt.thousands:
+        num = num.str.replace(fmt.thousands, "", regex=False)
+    if fmt.decimal != ".":
+        num = num.str.replace(fmt.decimal, ".", regex=False)
+    return ok, num.astype("float64").to_numpy()
+
+
+def parse_profiled(s: pd.Series, mode: str = "size", report: NumberFormatReport = None):
+    """
+    Parst die Text-Zellen einer Mengenspalte vektorisiert nach ihrem profilierten Format.
+
+    Returns
+    -------
+    (values, fast)
+        float64-Array (Faktor angewendet, sonst NaN) und Maske der so geparsten Zellen.
+        Alle anderen Zellen (Zahlen, NA, abweichende Texte) parst der Aufrufer einzeln.
+    """
+    n = len(s)
+    values = np.full(n, np.nan)
+    fast = np.zeros(n, dtype=bool)
+    if not _is_text_column(s) or n == 0:
+        return values, fast
+    raw = s.to_numpy(dtype=object)
+    is_str = np.fromiter((isinstance(v, str) for v in raw), dtype=bool, count=n)
+    if not is_str.any():
+        return values, fast
+    fmt = profile_number_format(raw[is_str], mode)
+    if fmt is not None:
+        ok, numbers = _extract_numbers(raw[is_str], fmt)
+        rows = np.flatnonzero(is_str)[ok]
+        values[rows] = numbers * fmt.factor
+        fast[rows] = True
+    if report is not None:
+        report.add(s.name, fmt, fast.sum(), raw[is_str & ~fast].tolist())
+    return values, fast
+
+
+# Hierarchie-Schluessel der Tools ⇒ Standardname aus COLUMN_PRESET
+MEASURE_TO_STANDARD = {
+    "Flaeche": "Fläche (m2)",
+    "Volumen": "Volumen (m3)",
+    "Laenge":  "Länge (m)",
+    "Dicke":   "Dicke (m)",
+    "Hoehe":   "Höhe (m)"
+}
+
+
+def parse_quantity_column(s: pd.Series, report: NumberFormatReport = None) -> np.ndarray:
+    """
+    Parst eine Mengenspalte einmal zu float64 (Meter bzw. m2/m3).
+    Numerische Spalten direkt; Texte im profilierten Spaltenformat vektorisiert,
+    der Rest per convert_size_to_m je eindeutigem Wert.
+    0 und ungueltige Werte ⇒ NaN.
+    """
+    if pd.api.types.is_numeric_dtype(s.dtype) and not pd.api.types.is_bool_dtype(s.dtype):
+        arr = s.to_numpy(dtype="float64", na_value=np.nan, copy=True)
+    else:
+        arr, fast = parse_profiled(s, "size", report)
+        rest = ~fast
+        if rest.any():
+            codes, uniques = pd.factorize(s[rest], use_na_sentinel=True)
+            parsed = np.array(
+                [convert_size_to_m(u) for u in uniques], dtype=object
+            )
+            parsed = pd.array(parsed, dtype="Float64").to_numpy(dtype="float64", na_value=np.nan)
+            arr[rest] = np.where(codes >= 0, parsed[codes] if len(parsed) else np.nan, np.nan)
+    arr[arr == 0] = np.nan
+    return arr
+
+
+def coalesce_measures(df: pd.DataFrame, hierarchies: dict, report: NumberFormatReport = None) -> pd.DataFrame:
+    """
+    Fuehrt je Mass die Quellspalten in Hierarchie-Reihenfolge zusammen:
+    erster gueltiger Wert (nicht leer, nicht 0) pro Zeile.
+
+    hierarchies: {measure: [spalten...]}, measure als Tool-Schluessel ("Flaeche")
+    oder direkt als Standardname ("Fläche (m2)").
+    Jede Quellspalte wird genau einmal geparst, die Auswahl erfolgt in einem
+    NumPy-Durchlauf ueber die gestapelten Arrays.
+
+    Returns
+    -------
+    DataFrame (Index wie df) mit einer float64-Spalte pro Mass mit Hierarchie.
+    """
+    parsed = {}
+    result = {}
+    n = len(df)
+    for measure, cols in hierarchies.items():
+        if not cols:
+            continue
+        arrays = []
+        for c in cols:
+            if c not in df.columns:
+                continue
+            if c not in parsed:
+                parsed[c] = parse_quantity_column(df[c], report)
+            arrays.append(parsed[c])
+        if arrays:
+            stack = np.column_stack(arrays)
+            valid = ~np.isnan(stack)
+            first = valid.argmax(axis=1)
+            merged = stack[np.arange(n), first]
+            merged[~valid.any(axis=1)] = np.nan
+        else:
+            merged = np.full(n, np.nan)
+        result[MEASURE_TO_STANDARD.get(measure, measure)] = merged
+    return pd.DataFrame(result, index=df.index)
+
+
+def convert_quantity_columns(df: pd.DataFrame, report: NumberFormatReport = None) -> pd.DataFrame:
     """
     Findet typische Mengenspalten (m, m2, m3, Stk., Stück, kg, lm, lfm, qm, cbm, cm, dm, Menge, Anzahl)
-    anhand des Spaltennamens und konvertiert deren Werte robust zu float.
+    anhand des Spaltennamens und konvertiert deren Werte robust zu float64 (leer ⇒ NaN).
     Handhabt Tausendertrennzeichen (., ', Leerzeichen) und Dezimaltrennzeichen (., ,).
+    Texte im profilierten Spaltenformat werden vektorisiert geparst, der Rest per _parse_num.
     """
     unit_patterns = [
         r"\bmenge\b", r"\banzahl\b",
@@ -78,96 +450,183 @@ def convert_quantity_columns(df: pd.DataFrame) -> pd.DataFrame:
     ]
     unit_regex = re.compile("|".join(unit_patterns), flags=re.IGNORECASE)
 
-    def parse_num(x):
-        if pd.isna(x):
-            return pd.NA
-        s = str(x).strip()
-        if s == "":
-            return pd.NA
-    
-        # Tausenderzeichen entfernen, Dezimal vereinheitlichen
-        s = s.replace("\xa0", "").replace(" ", "").replace("’", "").replace("'", "")
-        if "," in s and "." in s:
-            if s.rfind(",") > s.rfind("."):
-                s = s.replace(".", "").replace(",", ".")
-            else:
-                s = s.replace(",", "")
+    target_cols = [c for c in df.columns if unit_regex.search(str(c).lower())]
+    for c in target_cols:
+        s = df[c]
+        if pd.api.types.is_numeric_dtype(s.dtype) and not pd.api.types.is_bool_dtype(s.dtype):
+            # bereits numerisch (z. B. per COLUMN_SCHEMA): nur nach float64
+            df[c] = s.to_numpy(dtype="float64", na_value=np.nan)
         else:
-            if "," in s:
-                s = s.replace(",", ".")
-    
-        # Einheiten am Ende entfernen (verhindert 'E-43' durch 'm3')
-        s = re.sub(r"(mm2|cm2|dm2|m2|mm3|cm3|dm3|m3|mm|cm|dm|m|qm|cbm|lm|lfm|kg|t|stk|stueck|stück|l)$",
-                   "", s, flags=re.IGNORECASE)
-    
-        # Direktversuch: unterstützt 1.23E-4
-        try:
-            return float(s)
-        except ValueError:
-            pass
-    
-        # Fallback: harte Bereinigung, Exponenten zulassen
-        s = re.sub(r"[^0-9eE\.\+\-]", "", s)
+            values, fast = parse_profiled(s, "number", report)
+            if not fast.all():
+                values[~fast] = s[~fast].map(_parse_num).to_numpy(dtype="float64")
+            df[c] = values
+    return df
+
+
+
+# Tokens, die beim Einlesen aus Textzellen entfernt werden (Einheiten, Platzhalter)
+UNWANTED_TOKENS = [" m2", " m3", " m", "Nicht klassifiziert", "---"]
+
+
+def unwanted_tokens_pattern(delete_enabled: bool = False, custom_chars: str = "") -> re.Pattern:
+    """
+    Ein vorkompiliertes Muster fuer UNWANTED_TOKENS plus optionale Zusatzzeichen.
+    Alternativen in Listenreihenfolge, d. h. ' m2' wird vor ' m' versucht.
+    """
+    tokens = list(UNWANTED_TOKENS)
+    if delete_enabled and custom_chars.strip():
+        tokens.extend(x.strip() for x in custom_chars.split(",") if x.strip())
+    return re.compile("|".join(re.escape(t) for t in tokens))
+
+
+def _is_text_column(s: pd.Series) -> bool:
+    """Nur Spalten, die Strings enthalten koennen (object / string dtype)."""
+    return pd.api.types.is_object_dtype(s.dtype) or pd.api.types.is_string_dtype(s.dtype)
+
+
+def remove_unwanted_tokens(df: pd.DataFrame, pattern: re.Pattern) -> pd.DataFrame:
+    """
+    Entfernt `pattern` einmal pro Spalte aus allen Textzellen.
+    Nicht-Text-Zellen (Zahlen, Datumswerte, None) bleiben unveraendert.
+    """
+    for col in df.columns:
+        s = df[col]
+        if not _is_text_column(s):
+            continue
         try:
-            return float(s) if s not in ("", "-", ".", "+", "e", "E") else pd.NA
-        except ValueError:
+            replaced = s.str.replace(pattern, "", regex=True)
+        except AttributeError:
+            # object-Spalte ohne einen einzigen String
+            continue
+        df[col] = replaced.where(replaced.notna(), s)
+    return df
+
+
+# Platzhalter, die beim Bereinigen zu NA werden (alle Spalten bzw. nur einzelne)
+VALUE_PLACEHOLDERS = {"Nicht klassifiziert": pd.NA, "<Nicht definiert>": pd.NA}
+COLUMN_PLACEHOLDERS = {"Unter Terrain": {"oi": pd.NA}}
+# Nach dem Loeschen von Zusatzzeichen als leer gewertet
+_BLANK_VALUES = ["", "0", "0.0"]
+
+
+def _custom_chars(custom_chars: str) -> list:
+    """Kommagetrennte Zusatzzeichen, eindeutig und laengste zuerst (fuer ein Regex-Muster)."""
+    return sorted({c.strip() for c in custom_chars.split(",") if c.strip()}, key=len, reverse=True)
+
+
+def _clean_text_values(s: pd.Series, placeholders: list, chars: list, blank_to_na: bool) -> pd.Series:
+    """
+    Ein Durchgang ueber die String-Zellen einer Spalte: Platzhalter ⇒ NA,
+    Zusatzzeichen loeschen, leer/'0' ⇒ NA. Andere Zellen bleiben unveraendert.
+    """
+    if not chars and not blank_to_na:
+        # nur Platzhalter: ein isin reicht (auch fuer gemischte Spalten)
+        na = s.isin(placeholders).to_numpy(dtype=bool)
+        return s.mask(na, pd.NA) if na.any() else s
+
+    pattern = "|".join(map(re.escape, chars))
+    if s.dtype != object:
+        # String-dtype: vektorisiert (Arrow-Kernel mit Muster als Text)
+        na = s.isin(placeholders).to_numpy(dtype=bool)
+        if chars:
+            s = s.str.replace(pattern, "", regex=True)
+        if blank_to_na:
+            na |= s.str.strip().isin(_BLANK_VALUES).to_numpy(dtype=bool)
+        return s.mask(na, pd.NA) if na.any() else s
+
+    # object: nur die eindeutigen Strings bereinigen (Solibri-Texte haben wenige Auspraegungen)
+    ph = set(placeholders)
+    blanks = set(_BLANK_VALUES) if blank_to_na else ()
+    if not chars:
+        remove = None
+    elif all(len(c) == 1 for c in chars):
+        # nur Einzelzeichen: Uebersetzungstabelle statt Regex
+        table = str.maketrans("", "", "".join(chars))
+        remove = lambda v: v.translate(table)
+    else:
+        regex = re.compile(pattern)
+        remove = lambda v: regex.sub("", v)
+
+    def clean(v):
+        if not isinstance(v, str):
+            return v
+        if v in ph:
             return pd.NA
+        if remove is not None:
+            v = remove(v)
+        return pd.NA if v.strip() in blanks else v
 
+    values = s.to_numpy()
+    codes, uniques = pd.factorize(values)
+    uniques = np.asarray(uniques, dtype=object)
+    is_str = np.fromiter((isinstance(u, str) for u in uniques), dtype=bool, count=len(uniques))
+    if not is_str.any():
+        return s
+    rows = (codes >= 0) & is_str[codes]
+    cleaned = np.empty(len(uniques), dtype=object)
+    cleaned[:] = [clean(u) for u in uniques]
+    out = values.copy()
+    out[rows] = cleaned[codes[rows]]
+    return pd.Series(out, index=s.index, name=s.name, dtype=object)
 
-    target_cols = [c for c in df.columns if unit_regex.search(str(c).lower())]
-    for c in target_cols:
-        df[c] = df[c].map(parse_num).astype("Float64")
-    return df
 
+def _convert_size_column(s: pd.Series, report: NumberFormatReport = None) -> pd.Series:
+    """
+    Wie s.apply(convert_size_to_m), aber Texte im profilierten Format vektorisiert.
+    Ergebnis wie bei apply: float64 ohne Luecken, sonst object mit pd.NA.
+    """
+    values, fast = parse_profiled(s, "size", report)
+    if not fast.any():
+        return s.apply(convert_size_to_m)
+    out = values.astype(object)
+    out[fast & (values == 0)] = pd.NA
+    if not fast.all():
+        out[~fast] = s[~fast].apply(convert_size_to_m).to_numpy(dtype=object)
+    return pd.Series(out, index=s.index, name=s.name).infer_objects()
 
 
 def clean_columns_values(df: pd.DataFrame,
                          delete_enabled: bool = False,
-                         custom_chars: str = "") -> pd.DataFrame:
-    """
-    1) 'Nicht klassifiziert' ⇒ None
-    2) Nur Spalten aus COLUMN_PRESET keys: Einheitserkennung & Konvertierung
-    3) Ganze 0-Werte ⇒ None
-    4) Zusätzliche Zeichen (kommagetrennt) löschen, falls aktiviert
-    5) Warnung bei komplett leeren Mengenspalten
-    """
-    # 1)
-    df = df.replace("Nicht klassifiziert", pd.NA).replace("<Nicht definiert>", pd.NA)          
-
-    # 1.1) Spalten mit Farbangaben löschen
-    for drop_col in ("Farbe", "Color"):
-        if drop_col in df.columns:
-            df.drop(columns=drop_col, inplace=True)
-
-     # 'oi' in "Unter Terrain" ⇒ None
-    if "Unter Terrain" in df.columns:
-        df.loc[df["Unter Terrain"] == "oi", "Unter Terrain"] = pd.NA
-
-    # 2) Konvertierung nur für die Standard-Mengenspalten
-    preset_cols = [col for col in COLUMN_PRESET.keys() if col in df.columns]
-    empty_cols = []
-    for col in preset_cols:
-        df[col] = df[col].apply(convert_size_to_m)
-        # 3) Null-Werte
-        df[col] = df[col].mask(df[col] == 0, pd.NA)
-        if df[col].isna().all():
-            empty_cols.append(col)
-
-    # 4) Optional: Zusätzliche Zeichen löschen
-    if delete_enabled and custom_chars:
-        chars = [c.strip() for c in custom_chars.split(",") if c.strip()]
-        for col in df.columns:
-            if df[col].dtype == object:
-                for ch in chars:
-                    df[col] = df[col].str.replace(ch, "", regex=False)
-                df[col] = df[col].mask(
-                    df[col].str.strip().isin(["", "0", "0.0"]),
-                    pd.NA
-                )
+                         custom_chars: str = "",
+                         warn_empty: bool = True,
+                         report: NumberFormatReport = None) -> pd.DataFrame:
+    """
+    Ein Durchgang je Spalte (Eingabe bleibt unveraendert):
+    1) Platzhalter ('Nicht klassifiziert', '<Nicht definiert>', 'oi' in "Unter Terrain") ⇒ NA
+    2) Nur Spalten aus COLUMN_PRESET keys: Einheitserkennung & Konvertierung, 0 ⇒ NA
+    3) Zusätzliche Zeichen (kommagetrennt) löschen, falls aktiviert; danach leer/'0' ⇒ NA
+       (nur String-Zellen, Zahlen in gemischten Spalten bleiben erhalten)
+    4) Warnung bei komplett leeren Mengenspalten (abschaltbar fuer Chunks)
+    Spalten mit Farbangaben werden entfernt.
+    """
+    df = df.drop(columns=[c for c in ("Farbe", "Color") if c in df.columns])
+
+    blank_to_na = bool(delete_enabled and custom_chars)
+    chars = _custom_chars(custom_chars) if blank_to_na else []
+    empty = set()
+    for j, col in enumerate(df.columns):
+        s = df.iloc[:, j]
+        placeholders = list({**VALUE_PLACEHOLDERS, **COLUMN_PLACEHOLDERS.get(col, {})})
+        if col in COLUMN_PRESET:
+            # 1) + 2) Platzhalter vor dem Parsen entfernen, dann Einheiten umrechnen
+            if _is_text_column(s):
+                s = s.mask(s.isin(placeholders), pd.NA)
+            s = _convert_size_column(s, report)
+            s = s.mask(s == 0, pd.NA)
+            if s.isna().all():
+                empty.add(col)
+        elif _is_text_column(s):
+            # 1) + 3)
+            s = _clean_text_values(s, placeholders, chars, blank_to_na)
+        else:
+            continue
+        df.isetitem(j, s)
 
-    # 5) Warnung
-    if empty_cols:
-        st.warning(
+    # 4) Warnung
+    empty_cols = [col for col in COLUMN_PRESET if col in empty]
+    if empty_cols and warn_empty:
+        show_warning(
             "Folgende Mengenspalten nach Bereinigung komplett leer: "
             + ", ".join(empty_cols)
         )
@@ -181,6 +640,7 @@ def detect_header_row(df_raw: pd.DataFrame,
     Bestimmt den Header-Zeilenindex, indem in den ersten `max_scan_rows` Zeilen
     nach Key-Spalten gesucht wird. Bewertet jede Zeile nach Anzahl Key-Treffer
     und nimmt die Zeile mit dem hoechsten Score. Fallback: 0.
+    Eine Zeile, die exakt einer ITO-Vorlage entspricht, gewinnt ohne Scoring.
 
     Parameters
     ----------
@@ -202,6 +662,12 @@ def detect_header_row(df_raw: pd.DataFrame,
 
     # auf die ersten max_scan_rows begrenzen
     scan_limit = min(max_scan_rows, len(df_raw))
+
+    # Schnellpfad: Zeile entspricht exakt einer bekannten ITO-Vorlage
+    for idx in range(scan_limit):
+        if match_ito_template(df_raw.iloc[idx].tolist()) is not None:
+            return idx
+
     best_idx = 0
     best_score = -1
 
@@ -223,83 +689,158 @@ def detect_header_row(df_raw: pd.DataFrame,
     return best_idx if best_score > 0 else 0
 
 
+def _default_preset() -> dict:
+    return {
+        "Flaeche": COLUMN_PRESET["Fläche (m2)"],
+        "Volumen": COLUMN_PRESET["Volumen (m3)"],
+        "Laenge":  COLUMN_PRESET["Länge (m)"],
+        "Dicke":   COLUMN_PRESET["Dicke (m)"],
+        "Hoehe":   COLUMN_PRESET["Höhe (m)"]
+    }
+
+
+class _AliasMatcher:
+    """
+    Alle Aliase eines Presets (Ziel ⇒ Aliasliste) in einem vorkompilierten Regex.
+    `targets(name)` liefert die Ziele, von denen ein Alias als Teilstring
+    (case-insensitive) in `name` vorkommt, wie `any(a.lower() in name.lower())`.
+    """
+
+    def __init__(self, preset: dict):
+        owners = {}
+        for target, aliases in preset.items():
+            for a in aliases or []:
+                # Aliaslisten von None/Non-Strings saeubern (falls Preset unsauber)
+                if isinstance(a, str) and a.strip() != "":
+                    owners.setdefault(a.lower(), set()).add(target)
+        # Lookahead findet ueberlappende Treffer; laengster Alias je Position zuerst.
+        # Kuerzere Aliase an derselben Position sind Praefixe davon ⇒ deren Ziele mitnehmen.
+        self._targets = {
+            a: frozenset(t for b, ts in owners.items() if a.startswith(b) for t in ts)
+            for a in owners
+        }
+        alts = sorted(owners, key=len, reverse=True)
+        self._regex = re.compile("(?=(" + "|".join(map(re.escape, alts)) + "))") if alts else None
+
+    def targets(self, name) -> frozenset:
+        if self._regex is None or not isinstance(name, str):
+            return frozenset()
+        found = frozenset()
+        for m in self._regex.finditer(name.lower()):
+            found |= self._targets[m.group(1)]
+        return found
+
+
+_RENAME_MATCHER = _AliasMatcher(COLUMN_PRESET)
+_HIERARCHY_MATCHERS = {}
+
+
+def _preset_key(preset: dict) -> tuple:
+    return tuple((m, tuple(k)) for m, k in preset.items())
+
+
+def _columns_signature(columns) -> str:
+    """Hash des Spalten-Tupels (Reihenfolge und Namen) als Cache-Schluessel."""
+    return hashlib.blake2b(repr(tuple(columns)).encode(), digest_size=16).hexdigest()
+
+
+def _detect_preset_hierarchy(columns, preset: dict) -> dict:
+    """Erkennung je Mass: BQ-Spalten zuerst, dann exakte Aliase, dann Teilstrings, Solibri zuletzt."""
+    key = _preset_key(preset)
+    matcher = _HIERARCHY_MATCHERS.get(key)
+    if matcher is None:
+        matcher = _HIERARCHY_MATCHERS[key] = _AliasMatcher(preset)
+    hits = {col: matcher.targets(col) for col in columns}
+    hierarchy = {}
+    for measure, keywords in preset.items():
+        detected = []
+        detected += [
+            col for col in columns
+            if "bq" in col.lower() and measure in hits[col]
+        ]
+        detected += [
+            col for col in keywords if col in hits and col not in detected
+        ]
+        detected += [
+            col for col in columns
+            if measure in hits[col] and col not in detected
+        ]
+        sol = [c for c in detected if "solibri" in c.lower()]
+        detected = [c for c in detected if c not in sol] + sol
+        if detected:
+            hierarchy[measure] = detected
+    return hierarchy
+
+
 def apply_preset_hierarchy(df: pd.DataFrame,
                            existing_hierarchy: dict,
                            preset: dict = None) -> dict:
     """
     Füllt existing_hierarchy nur, wenn noch leer, anhand COLUMN_PRESET.
+    Bei bekannter ITO-Vorlage wird die vorberechnete Hierarchie übernommen,
+    sonst die je Header-Signatur gecachte.
     """
+    template = match_ito_template(df.columns) if preset is None else None
     if preset is None:
-        preset = {
-            "Flaeche": COLUMN_PRESET["Fläche (m2)"],
-            "Volumen": COLUMN_PRESET["Volumen (m3)"],
-            "Laenge":  COLUMN_PRESET["Länge (m)"],
-            "Dicke":   COLUMN_PRESET["Dicke (m)"],
-            "Hoehe":   COLUMN_PRESET["Höhe (m)"]
-        }
+        preset = _default_preset()
     # vorhandene validieren
     for m, defaults in existing_hierarchy.items():
         existing_hierarchy[m] = [c for c in defaults if c in df.columns]
     # nur wenn alle noch leer
     if all(not v for v in existing_hierarchy.values()):
-        for measure, keywords in preset.items():
-            detected = []
-            detected += [
-                col for col in df.columns
-                if "bq" in col.lower() and any(k.lower() in col.lower() for k in keywords)
-            ]
-            detected += [
-                col for col in keywords if col in df.columns and col not in detected
-            ]
-            detected += [
-                col for col in df.columns
-                if any(k.lower() in col.lower() for k in keywords) and col not in detected
-            ]
-            sol = [c for c in detected if "solibri" in c.lower()]
-            detected = [c for c in detected if c not in sol] + sol
-            if detected:
-                existing_hierarchy[measure] = detected
+        if template is not None:
+            detected = template.hierarchy
+        else:
+            columns = list(df.columns)
+            detected = MAPPING_CACHE.get_or_compute(
+                ("hierarchy", _columns_signature(columns), _preset_key(preset)),
+                lambda: _detect_preset_hierarchy(columns, preset),
+            )
+        for measure, cols in detected.items():
+            existing_hierarchy[measure] = list(cols)
     return existing_hierarchy
 
-def _as_lower_str_or_none(x):
-    # Nur echte Strings zulassen; alles andere ignorieren
-    return x.lower() if isinstance(x, str) else None
-
-def rename_columns_to_standard(df: pd.DataFrame) -> pd.DataFrame:
-    # 0) MultiIndex-Spalten aufloesen -> eindeutige Stringnamen
-    if isinstance(df.columns, pd.MultiIndex):
-        df.columns = ["__".join([str(p) for p in tup if p is not None]) for tup in df.columns]
 
+def _rename_plan(columns) -> tuple[dict, list]:
+    """
+    Alias-Matching fuer rename_columns_to_standard.
+    Rueckgabe: (Umbenennung alt ⇒ Standard, Warnungen bei Mehrfach-Treffern).
+    """
     renamed = {}
+    warnings = []
 
-    # 1) Aliaslisten von None/Non-Strings saeubern (falls COLUMN_PRESET unsauber)
-    clean_preset = {
-        standard: [a for a in (alts or []) if isinstance(a, str) and a.strip() != ""]
-        for standard, alts in COLUMN_PRESET.items()
-    }
-
-    # 2) Spaltennamen, die keine Strings sind, ignorieren (nicht zwangsweise in Strings casten)
-    valid_cols = [c for c in df.columns if isinstance(c, str) and c.strip() != ""]
-
-    for standard, alts in clean_preset.items():
-        matches = []
-        for c in valid_cols:
-            c_l = _as_lower_str_or_none(c)
-            # Wenn c kein String ist, ueberspringen
-            if c_l is None:
-                continue
-            # Sobald ein Alias als Teilstring vorkommt, ist es ein Match
-            for alt in alts:
-                alt_l = _as_lower_str_or_none(alt)
-                if alt_l and alt_l in c_l:
-                    matches.append(c)
-                    break
+    # Spaltennamen, die keine Strings sind, ignorieren (nicht zwangsweise in Strings casten)
+    valid_cols = [c for c in columns if isinstance(c, str) and c.strip() != ""]
+    hits = [(c, _RENAME_MATCHER.targets(c)) for c in valid_cols]
 
+    for standard in COLUMN_PRESET:
+        # Sobald ein Alias als Teilstring vorkommt, ist es ein Match
+        matches = [c for c, targets in hits if standard in targets]
         if matches:
             if len(matches) > 1:
-                st.warning(f"Mehrfach: {matches}. Nutze '{matches[0]}' fuer '{standard}'.")
+                warnings.append(f"Mehrfach: {matches}. Nutze '{matches[0]}' fuer '{standard}'.")
             renamed[matches[0]] = standard
 
+    return renamed, warnings
+
+
+def rename_columns_to_standard(df: pd.DataFrame) -> pd.DataFrame:
+    # 0) MultiIndex-Spalten aufloesen -> eindeutige Stringnamen
+    if isinstance(df.columns, pd.MultiIndex):
+        df.columns = ["__".join([str(p) for p in tup if p is not None]) for tup in df.columns]
+
+    # Bekannte ITO-Vorlage: vorberechnete Umbenennung, sonst je Header-Signatur gecacht
+    template = match_ito_template(df.columns)
+    if template is not None:
+        renamed, warnings = template.rename_map, template.rename_warnings
+    else:
+        columns = list(df.columns)
+        renamed, warnings = MAPPING_CACHE.get_or_compute(
+            ("rename", _columns_signature(columns)), lambda: _rename_plan(columns)
+        )
+    for msg in warnings:
+        show_warning(msg)
+
     if renamed:
         df = df.rename(columns=renamed)
 
@@ -312,3 +853,982 @@ def prepend_values_cleaning(df: pd.DataFrame,
     Nur Werte bereinigen, keine Spalten umbenennen.
     """
     return clean_columns_values(df, delete_enabled, custom_chars)
+
+
+# ========= ITO-Vorlagen: Header-Signatur ⇒ vorberechnetes Schema =========
+# Spaltenarten der ITO-Definition, die im Export Text liefern
+_ITO_TEXT_KINDS = {"ClassificationColumn", "ComponentTypeColumn", "IdentificationTypeColumn", "MaterialColumn"}
+# Farbspalten fehlen je nach Export bzw. werden von clean_columns_values entfernt
+_ITO_OPTIONAL_KINDS = {"CustomColorColumn"}
+
+
+@dataclass
+class TemplateSchema:
+    """
+    Alles, was sonst pro Upload heuristisch bestimmt wird, fuer eine ITO-Spaltenliste:
+    Umbenennung (rename_columns_to_standard), Mengen-Hierarchie (apply_preset_hierarchy)
+    und dtypes (apply_column_schema).
+    """
+    name: str
+    columns: tuple
+    rename_map: dict
+    rename_warnings: list
+    hierarchy: dict
+    dtypes: dict
+
+
+def _template_schema(template, defs: list) -> TemplateSchema:
+    columns = tuple(d.name for d in defs)
+    rename_map, rename_warnings = _rename_plan(columns)
+    dtypes = {d.name: "text" for d in defs if d.kind in _ITO_TEXT_KINDS}
+    dtypes.update({c: COLUMN_SCHEMA[c] for c in columns if c in COLUMN_SCHEMA})
+    return TemplateSchema(
+        name=template.name,
+        columns=columns,
+        rename_map=rename_map,
+        rename_warnings=rename_warnings,
+        hierarchy=_detect_preset_hierarchy(list(columns), _default_preset()),
+        dtypes=dtypes,
+    )
+
+
+_ITO_SIGNATURES = None
+
+
+def ito_signatures() -> dict:
+    """
+    Header-Signatur (Tupel der Spaltennamen) ⇒ TemplateSchema, einmal aus
+    ito_templates/*.ito gebaut. Je Vorlage mit und ohne Farbspalte.
+    """
+    global _ITO_SIGNATURES
+    if _ITO_SIGNATURES is None:
+        signatures = {}
+        for template in load_ito_templates():
+            core = [d for d in template.columns if d.kind not in _ITO_OPTIONAL_KINDS]
+            for defs in (template.columns, core):
+                schema = _template_schema(template, defs)
+                signatures.setdefault(schema.columns, schema)
+        _ITO_SIGNATURES = signatures
+    return _ITO_SIGNATURES
+
+
+def match_ito_template(columns) -> "TemplateSchema | None":
+    """
+    Exakter Abgleich einer Header-Zeile (leere Zellen am Ende ignoriert)
+    mit den ITO-Signaturen. Kein Treffer ⇒ None (Heuristik verwenden).
+    """
+    names = list(columns)
+    while names and (names[-1] is None or (not isinstance(names[-1], str) and pd.isna(names[-1]))):
+        names.pop()
+    if not names or not all(isinstance(n, str) for n in names):
+        return None
+    return ito_signatures().get(tuple(names))
+
+
+# ========= Streaming: Header-Erkennung, Chunks, Writer =========
+def _unique_header_names(header_row) -> list:
+    """
+    Benennt Header-Zellen wie pandas.read_excel:
+    leer ⇒ 'Unnamed: i', Duplikate ⇒ 'Name.1', 'Name.2', ...
+    """
+    names = []
+    seen = {}
+    for i, val in enumerate(header_row):
+        name = f"Unnamed: {i}" if val is None or (isinstance(val, str) and val == "") else val
+        if name in seen:
+            seen[name] += 1
+            cand = f"{name}.{seen[name]}"
+            while cand in seen:
+                seen[name] += 1
+                cand = f"{name}.{seen[name]}"
+            seen[cand] = 0
+            name = cand
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _open_sheet_read_only(file, sheet_name=None):
+    """Oeffnet ein Blatt im read-only Modus. Rueckgabe: (workbook, worksheet)."""
+    if hasattr(file, "seek"):
+        file.seek(0)
+    wb = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    ws = wb[sheet_name] if sheet_name is not None else wb.worksheets[0]
+    return wb, ws
+
+
+def read_sheet_head(file, sheet_name=None, nrows: int = 10) -> pd.DataFrame:
+    """
+    Liest nur die ersten `nrows` Zeilen eines Blatts (read-only), entspricht
+    pd.read_excel(..., header=None, nrows=nrows). Default: erstes Blatt.
+    """
+    wb, ws = _open_sheet_read_only(file, sheet_name)
+    try:
+        rows = list(ws.iter_rows(max_row=nrows, values_only=True))
+    finally:
+        wb.close()
+    return pd.DataFrame(rows)
+
+
+def detect_sheet_header(file,
+                        sheet_name=None,
+                        keys: list[str] = None,
+                        max_scan_rows: int = 10) -> tuple[int, list]:
+    """
+    Header-Erkennung ohne das Blatt komplett zu lesen.
+
+    Returns
+    -------
+    (header_row, columns)
+        0-basierter Header-Index (wie detect_header_row) und Spaltennamen
+        wie sie pd.read_excel(header=header_row) liefern wuerde.
+    """
+    head = read_sheet_head(file, sheet_name, nrows=max_scan_rows)
+    if head.empty:
+        return 0, []
+    header_row = detect_header_row(head, keys, max_scan_rows)
+    header = head.iloc[header_row].tolist()
+    # leere Zellen am Ende abschneiden (read-only liefert bis max_column)
+    while header and header[-1] is None:
+        header.pop()
+    return header_row, _unique_header_names(header)
+
+
+# Texte, die pd.read_excel standardmaessig als NaN liest
+READ_EXCEL_NA_STRINGS = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+]
+
+
+def _chunk_frame(rows: list, columns: list) -> pd.DataFrame:
+    """Zeilen ⇒ DataFrame; NA-Texte wie bei pd.read_excel als NaN."""
+    df = pd.DataFrame(rows, columns=columns)
+    for j in np.flatnonzero((df.dtypes == object).to_numpy()):
+        s = df.iloc[:, j]
+        na = s.isin(READ_EXCEL_NA_STRINGS)
+        if na.any():
+            df.isetitem(j, s.mask(na).infer_objects())
+    return df
+
+
+def iter_sheet_chunks(file,
+                      sheet_name=None,
+                      header_row: int = 0,
+                      columns: list = None,
+                      chunk_size: int = 20000):
+    """
+    Liest ein Blatt zeilenweise (read-only) und liefert DataFrames mit hoechstens
+    `chunk_size` Zeilen. Komplett leere Zeilen werden uebersprungen.
+    `columns`: bereits bekannte Spaltennamen (sonst aus der Header-Zeile).
+    NA-Texte ("nan", "N/A", ...) werden wie bei pd.read_excel zu NaN.
+    """
+    wb, ws = _open_sheet_read_only(file, sheet_name)
+    try:
+        rows = ws.iter_rows(min_row=header_row + 1, values_only=True)
+        header = next(rows, None)
+        if columns is None:
+            header = list(header or [])
+            while header and header[-1] is None:
+                header.pop()
+            columns = _unique_header_names(header)
+        width = len(columns)
+        pad = (None,) * width
+        buf = []
+        for row in rows:
+            if all(v is None for v in row):
+                continue
+            row = tuple(row[:width])
+            if len(row) < width:
+                row = row + pad[len(row):]
+            buf.append(row)
+            if len(buf) >= chunk_size:
+                yield _chunk_frame(buf, columns)
+                buf = []
+        if buf:
+            yield _chunk_frame(buf, columns)
+    finally:
+        wb.close()
+
+
+def hash_values(s: pd.Series) -> np.ndarray:
+    """64-bit Hash je Wert (als Text), z. B. fuer GUID-Sets ueber Chunks hinweg."""
+    return pd.util.hash_array(s.astype(str).to_numpy(dtype=object))
+
+
+
+def _normalized_column_hash(s: pd.Series) -> np.ndarray:
+    """
+    64-bit Hash je Zelle nach der Element-Dedup-Normierung:
+    Text ⇒ str mit zusammengefassten Leerzeichen, Zahlen ⇒ auf 6 Stellen gerundet,
+    alle anderen dtypes unveraendert.
+    """
+    if _is_text_column(s):
+        # nur die eindeutigen Texte normieren und hashen
+        codes, uniques = pd.factorize(s.astype(str).to_numpy(dtype=object))
+        norm = pd.Series(uniques, dtype=object).str.replace(r"\s+", " ", regex=True).str.strip()
+        return pd.util.hash_array(norm.to_numpy(dtype=object))[codes]
+    if pd.api.types.is_numeric_dtype(s.dtype):
+        s = pd.to_numeric(s, errors="coerce").round(6)
+        if pd.api.types.is_float_dtype(s.dtype):
+            # -0.0 == 0.0 und alle NaN gleich, wie bei duplicated()
+            v = s.to_numpy(dtype="float64") + 0.0
+            v[np.isnan(v)] = np.nan
+            return pd.util.hash_array(v)
+    return pd.util.hash_pandas_object(s, index=False).to_numpy()
+
+
+def _canonical_value(v) -> str:
+    if isinstance(v, (bool, np.bool_)):
+        return str(v)
+    if isinstance(v, (int, float, np.integer, np.floating)):
+        return repr(round(float(v), 6) + 0.0)
+    if isinstance(v, str):
+        return " ".join(v.split())
+    return str(v)
+
+
+def _stable_column_hash(s: pd.Series) -> np.ndarray:
+    """Wie _normalized_column_hash, aber unabhaengig vom inferierten dtype (1 == 1.0, leer == NA)."""
+    codes, uniques = pd.factorize(s, use_na_sentinel=True)
+    canon = [_canonical_value(u) for u in uniques] + ["<NA>"]
+    return pd.util.hash_array(np.array(canon, dtype=object))[codes]
+
+
+def row_fingerprints(df: pd.DataFrame, cols: list = None, dtype_stable: bool = False) -> np.ndarray:
+    """
+    64-bit Fingerprint je Zeile ueber die normierten Werte der Spalten `cols`.
+    Spaltenweise kombiniert, ohne eine normierte Kopie des Frames anzulegen.
+    dtype_stable: gleiche Werte ergeben auch bei je Chunk anders inferierten
+    dtypes denselben Hash (fuer Sets ueber Chunks hinweg).
+    """
+    cols = list(df.columns) if cols is None else cols
+    column_hash = _stable_column_hash if dtype_stable else _normalized_column_hash
+    h = np.full(len(df), 0xCBF29CE484222325, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for c in cols:
+            h = (h ^ column_hash(df[c])) * np.uint64(0x100000001B3)
+            h ^= h >> np.uint64(29)
+    return h
+
+
+def drop_duplicate_rows(df: pd.DataFrame, cols: list = None):
+    """Exakte Duplikate (nach Normierung) ueber Zeilen-Fingerprints entfernen.
+    Rueckgabe: (DataFrame ohne Duplikate, Anzahl entfernter Zeilen)."""
+    dup = pd.Series(row_fingerprints(df, cols)).duplicated(keep="first").to_numpy()
+    return df.loc[~dup].reset_index(drop=True), int(dup.sum())
+
+
+
+class SeenHashes:
+    """
+    Menge aus 64-bit Hashes ueber Chunks hinweg (GUIDs, Zeilen-Fingerprints).
+    mark() liefert je Zeile True fuer Folge-Vorkommen; das erste bleibt unmarkiert.
+    """
+
+    def __init__(self):
+        self._seen = set()
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def mark(self, hashes: np.ndarray, valid=None) -> np.ndarray:
+        """valid: optionale bool-Maske; ungueltige Zeilen (z. B. ohne GUID) nie markieren."""
+        dup = pd.Series(hashes).duplicated().to_numpy()
+        dup |= np.fromiter((h in self._seen for h in hashes.tolist()), bool, len(hashes))
+        keep = ~dup
+        if valid is not None:
+            valid = np.asarray(valid, dtype=bool)
+            dup &= valid
+            keep &= valid
+        self._seen.update(hashes[keep].tolist())
+        return dup
+
+
+class GroupIdentity:
+    """
+    Chunkuebergreifend je Schluessel (GUID): sind alle Zeilen der Gruppe identisch,
+    d. h. hat jede Spalte hoechstens einen Wert (NA ignoriert)? Entspricht
+    groupby(key).nunique() <= 1 ueber die ganze Tabelle.
+    Erst update() fuer alle Chunks, danach drop_mask() je Chunk in derselben Reihenfolge.
+    """
+
+    def __init__(self):
+        self._first = {}     # Schluessel -> erste Nicht-NA-Hashes je Spalte (0 = noch leer)
+        self._mixed = set()  # Schluessel mit abweichenden Werten
+        self._emitted = set()
+
+    def update(self, keys, frame: pd.DataFrame) -> None:
+        """keys: Schluessel je Zeile von `frame` (gleiche Reihenfolge)."""
+        keys = pd.Series(np.asarray(keys, dtype=object))
+        valid = keys.notna().to_numpy()
+        if not valid.any():
+            return
+        h = np.column_stack([_stable_column_hash(frame[c]) for c in frame.columns])
+        h = pd.DataFrame(h[valid], dtype="UInt64").mask(frame.isna().to_numpy()[valid])
+        g = h.groupby(keys[valid].to_numpy(), sort=False)
+        mixed = (g.nunique() > 1).any(axis=1).to_numpy()
+        first = g.first()
+        for key, vals, m in zip(first.index, first.fillna(0).to_numpy(dtype=np.uint64), mixed):
+            if key in self._mixed:
+                continue
+            prev = self._first.get(key)
+            if m:
+                self._mark_mixed(key)
+            elif prev is None:
+                self._first[key] = vals.tobytes()
+            elif prev != vals.tobytes():
+                a = np.frombuffer(prev, dtype=np.uint64)
+                if ((a != 0) & (vals != 0) & (a != vals)).any():
+                    self._mark_mixed(key)
+                else:
+                    self._first[key] = np.where(a == 0, vals, a).tobytes()
+
+    def _mark_mixed(self, key) -> None:
+        self._mixed.add(key)
+        self._first.pop(key, None)
+
+    def drop_mask(self, keys) -> np.ndarray:
+        """True fuer Folge-Vorkommen identischer Gruppen; das erste Vorkommen bleibt."""
+        keys = np.asarray(keys, dtype=object)
+        drop = np.zeros(len(keys), dtype=bool)
+        for i, key in enumerate(keys.tolist()):
+            if pd.isna(key) or key not in self._first:
+                continue
+            if key in self._emitted:
+                drop[i] = True
+            else:
+                self._emitted.add(key)
+        return drop
+
+
+def iter_group_chunks(chunks, can_start):
+    """
+    Schneidet einen Chunk-Strom nur an Gruppengrenzen neu, damit eine Mutter
+    nie von ihren Subs getrennt wird: jeder Chunk endet vor seiner letzten
+    zulaessigen Startzeile, der Rest ab dort wird dem naechsten Chunk vorangestellt.
+
+    can_start: Funktion DataFrame -> bool je Zeile, ob ein Chunk dort beginnen
+    darf (z. B. Mutterzeile).
+    """
+    carry = None
+    for chunk in chunks:
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        starts = np.flatnonzero(np.asarray(can_start(chunk), dtype=bool))
+        cut = int(starts[-1]) if len(starts) else 0
+        if cut == 0:
+            # noch keine abgeschlossene Gruppe im Puffer
+            carry = chunk
+            continue
+        yield chunk.iloc[:cut].reset_index(drop=True)
+        carry = chunk.iloc[cut:].reset_index(drop=True)
+    if carry is not None and len(carry):
+        yield carry
+
+
+class RowLimitError(ValueError):
+    """Ausgabe passt nicht mehr in ein Excel-Blatt; das Ergebnis waere abgeschnitten."""
+
+
+class StreamingTableWriter:
+    """
+    Schreibt eine Tabelle chunkweise mit konstantem Speicher:
+    - "xlsx": xlsxwriter mit constant_memory; Zeilen- und Zellmasken werden
+      direkt beim Schreiben als Hintergrundfarbe ausgegeben
+    - "parquet": pyarrow.ParquetWriter, Zeilenmaske optional als bool-Spalte
+
+    Verwendung:
+        with StreamingTableWriter(buffer, columns, "Merged") as w:
+            for chunk in chunks:
+                w.append(chunk, row_mask=mask)
+    """
+
+    XLSX_MAX_ROWS = 1_048_576
+    DATE_NUM_FORMAT = "yyyy-mm-dd hh:mm:ss"
+
+    def __init__(self,
+                 buffer,
+                 columns: list,
+                 sheet_name: str = "Merged",
+                 fmt: str = "xlsx",
+                 row_color: str = "#FFFF00",
+                 cell_color: str = "#FFFF00",
+                 mark_column: str | None = None,
+                 numeric_columns: list | None = None):
+        self.columns = list(columns)
+        self.fmt = fmt
+        self.mark_column = mark_column
+        self.numeric_columns = set(numeric_columns or [])
+        self.rows_written = 0
+        self._buffer = buffer
+        self._date_cols = set()
+
+        if fmt == "xlsx":
+            self._wb = xlsxwriter.Workbook(buffer, {
+                "constant_memory": True,
+                "nan_inf_to_errors": True,
+                "strings_to_urls": False,
+                "strings_to_formulas": False,
+            })
+            self._ws = self._wb.add_worksheet(sheet_name[:31])
+            self._header_fmt = self._wb.add_format({"bold": True, "border": 1})
+            self._colors = {"row": row_color, "cell": cell_color}
+            self._fmt_cache = {}
+            self._row_fmt = self._fill_fmt("row", False)
+            self._cell_fmt = self._fill_fmt("cell", False)
+            self._date_fmt = self._wb.add_format({"num_format": self.DATE_NUM_FORMAT})
+            self._ws.write_row(0, 0, [str(c) for c in self.columns], self._header_fmt)
+        elif fmt == "parquet":
+            if pq is None:
+                raise ImportError("Parquet-Ausgabe benoetigt 'pyarrow'.")
+            fields = [
+                pa.field(str(c), pa.float64() if c in self.numeric_columns else pa.string())
+                for c in self.columns
+            ]
+            if mark_column:
+                fields.append(pa.field(mark_column, pa.bool_()))
+            self._schema = pa.schema(fields)
+            self._pq = pq.ParquetWriter(buffer, self._schema)
+        else:
+            raise ValueError(f"Unbekanntes Ausgabeformat: {fmt}")
+
+    def _fill_fmt(self, kind: str, date: bool):
+        """Hintergrund ("row"/"cell"), fuer Datumsspalten mit Datumsformat; je Kombination einmal."""
+        key = (kind, date)
+        if key not in self._fmt_cache:
+            props = {"bg_color": self._colors[kind]}
+            if date:
+                props["num_format"] = self.DATE_NUM_FORMAT
+            self._fmt_cache[key] = self._wb.add_format(props)
+        return self._fmt_cache[key]
+
+    def _cell_matrix(self, cell_mask, n_rows: int):
+        """Zellmaske (DataFrame mit Spalten-Teilmenge oder ndarray) ⇒ bool-Matrix."""
+        if cell_mask is None:
+            return None
+        if isinstance(cell_mask, pd.DataFrame):
+            cell_mask = cell_mask.reindex(columns=self.columns, fill_value=False).to_numpy(dtype=bool)
+        cells = np.asarray(cell_mask, dtype=bool)
+        if cells.shape != (n_rows, len(self.columns)):
+            raise ValueError(f"Zellmaske hat Form {cells.shape}, erwartet {(n_rows, len(self.columns))}.")
+        return cells
+
+    def append(self, df: pd.DataFrame, row_mask=None, cell_mask=None):
+        """
+        Haengt einen Chunk an; Spalten werden auf `columns` ausgerichtet.
+        row_mask: bool je Zeile ⇒ ganze Zeile farbig.
+        cell_mask: bool je Zelle ⇒ einzelne Zellen farbig (nur xlsx).
+        """
+        if list(df.columns) != self.columns:
+            df = df.reindex(columns=self.columns)
+        mask = np.zeros(len(df), dtype=bool) if row_mask is None else np.asarray(row_mask, dtype=bool)
+
+        if self.fmt == "xlsx":
+            if self.rows_written + len(df) >= self.XLSX_MAX_ROWS:
+                raise RowLimitError(
+                    "Zu viele Zeilen fuer ein Excel-Blatt (max. 1'048'575). Bitte Parquet waehlen."
+                )
+            for j, c in enumerate(self.columns):
+                if j not in self._date_cols and pd.api.types.is_datetime64_any_dtype(df[c]):
+                    self._ws.set_column(j, j, 19, self._date_fmt)
+                    self._date_cols.add(j)
+            cells = self._cell_matrix(cell_mask, len(df))
+            cell_rows = cells.any(axis=1) if cells is not None else np.zeros(len(df), dtype=bool)
+
+            values = df.astype(object).where(df.notna(), None)
+            start = self.rows_written + 1
+            ws = self._ws
+            for r, row in enumerate(values.itertuples(index=False, name=None)):
+                excel_row = start + r
+                if mask[r]:
+                    ws.set_row(excel_row, None, self._row_fmt)
+                    ws.write_row(excel_row, 0, row, self._row_fmt)
+                    # farbige Zeile ueberschreibt das Spaltenformat: Datum kombiniert ausgeben
+                    for j in self._date_cols:
+                        ws.write(excel_row, j, row[j], self._fill_fmt("row", True))
+                else:
+                    ws.write_row(excel_row, 0, row)
+                if cell_rows[r]:
+                    for j in np.flatnonzero(cells[r]):
+                        ws.write(excel_row, j, row[j], self._fill_fmt("cell", j in self._date_cols))
+        else:
+            data = {}
+            for c in self.columns:
+                if c in self.numeric_columns:
+                    data[str(c)] = pd.to_numeric(df[c], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+                else:
+                    data[str(c)] = df[c].astype(object).where(df[c].notna(), None).map(
+                        lambda v: v if v is None else str(v)
+                    )
+            if self.mark_column:
+                data[self.mark_column] = mask
+            self._pq.write_table(pa.Table.from_pydict(data, schema=self._schema))
+        self.rows_written += len(df)
+
+    def close(self):
+        if self.fmt == "xlsx":
+            self._wb.close()
+        else:
+            self._pq.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def write_highlighted_excel(df: pd.DataFrame,
+                            buffer,
+                            sheet_name: str = "Sheet1",
+                            row_mask=None,
+                            cell_mask=None,
+                            row_color: str = "#FFFF00",
+                            cell_color: str = "#FFFF00",
+                            chunk_size: int = 50000):
+    """
+    Schreibt einen DataFrame als xlsx (ohne Index) und markiert Zeilen/Zellen
+    direkt beim Schreiben, statt die Zellen nachtraeglich einzufaerben.
+    """
+    row_mask = None if row_mask is None else np.asarray(row_mask, dtype=bool)
+    if isinstance(cell_mask, pd.DataFrame):
+        cell_mask = cell_mask.reindex(columns=df.columns, fill_value=False).to_numpy(dtype=bool)
+    with StreamingTableWriter(buffer, list(df.columns), sheet_name,
+                              row_color=row_color, cell_color=cell_color) as writer:
+        for start in range(0, max(len(df), 1), chunk_size):
+            stop = start + chunk_size
+            writer.append(
+                df.iloc[start:stop],
+                row_mask=None if row_mask is None else row_mask[start:stop],
+                cell_mask=None if cell_mask is None else cell_mask[start:stop],
+            )
+    return buffer
+
+
+# ========= Duplikat-Review (seitenweise statt Styler) =========
+def render_number_format_report(report: NumberFormatReport) -> None:
+    """Erkannte Zahlenformate je Mengenspalte; Zellen ausserhalb des Formats als Hinweis."""
+    if report is None or not report.columns:
+        return
+    if report.n_fallback:
+        st.info(
+            f"{report.n_fallback} Mengenzellen entsprachen nicht dem Zahlenformat "
+            "ihrer Spalte und wurden einzeln geparst."
+        )
+    with st.expander("Zahlenformate der Mengenspalten"):
+        st.dataframe(report.frame(), width="stretch")
+
+
+def render_duplicate_review(df: pd.DataFrame,
+                            key_col: str = "GUID",
+                            key: str = "dup_review",
+                            groups_per_page: int = 25):
+    """
+    Zeigt nur die Duplikat-Gruppen von `key_col` an, seitenweise und serverseitig
+    gefiltert: Kennzahlen, Suche nach Schluessel (Teilstring) und pro Seite nur
+    die Zeilen der sichtbaren Gruppen. Gibt die Anzahl Duplikat-Zeilen zurueck.
+    """
+    if df is None or key_col not in df.columns:
+        return 0
+    keys = df[key_col]
+    dup_mask = keys.notna() & keys.duplicated(keep=False)
+    n_rows = int(dup_mask.sum())
+    if not n_rows:
+        return 0
+
+    dups = df.loc[dup_mask]
+    counts = dups[key_col].value_counts()
+
+    st.markdown(f"**Duplikat-Review ({key_col})**")
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Gruppen", len(counts))
+    c2.metric("Zeilen", n_rows)
+    c3.metric("Grösste Gruppe", int(counts.iloc[0]))
+
+    search = st.text_input(f"{key_col} suchen", value="", key=f"{key}_search").strip()
+    if search:
+        counts = counts[counts.index.astype(str).str.contains(search, case=False, regex=False)]
+    if counts.empty:
+        st.info(f"Keine Duplikat-Gruppe zu '{search}' gefunden.")
+        return n_rows
+
+    n_pages = (len(counts) - 1) // groups_per_page + 1
+    page = st.number_input(
+        f"Seite (1–{n_pages})", min_value=1, max_value=n_pages, value=1, step=1,
+        key=f"{key}_page_{search}"
+    )
+    page_counts = counts.iloc[(page - 1) * groups_per_page: page * groups_per_page]
+
+    view = dups[dups[key_col].isin(page_counts.index)]
+    order = pd.Series(np.arange(len(page_counts)), index=page_counts.index)
+    view = view.iloc[np.argsort(view[key_col].map(order).to_numpy(), kind="stable")]
+
+    col_a, col_b = st.columns([1, 3])
+    col_a.dataframe(
+        page_counts.rename("Anzahl").rename_axis(key_col).reset_index(),
+        hide_index=True, width="stretch"
+    )
+    col_b.dataframe(view, width="stretch")
+    st.caption(f"Seite {page} von {n_pages} · {len(page_counts)} von {len(counts)} Gruppen")
+    return n_rows
+
+
+# ========= Parallele Verarbeitung (Dateien / Blaetter) =========
+def get_worker_count() -> int:
+    """Anzahl paralleler Worker aus der Sidebar (main.py); Default 1 = sequentiell."""
+    try:
+        return max(1, int(st.session_state.get("global_workers", 1)))
+    except Exception:
+        return 1
+
+
+# Aktive Sammel-Listen von collect_warnings; je Thread/Kontext getrennt
+_WARNING_SINK = contextvars.ContextVar("warning_sink", default=None)
+
+
+def show_warning(msg: str) -> None:
+    """
+    Warnung der Bereinigungs-Helfer (Einheiten, leere Mengenspalten, Umbenennung).
+    Sammelt collect_warnings gerade, landet die Meldung in dessen Liste; angezeigt
+    wird sie nur, wenn dort show=True gilt.
+    """
+    sink = _WARNING_SINK.get()
+    if sink is not None:
+        collected, show = sink
+        collected.append(str(msg))
+        if not show:
+            return
+    st.warning(msg)
+
+
+@contextmanager
+def collect_warnings(show: bool = True):
+    """
+    Sammelt die Meldungen von show_warning im aktuellen Kontext in einer Liste
+    (z. B. um sie mit einem gecachten Ergebnis zu speichern). show=False unterdrueckt
+    die Anzeige. Ueber contextvars getrennt: parallele Sessions sehen nichts davon.
+    """
+    collected = []
+    token = _WARNING_SINK.set((collected, show))
+    try:
+        yield collected
+    finally:
+        _WARNING_SINK.reset(token)
+
+
+def _run_collecting_warnings(fn, *job):
+    """
+    Worker-Seite von iter_parallel: ohne Streamlit-Kontext gingen die Warnungen
+    verloren, daher sammeln und mit dem Ergebnis zurueckgeben.
+    """
+    with collect_warnings(show=False) as collected:
+        return fn(*job), collected
+
+
+def iter_parallel(fn, jobs, max_workers: int = 1, on_progress=None):
+    """
+    Fuehrt fn(*job) fuer jeden Job aus und liefert (index, result, error)
+    in Job-Reihenfolge. Fehler eines Jobs brechen die anderen nicht ab.
+
+    - max_workers > 1: Prozess-Pool (spawn); `fn` muss eine Modul-Funktion sein,
+      Jobs muessen picklebar sein (z. B. Dateiname + Bytes statt Upload-Objekt).
+    - on_progress(done, total) wird nach jedem fertigen Job aufgerufen,
+      unabhaengig von der Reihenfolge.
+    - show_warning-Meldungen der Worker werden im Hauptprozess in Job-Reihenfolge
+      ausgegeben (vor dem jeweiligen Ergebnis).
+    """
+    jobs = list(jobs)
+    total = len(jobs)
+    if max_workers <= 1 or total <= 1:
+        for i, job in enumerate(jobs):
+            try:
+                res, err = fn(*job), None
+            except Exception as e:
+                res, err = None, e
+            if on_progress:
+                on_progress(i + 1, total)
+            yield i, res, err
+        return
+
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(max_workers, total), mp_context=ctx) as ex:
+        futures = {ex.submit(_run_collecting_warnings, fn, *job): i for i, job in enumerate(jobs)}
+        ready = {}
+        next_idx = 0
+        done = 0
+        for fut in as_completed(futures):
+            i = futures[fut]
+            try:
+                res, warnings = fut.result()
+                ready[i] = (res, None, warnings)
+            except Exception as e:
+                ready[i] = (None, e, [])
+            done += 1
+            if on_progress:
+                on_progress(done, total)
+            while next_idx in ready:
+                res, err, warnings = ready.pop(next_idx)
+                for msg in warnings:
+                    st.warning(msg)
+                yield next_idx, res, err
+                next_idx += 1
+
+
+# ========= Arbeitsmappe einmal laden (Modell fuer Reruns) =========
+@dataclass
+class WorkbookModel:
+    """
+    Einmal geparste Arbeitsmappe: alle Blaetter roh (header=None) plus
+    erkannte Header-Zeile je Blatt. Gedacht fuer st.session_state, damit
+    Reruns und Merge nicht erneut aus dem Upload lesen.
+    """
+    name: str
+    sheets: dict = field(default_factory=dict)       # Blatt ⇒ Roh-DataFrame
+    header_rows: dict = field(default_factory=dict)  # Blatt ⇒ 0-basierter Header
+
+    @classmethod
+    def load(cls, file, keys: list[str] = None) -> "WorkbookModel":
+        if hasattr(file, "seek"):
+            file.seek(0)
+        sheets = pd.read_excel(file, sheet_name=None, header=None, engine="openpyxl")
+        header_rows = {
+            name: detect_header_row(raw, keys) if not raw.empty else 0
+            for name, raw in sheets.items()
+        }
+        return cls(getattr(file, "name", ""), sheets, header_rows)
+
+    @property
+    def sheet_names(self) -> list:
+        return list(self.sheets)
+
+    def frame(self, sheet: str, header_row: int = None) -> pd.DataFrame:
+        """
+        Blatt als DataFrame wie pd.read_excel(header=header_row);
+        ohne Angabe mit der erkannten Header-Zeile.
+        """
+        raw = self.sheets[sheet]
+        if header_row is None:
+            header_row = self.header_rows.get(sheet, 0)
+        if raw.empty or header_row >= len(raw):
+            return pd.DataFrame()
+        header = [None if pd.isna(v) else v for v in raw.iloc[header_row].tolist()]
+        df = raw.iloc[header_row + 1:].reset_index(drop=True)
+        df.columns = _unique_header_names(header)
+        return apply_column_schema(df.infer_objects())
+
+
+# ========= Mutter/Sub-Struktur mehrschichtiger Exporte =========
+def blank_mask(block: pd.DataFrame) -> np.ndarray:
+    """2D-Maske: NA oder leerer/whitespace-String (wie astype(str).str.strip() == "")."""
+    mask = block.isna().to_numpy()
+    for j in range(block.shape[1]):
+        s = block.iloc[:, j]
+        if _is_text_column(s):
+            # nur eindeutige Werte pruefen, per Codes zurueckverteilen
+            codes, uniques = pd.factorize(s)
+            blank_u = np.array([isinstance(v, str) and not v.strip() for v in uniques], dtype=bool)
+            if blank_u.any():
+                mask[:, j] |= (codes >= 0) & blank_u[np.maximum(codes, 0)]
+    return mask
+
+
+def fill_rows(df: pd.DataFrame, cols: list, rows: np.ndarray, fill: np.ndarray, values: np.ndarray) -> None:
+    """Setzt values[fill] in df[cols] an den Positionen `rows` (ein Block-Update)."""
+    changed = fill.any(axis=0)
+    if not changed.any():
+        return
+    cols = [c for c, ch in zip(cols, changed) if ch]
+    fill, values = fill[:, changed], values[:, changed]
+    full_fill = np.zeros((len(df), len(cols)), dtype=bool)
+    full_fill[rows] = fill
+    full_vals = np.empty((len(df), len(cols)), dtype=object)
+    full_vals[rows] = values
+    other = pd.DataFrame(full_vals, index=df.index, columns=cols)
+    df[cols] = df[cols].mask(full_fill, other).infer_objects()
+
+
+@dataclass
+class GroupIndex:
+    """
+    Mutter/Sub-Gruppen eines mehrschichtigen Exports, einmal in O(n) aufgebaut.
+
+    Eine Gruppe ist eine Mutterzeile (Anker) gefolgt von einem zusammen-
+    haengenden Block Sub-Zeilen (Member). Entspricht der bisherigen
+    Zeilen-Schleife: ab einem Anker werden alle direkt folgenden Member
+    konsumiert, danach geht die Suche nach dem naechsten Anker weiter.
+
+    - mother_pos: Position der Mutter je Gruppe
+    - sub_start / sub_stop: Positionsbereich der Subs je Gruppe (stop exklusiv)
+    - codes: Gruppen-Code je Zeile (-1 = keine Gruppe), Muetter inklusive
+    """
+    mother_pos: np.ndarray
+    sub_start: np.ndarray
+    sub_stop: np.ndarray
+    codes: np.ndarray
+
+    @classmethod
+    def from_flags(cls, is_anchor, is_member) -> "GroupIndex":
+        anchor = np.asarray(is_anchor, dtype=bool)
+        member = np.asarray(is_member, dtype=bool)
+        n = len(anchor)
+        pos = np.arange(n)
+
+        # Member-Bloecke; ein Block ohne Anker davor wird vom ersten Anker
+        # im Block eroeffnet (Zeile ist dann Anker und Member zugleich)
+        prev_member = np.concatenate(([False], member[:-1]))
+        prev_anchor = np.concatenate(([False], anchor[:-1]))
+        run_start = member & ~prev_member
+        run_id = np.maximum(np.cumsum(run_start) - 1, 0)
+        first_cand = np.zeros(n, dtype=bool)
+        if run_start.any():
+            orphan_run = ~prev_anchor[run_start]
+            cand = member & anchor & orphan_run[run_id]
+            cand_cum = np.cumsum(cand)
+            starts = pos[run_start]
+            before_run = np.where(starts > 0, cand_cum[starts - 1], 0)
+            first_cand = cand & (cand_cum - before_run[run_id] == 1)
+        eff_anchor = (anchor & ~member) | first_cand
+
+        # Zugehoerigkeit: letzter Anker liegt nicht vor der letzten Nicht-Member-Zeile
+        last_anchor = np.maximum.accumulate(np.where(eff_anchor, pos, -1)) if n else pos
+        last_break = np.maximum.accumulate(np.where(~member, pos, -1)) if n else pos
+        grp = np.cumsum(eff_anchor) - 1
+        belongs = eff_anchor | (member & (last_anchor >= 0) & (last_anchor >= last_break))
+        codes = np.where(belongs, grp, -1)
+
+        mother_pos = pos[eff_anchor]
+        counts = np.bincount(codes[belongs & ~eff_anchor], minlength=len(mother_pos))
+        sub_start = mother_pos + 1
+        return cls(mother_pos, sub_start, sub_start + counts, codes)
+
+    @property
+    def n_groups(self) -> int:
+        return len(self.mother_pos)
+
+    @property
+    def sub_counts(self) -> np.ndarray:
+        return self.sub_stop - self.sub_start
+
+    @property
+    def is_mother(self) -> np.ndarray:
+        mask = np.zeros(len(self.codes), dtype=bool)
+        mask[self.mother_pos] = True
+        return mask
+
+    @property
+    def is_sub(self) -> np.ndarray:
+        return (self.codes >= 0) & ~self.is_mother
+
+    @property
+    def sub_pos(self) -> np.ndarray:
+        return np.flatnonzero(self.is_sub)
+
+    def mother_of(self, rows) -> np.ndarray:
+        """Mutter-Position je Zeile (-1 ohne Gruppe)."""
+        codes = self.codes[np.asarray(rows)]
+        if not self.n_groups:
+            return np.full(len(codes), -1)
+        return np.where(codes >= 0, self.mother_pos[np.maximum(codes, 0)], -1)
+
+    def gather(self, values, rows=None, fill=None) -> np.ndarray:
+        """Mutterwert je Zeile (Default: alle Sub-Zeilen); ohne Gruppe ⇒ fill."""
+        values = values.to_numpy() if hasattr(values, "to_numpy") else np.asarray(values)
+        rows = self.sub_pos if rows is None else np.asarray(rows)
+        mothers = self.mother_of(rows)
+        out = values[np.maximum(mothers, 0)] if len(values) else np.empty(len(rows), dtype=object)
+        if (mothers < 0).any():
+            out = out.astype(object)
+            out[mothers < 0] = fill
+        return out
+
+    def gather_frame(self, df: pd.DataFrame, cols, rows=None, fill=None) -> np.ndarray:
+        """Wie gather, fuer mehrere Spalten als 2D-object-Array (ein take)."""
+        rows = self.sub_pos if rows is None else np.asarray(rows)
+        block = df[list(cols)].to_numpy(dtype=object)
+        mothers = self.mother_of(rows)
+        out = block[np.maximum(mothers, 0)] if len(block) else np.empty((len(rows), len(cols)), dtype=object)
+        out[mothers < 0] = fill
+        return out
+
+    def broadcast(self, group_values, rows=None, fill=None) -> np.ndarray:
+        """Gruppenwerte (Laenge n_groups) auf Zeilen verteilen."""
+        group_values = np.asarray(group_values)
+        rows = np.arange(len(self.codes)) if rows is None else np.asarray(rows)
+        codes = self.codes[rows]
+        if not self.n_groups:
+            return np.full(len(rows), fill, dtype=object)
+        out = group_values[np.maximum(codes, 0)]
+        if (codes < 0).any():
+            out = out.astype(object)
+            out[codes < 0] = fill
+        return out
+
+    def group_any(self, row_mask) -> np.ndarray:
+        """Je Gruppe: trifft row_mask auf mindestens eine Sub-Zeile zu?"""
+        row_mask = np.asarray(row_mask, dtype=bool) & self.is_sub
+        hit = np.bincount(self.codes[row_mask], minlength=self.n_groups)
+        return hit > 0
+
+
+# ========= Ergebnis-Cache (LRU, fuer st.session_state) =========
+class LRUCache:
+    """
+    Begrenzter Cache mit LRU-Verdraengung und Treffer-/Fehlzaehlern.
+    Schluessel muessen hashbar sein (z. B. Tupel aus Fingerprint und frozensets).
+    """
+
+    def __init__(self, maxsize: int = 8):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+    def get(self, key, default=None):
+        if key in self._data:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get_or_compute(self, key, fn):
+        """Wert aus dem Cache oder fn() berechnen und ablegen."""
+        if key in self._data:
+            return self.get(key)
+        self.misses += 1
+        value = fn()
+        self.put(key, value)
+        return value
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# Aufgeloeste Spalten-Mappings je Header-Signatur (Umbenennung, Mengen-Hierarchie);
+# gleiche Header ueber viele Dateien/Blaetter werden so nur einmal gematcht
+MAPPING_CACHE = LRUCache(maxsize=256)
+
+
+def frame_fingerprint(df: pd.DataFrame) -> str:
+    """Inhalts-Fingerprint eines DataFrames (Werte, Index, Spalten, dtypes)."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr([(str(c), str(t)) for c, t in df.dtypes.items()]).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return h.hexdigest()
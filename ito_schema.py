@@ -0,0 +1,250 @@
+import io
+import os
+import struct
+import zipfile
+from dataclasses import dataclass, field
+
+# Ablage der Solibri ITO-Vorlagen (wie in ito_download)
+ITO_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ito_templates")
+
+# Java Object Serialization Stream Protocol (nur was ITO-Dateien brauchen)
+_STREAM_MAGIC = 0xACED
+_BASE_HANDLE = 0x7E0000
+TC_NULL, TC_REFERENCE, TC_CLASSDESC, TC_OBJECT = 0x70, 0x71, 0x72, 0x73
+TC_STRING, TC_ARRAY, TC_CLASS, TC_BLOCKDATA = 0x74, 0x75, 0x76, 0x77
+TC_ENDBLOCKDATA, TC_RESET, TC_BLOCKDATALONG = 0x78, 0x79, 0x7A
+TC_LONGSTRING, TC_PROXYCLASSDESC, TC_ENUM = 0x7C, 0x7D, 0x7E
+SC_WRITE_METHOD, SC_SERIALIZABLE, SC_EXTERNALIZABLE, SC_BLOCK_DATA = 0x01, 0x02, 0x04, 0x08
+
+_PRIMITIVES = {
+    "B": (">b", 1), "C": (">H", 2), "D": (">d", 8), "F": (">f", 4),
+    "I": (">i", 4), "J": (">q", 8), "S": (">h", 2), "Z": (">?", 1),
+}
+
+
+@dataclass
+class JavaClass:
+    name: str
+    flags: int = 0
+    fields: list = field(default_factory=list)    # [(typecode, name)]
+    super_class: "JavaClass" = None
+
+
+@dataclass
+class JavaObject:
+    """Deserialisiertes Objekt: Feldwerte plus writeObject-Annotationen (z.B. ArrayList-Elemente)."""
+    class_name: str
+    fields: dict = field(default_factory=dict)
+    annotations: list = field(default_factory=list)
+
+
+@dataclass
+class JavaEnum:
+    class_name: str
+    constant: str
+
+
+class _JavaStreamReader:
+    """Minimaler Leser fuer java.io.ObjectOutputStream-Daten (ohne Klassen-Laden)."""
+
+    def __init__(self, data: bytes):
+        self.buf = io.BytesIO(data)
+        self.handles = []
+
+    def _read(self, fmt: str, size: int):
+        raw = self.buf.read(size)
+        if len(raw) != size:
+            raise ValueError("ITO-Datei unvollstaendig (Stream-Ende)")
+        return struct.unpack(fmt, raw)[0]
+
+    def _byte(self) -> int:
+        return self._read(">B", 1)
+
+    def _utf(self, long: bool = False) -> str:
+        size = self._read(">q" if long else ">H", 8 if long else 2)
+        # modifiziertes UTF-8: fuer Spaltennamen genuegt normales UTF-8
+        return self.buf.read(size).decode("utf-8", errors="replace")
+
+    def _new_handle(self, obj):
+        self.handles.append(obj)
+        return obj
+
+    def read_stream(self) -> list:
+        if self._read(">H", 2) != _STREAM_MAGIC:
+            raise ValueError("Keine Java-Serialisierung (Magic fehlt)")
+        self._read(">H", 2)  # Version
+        contents = []
+        while self.buf.tell() < len(self.buf.getbuffer()):
+            contents.append(self.read_content())
+        return contents
+
+    def read_content(self, tc: int = None):
+        if tc is None:
+            tc = self._byte()
+        if tc == TC_NULL:
+            return None
+        if tc == TC_REFERENCE:
+            return self.handles[self._read(">i", 4) - _BASE_HANDLE]
+        if tc == TC_STRING:
+            return self._new_handle(self._utf())
+        if tc == TC_LONGSTRING:
+            return self._new_handle(self._utf(long=True))
+        if tc in (TC_CLASSDESC, TC_PROXYCLASSDESC):
+            return self._class_desc(tc)
+        if tc == TC_OBJECT:
+            return self._object()
+        if tc == TC_ARRAY:
+            return self._array()
+        if tc == TC_ENUM:
+            cls = self.read_content()
+            enum = self._new_handle(JavaEnum(cls.name, None))
+            enum.constant = self.read_content()
+            return enum
+        if tc == TC_CLASS:
+            return self._new_handle(self.read_content())
+        if tc == TC_BLOCKDATA:
+            return self.buf.read(self._byte())
+        if tc == TC_BLOCKDATALONG:
+            return self.buf.read(self._read(">i", 4))
+        if tc == TC_RESET:
+            self.handles.clear()
+            return self.read_content()
+        raise ValueError(f"Unbekannter Typcode 0x{tc:02x} an Position {self.buf.tell() - 1}")
+
+    def _annotations(self) -> list:
+        items = []
+        while True:
+            tc = self._byte()
+            if tc == TC_ENDBLOCKDATA:
+                return items
+            items.append(self.read_content(tc))
+
+    def _class_desc(self, tc: int) -> JavaClass:
+        if tc == TC_PROXYCLASSDESC:
+            cls = self._new_handle(JavaClass("<proxy>"))
+            for _ in range(self._read(">i", 4)):
+                self._utf()
+        else:
+            cls = self._new_handle(JavaClass(self._utf()))
+            self._read(">q", 8)  # serialVersionUID
+            cls.flags = self._byte()
+            for _ in range(self._read(">h", 2)):
+                typecode = chr(self._byte())
+                name = self._utf()
+                if typecode in "L[":
+                    self.read_content()  # Klassenname des Feldtyps
+                cls.fields.append((typecode, name))
+        self._annotations()
+        cls.super_class = self.read_content()
+        return cls
+
+    def _value(self, typecode: str):
+        if typecode in _PRIMITIVES:
+            return self._read(*_PRIMITIVES[typecode])
+        return self.read_content()
+
+    def _object(self) -> JavaObject:
+        cls = self.read_content()
+        obj = self._new_handle(JavaObject(cls.name))
+        chain = []
+        while cls is not None:
+            chain.append(cls)
+            cls = cls.super_class
+        # Klassendaten von der obersten Oberklasse abwaerts
+        for c in reversed(chain):
+            if c.flags & SC_EXTERNALIZABLE:
+                if not c.flags & SC_BLOCK_DATA:
+                    raise ValueError(f"Externalizable ohne Blockdaten nicht lesbar: {c.name}")
+                obj.annotations.extend(self._annotations())
+                continue
+            for typecode, name in c.fields:
+                obj.fields[name] = self._value(typecode)
+            if c.flags & SC_WRITE_METHOD:
+                obj.annotations.extend(self._annotations())
+        return obj
+
+    def _array(self) -> list:
+        cls = self.read_content()
+        values = self._new_handle([])
+        typecode = cls.name[1] if cls.name.startswith("[") else "L"
+        for _ in range(self._read(">i", 4)):
+            values.append(self._value(typecode))
+        return values
+
+
+def read_java_stream(data: bytes) -> list:
+    """Alle Top-Level-Objekte eines Java-Serialisierungs-Streams."""
+    return _JavaStreamReader(data).read_stream()
+
+
+# ========= ITO-Vorlagen =========
+@dataclass
+class ItoColumnDef:
+    name: str
+    kind: str              # Java-Klasse ohne Paket, z.B. "PropertySetColumn"
+    property: str = None   # referenzierte Eigenschaft (falls vorhanden)
+
+
+@dataclass
+class ItoTemplate:
+    """Spaltenliste einer Solibri Informations-Auswertung (Reihenfolge wie im Export)."""
+    name: str
+    path: str
+    columns: list          # [ItoColumnDef]
+
+    @property
+    def column_names(self) -> list:
+        return [c.name for c in self.columns]
+
+
+def _is_ito_column(obj) -> bool:
+    return isinstance(obj, JavaObject) and obj.class_name.endswith("Column") and "name" in obj.fields
+
+
+def parse_ito(data: bytes) -> list:
+    """
+    Spalten einer ITO-Definition (Java-serialisierte ItoSettings) lesen.
+    `data` ist die .ito-Datei selbst (Zip) oder deren entpackter Inhalt.
+    """
+    if data[:2] == b"PK":
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            data = zf.read(zf.namelist()[0])
+    settings = next(
+        (o for o in read_java_stream(data)
+         if isinstance(o, JavaObject) and o.class_name.endswith("ItoSettings")),
+        None,
+    )
+    if settings is None:
+        raise ValueError("Keine ItoSettings in der ITO-Datei gefunden")
+    columns = settings.fields.get("columns")
+    items = columns.annotations if isinstance(columns, JavaObject) else []
+    result = []
+    for col in items:
+        if not _is_ito_column(col):
+            continue
+        prop = col.fields.get("propertyName") or col.fields.get("classification")
+        result.append(ItoColumnDef(
+            name=col.fields["name"],
+            kind=col.class_name.rsplit(".", 1)[-1],
+            property=prop if isinstance(prop, str) else None,
+        ))
+    return result
+
+
+def load_ito_templates(directory: str = ITO_TEMPLATE_DIR) -> list:
+    """Alle lesbaren *.ito-Vorlagen eines Ordners; defekte Dateien werden uebersprungen."""
+    templates = []
+    if not os.path.isdir(directory):
+        return templates
+    for fname in sorted(os.listdir(directory)):
+        if not fname.lower().endswith(".ito"):
+            continue
+        path = os.path.join(directory, fname)
+        try:
+            with open(path, "rb") as fh:
+                columns = parse_ito(fh.read())
+        except (OSError, ValueError, zipfile.BadZipFile, struct.error, IndexError):
+            continue
+        if columns:
+            templates.append(ItoTemplate(fname.rsplit(".", 1)[0], path, columns))
+    return templates
@@ -1,3 +1,4 @@
+import os
 import streamlit as st
 from excel_requirements import app as excel_requirements
 from spalten_values_merger import app as values_merger
@@ -30,6 +31,10 @@ with st.sidebar.expander("Verarbeitungseinstellungen"):
         **Zusätzliche Zeichen (kommagetrennt):**  
         z. B. cm, CHF  
         ⇒ nur entfernen, wenn Häkchen gesetzt
+
+        **Parallele Worker:**  
+        Anzahl Prozesse zum Einlesen mehrerer Dateien/Blätter.  
+        1 ⇒ sequentiell
         """
     )
 
@@ -51,6 +56,15 @@ delete_custom = st.sidebar.checkbox(
     key="global_custom_delete"
 )
 
+st.sidebar.number_input(
+    "Parallele Worker",
+    min_value=1,
+    max_value=os.cpu_count() or 1,
+    value=1,
+    step=1,
+    key="global_workers"
+)
+
 # Flags für Sub-Apps
 delete_enabled = True
 if not delete_custom:
@@ -2,8 +2,28 @@ import streamlit as st
 import pandas as pd
 import io
 import re
+import pickle
+import tempfile
+import numpy as np
 from typing import Tuple, Dict, Any
-from excel_utils import clean_columns_values, rename_columns_to_standard, convert_quantity_columns
+from excel_utils import (
+    clean_columns_values,
+    rename_columns_to_standard,
+    convert_quantity_columns,
+    detect_sheet_header,
+    iter_sheet_chunks,
+    iter_group_chunks,
+    GroupIdentity,
+    StreamingTableWriter,
+    GroupIndex,
+    blank_mask,
+    fill_rows,
+    COLUMN_PRESET,
+    pq,
+)
+
+# Masterspalten (werden von Mutter an Subs vererbt; alle leer ⇒ Sub-Zeile)
+MASTER_COLS = ["Teilprojekt", "Gebäude", "Baufeld", "Geschoss", "Umbaustatus", "Unter Terrain"]
 
 
 def clean_dataframe(
@@ -16,6 +36,8 @@ def clean_dataframe(
     group_col: str | None = None,
     inherit_mother_ebkph_if_sub_missing: bool = False,
     global_sources_per_pair: Dict[str, str] | None = None,
+    warn_empty: bool = True,
+    guid_groups: GroupIdentity | None = None,
 ) -> Tuple[pd.DataFrame, Dict[str, Any]]:
     """
     Bereinigt die mehrschichtigen Daten.
@@ -23,6 +45,8 @@ def clean_dataframe(
     - Subs als Hauptzeilen aufschlüsseln; Mutter nur droppen, wenn mind. ein Sub nutzbar ist.
     - Spezialfall 'Treppe': Mutter nie droppen; Subs je nach Einstellung droppen.
     - Konfigurator steuert je Gruppe/Feldpaar (nur für '... Sub'-Paare): Auto/Mutter/Sub.
+    - guid_groups (Streaming): Schritt 9 nicht im Chunk anwenden, sondern die GUID-Gruppen
+      dort sammeln; entschieden wird erst nach dem letzten Chunk (siehe stream_clean).
     """
     stats = {
         "inherited_ebkph": 0,
@@ -30,12 +54,8 @@ def clean_dataframe(
         "treppe_subs_dropped": 0,
     }
 
-    def has_value(x) -> bool:
-        return pd.notna(x) and str(x).strip() != ""
-
     # Masterspalten (werden von Mutter an Subs vererbt)
-    master_cols = ["Teilprojekt", "Gebäude", "Baufeld", "Geschoss", "Umbaustatus", "Unter Terrain"]
-    master_cols = [c for c in master_cols if c in df.columns]
+    master_cols = [c for c in MASTER_COLS if c in df.columns]
 
     # Feldpaare (nur Basisspalten, die eine "... Sub" besitzen)
     sub_pairs = sorted({
@@ -44,179 +64,140 @@ def clean_dataframe(
     })
 
     # 1) Flag mehrschichtig
-    df["Mehrschichtiges Element"] = df.apply(
-        lambda row: all(pd.isna(row.get(col)) for col in master_cols), axis=1
-    )
+    df["Mehrschichtiges Element"] = df[master_cols].isna().all(axis=1)
+
+    def _anchor_groups(anchor_mask) -> GroupIndex:
+        return GroupIndex.from_flags(anchor_mask, df["Mehrschichtiges Element"])
 
     # 2) Werte aus Mutter in Subs für master_cols
-    i = 0
-    while i < len(df):
-        if all(pd.notna(df.at[i, c]) for c in master_cols):
-            j = i + 1
-            while j < len(df) and df.at[j, "Mehrschichtiges Element"]:
-                for c in master_cols:
-                    df.at[j, c] = df.at[i, c]
-                j += 1
-            i = j
-        else:
-            i += 1
+    #    Anker = Zeile mit allen Masterwerten, Subs = direkt folgende mehrschichtige Zeilen
+    gi = _anchor_groups(df[master_cols].notna().all(axis=1))
+    sub_rows = gi.sub_pos
+    if len(sub_rows) and master_cols:
+        ctx = gi.gather_frame(df, master_cols, sub_rows)
+        for j, c in enumerate(master_cols):
+            df.loc[df.index[sub_rows], c] = pd.Series(ctx[:, j], index=df.index[sub_rows]).infer_objects()
 
     # 3) Nicht klassifizierte Hauptelemente ohne Subs entfernen
-    drop_idx = []
-    i = 0
-    while i < len(df):
-        if all(pd.notna(df.at[i, c]) for c in master_cols):
-            j = i + 1
-            sub_idxs = []
-            while j < len(df) and df.at[j, "Mehrschichtiges Element"]:
-                sub_idxs.append(j)
-                j += 1
-            if not sub_idxs and "eBKP-H" in df.columns and df.at[i, "eBKP-H"] == "Nicht klassifiziert":
-                drop_idx.append(i)
-            i = j
-        else:
-            i += 1
-    if drop_idx:
-        df.drop(index=drop_idx, inplace=True)
-        df.reset_index(drop=True, inplace=True)
+    if "eBKP-H" in df.columns and gi.n_groups:
+        lonely = gi.mother_pos[gi.sub_counts == 0]
+        unclassified = df["eBKP-H"].eq("Nicht klassifiziert").fillna(False).to_numpy(dtype=bool)
+        drop_pos = lonely[unclassified[lonely]]
+        if len(drop_pos):
+            df.drop(index=df.index[drop_pos], inplace=True)
+            df.reset_index(drop=True, inplace=True)
 
     # 4) Vererbung eBKP-H Mutter -> Subs (nur wenn Sub fehlt/unklassifiziert)
+    #    Anker = jede nicht mehrschichtige Zeile
     if inherit_mother_ebkph_if_sub_missing and "eBKP-H" in df.columns:
-        i = 0
-        while i < len(df):
-            if not df.at[i, "Mehrschichtiges Element"]:
-                j = i + 1
-                while j < len(df) and df.at[j, "Mehrschichtiges Element"]:
-                    mother_ebkph = df.at[i, "eBKP-H"]
-                    sub_ebkph = df.at[j, "eBKP-H Sub"] if "eBKP-H Sub" in df.columns else pd.NA
-                    if pd.notna(mother_ebkph) and (
-                        pd.isna(sub_ebkph) or str(sub_ebkph).strip() in ["", "Nicht klassifiziert", "Keine Zuordnung"]
-                    ):
-                        df.at[j, "eBKP-H"] = mother_ebkph
-                        stats["inherited_ebkph"] += 1
-                    j += 1
-                i = j
-            else:
-                i += 1
+        gi4 = _anchor_groups(~df["Mehrschichtiges Element"])
+        sub_rows = gi4.sub_pos
+        mother_ebkph = pd.Series(gi4.gather(df["eBKP-H"], sub_rows), index=df.index[sub_rows])
+        if "eBKP-H Sub" in df.columns:
+            sub_ebkph = df["eBKP-H Sub"].iloc[sub_rows]
+            sub_missing = sub_ebkph.isna() | sub_ebkph.astype(str).str.strip().isin(
+                ["", "Nicht klassifiziert", "Keine Zuordnung"]
+            )
+        else:
+            sub_missing = pd.Series(True, index=mother_ebkph.index)
+        inherit = mother_ebkph.notna() & sub_missing
+        df.loc[inherit.index[inherit], "eBKP-H"] = mother_ebkph[inherit]
+        stats["inherited_ebkph"] += int(inherit.sum())
 
     # 5) Aufschlüsseln: Subs zu Hauptzeilen
     #    - nutzbarer Sub: hat gültiges eBKP-H Sub ODER (durch Vererbung) eBKP-H
     #    - Treppe: Mutter nie droppen; Sub ggf. droppen (stats)
-    new_rows = []
-    drop_idx = []
-    i = 0
-    while i < len(df):
-        if all(pd.notna(df.at[i, c]) for c in master_cols):
-            j = i + 1
-            sub_idxs = []
-            while j < len(df) and df.at[j, "Mehrschichtiges Element"]:
-                sub_idxs.append(j)
-                j += 1
-
-            # Treppe-Erkennung (in Mutter oder in deren Subs)
-            mother_txt = str(df.at[i, "eBKP-H"]) if "eBKP-H" in df.columns else ""
-            treppe_case = "Treppe" in mother_txt
-            for idx in sub_idxs:
-                if "eBKP-H Sub" in df.columns and "Treppe" in str(df.at[idx, "eBKP-H Sub"]):
-                    treppe_case = True
-                if "eBKP-H" in df.columns and "Treppe" in str(df.at[idx, "eBKP-H"]):
-                    treppe_case = True
-
-            # Bestimme, ob es min. einen nutzbaren Sub gibt
-            usable_subs = []
-            for idx in sub_idxs:
-                ebkph_sub = df.at[idx, "eBKP-H Sub"] if "eBKP-H Sub" in df.columns else pd.NA
-                ebkph = df.at[idx, "eBKP-H"] if "eBKP-H" in df.columns else pd.NA
-                is_valid_sub = (
-                    (has_value(ebkph_sub) and str(ebkph_sub) not in ["Nicht klassifiziert", "Keine Zuordnung"]) or
-                    (has_value(ebkph) and str(ebkph) not in ["Nicht klassifiziert", "Keine Zuordnung"])
-                )
-                if is_valid_sub:
-                    usable_subs.append(idx)
-
-            if sub_idxs:
-                if treppe_case:
-                    # Mutter NIE droppen
-                    if drop_treppe_sub:
-                        # Subs mit Treppe droppen
-                        for idx in sub_idxs:
-                            if (
-                                ("eBKP-H Sub" in df.columns and "Treppe" in str(df.at[idx, "eBKP-H Sub"])) or
-                                ("eBKP-H" in df.columns and "Treppe" in str(df.at[idx, "eBKP-H"]))
-                            ):
-                                drop_idx.append(idx)
-                                stats["treppe_subs_dropped"] += 1
-                    # Keine weitere Aufschlüsselung für Treppe (Mutter bleibt Anker)
-                    i = j
-                    continue
-
-                if usable_subs:
-                    # Mutter droppen und nutzbare Subs zu neuen (Haupt-)Zeilen erheben
-                    drop_idx.append(i)
-                    stats["mothers_dropped"] += 1
-                    for idx in usable_subs:
-                        new = df.loc[idx].copy()
-                        # Markiere als NICHT mehrschichtig (wird Hauptzeile)
-                        new["Mehrschichtiges Element"] = False
-                        # Masterwerte der Mutter in neue Hauptzeile übernehmen
-                        for c in master_cols:
-                            new[c] = df.at[i, c]
-                        new_rows.append(new)
-                else:
-                    # Keine nutzbaren Subs -> Subs entfernen, Mutter bleibt
-                    drop_idx.extend(sub_idxs)
-                    df.at[i, "Mehrschichtiges Element"] = False
-            else:
-                df.at[i, "Mehrschichtiges Element"] = False
-
-            i = j
-        else:
-            i += 1
-
-    if drop_idx:
-        df.drop(index=drop_idx, inplace=True)
+    gi = _anchor_groups(df[master_cols].notna().all(axis=1))
+    n = len(df)
+    na_col = pd.Series(pd.NA, index=df.index, dtype=object)
+    ebkph = df["eBKP-H"] if "eBKP-H" in df.columns else na_col
+    ebkph_sub = df["eBKP-H Sub"] if "eBKP-H Sub" in df.columns else na_col
+
+    def _treppe(s: pd.Series) -> np.ndarray:
+        return s.astype(str).str.contains("Treppe", regex=False).to_numpy()
+
+    def _valid(s: pd.Series) -> np.ndarray:
+        txt = s.astype(str)
+        return (
+            s.notna() & txt.str.strip().ne("") & ~txt.isin(["Nicht klassifiziert", "Keine Zuordnung"])
+        ).to_numpy()
+
+    row_treppe = np.zeros(n, dtype=bool)
+    if "eBKP-H Sub" in df.columns:
+        row_treppe |= _treppe(ebkph_sub)
+    if "eBKP-H" in df.columns:
+        row_treppe |= _treppe(ebkph)
+    usable = _valid(ebkph_sub) | _valid(ebkph)
+
+    is_sub = gi.is_sub
+    has_subs = gi.sub_counts > 0
+    mother_treppe = _treppe(ebkph)[gi.mother_pos] if "eBKP-H" in df.columns else np.zeros(gi.n_groups, dtype=bool)
+    treppe_grp = has_subs & (mother_treppe | gi.group_any(row_treppe))
+    usable_grp = has_subs & ~treppe_grp & gi.group_any(usable)
+    unusable_grp = has_subs & ~treppe_grp & ~usable_grp
+
+    sub_treppe_grp = gi.broadcast(treppe_grp, fill=False).astype(bool)
+    sub_usable_grp = gi.broadcast(usable_grp, fill=False).astype(bool)
+    sub_unusable_grp = gi.broadcast(unusable_grp, fill=False).astype(bool)
+
+    # Treppe: Mutter NIE droppen; Subs mit Treppe ggf. droppen
+    drop_mask = np.zeros(n, dtype=bool)
+    if drop_treppe_sub:
+        treppe_drop = is_sub & sub_treppe_grp & row_treppe
+        drop_mask |= treppe_drop
+        stats["treppe_subs_dropped"] += int(treppe_drop.sum())
+
+    # Mutter droppen und nutzbare Subs zu neuen (Haupt-)Zeilen erheben
+    drop_mask[gi.mother_pos[usable_grp]] = True
+    stats["mothers_dropped"] += int(usable_grp.sum())
+    promote_pos = np.flatnonzero(is_sub & sub_usable_grp & usable)
+    new_rows = df.iloc[promote_pos].copy()
+    new_rows["Mehrschichtiges Element"] = False
+    if master_cols and len(promote_pos):
+        ctx = gi.gather_frame(df, master_cols, promote_pos)
+        for j, c in enumerate(master_cols):
+            new_rows[c] = pd.Series(ctx[:, j], index=new_rows.index).infer_objects()
+
+    # Keine nutzbaren Subs -> Subs entfernen, Mutter bleibt (nicht mehrschichtig)
+    drop_mask |= is_sub & sub_unusable_grp
+    flag_pos = gi.mother_pos[~treppe_grp & ~usable_grp]
+    df.loc[df.index[flag_pos], "Mehrschichtiges Element"] = False
+
+    if drop_mask.any():
+        df.drop(index=df.index[drop_mask], inplace=True)
         df.reset_index(drop=True, inplace=True)
-    if new_rows:
-        df = pd.concat([df, pd.DataFrame(new_rows)], ignore_index=True)
+    if len(new_rows):
+        df = pd.concat([df, new_rows], ignore_index=True)
 
     # 6) Konfigurator anwenden (nur Paare mit "... Sub")
-    if config and group_col and group_col in df.columns:
-        i = 0
-        while i < len(df):
-            # Mutter als Anker
-            if not df.at[i, "Mehrschichtiges Element"]:
-                j = i + 1
-                sub_idxs = []
-                while j < len(df) and df.at[j, "Mehrschichtiges Element"]:
-                    sub_idxs.append(j)
-                    j += 1
-                grp = df.at[i, group_col]
-                grp_cfg = config.get(grp, {})
-                for idx in sub_idxs:
-                    for base in sub_pairs:
-                        # Reihenfolge: Gruppen-Override -> globaler Default -> Auto
-                        choice = grp_cfg.get(base, (global_sources_per_pair or {}).get(base, "Auto"))
-                        sub_col = f"{base} Sub"
-                        if choice == "Mutter":
-                            df.at[idx, base] = df.at[i, base]
-                        elif choice == "Sub":
-                            if sub_col in df.columns and has_value(df.at[idx, sub_col]):
-                                df.at[idx, base] = df.at[idx, sub_col]
-                        else:
-                            # Auto: Standardverhalten -> Sub wenn vorhanden, sonst lassen
-                            if sub_col in df.columns and has_value(df.at[idx, sub_col]):
-                                df.at[idx, base] = df.at[idx, sub_col]
-                i = j
-            else:
-                i += 1
-    else:
-        # Fallback: Sub-Werte ins Basisfeld, wenn vorhanden
-        for idx, row in df.iterrows():
-            if row.get("Mehrschichtiges Element", False):
-                for base in sub_pairs:
-                    sub_col = f"{base} Sub"
-                    if sub_col in df.columns and has_value(row[sub_col]):
-                        df.at[idx, base] = row[sub_col]
+    #    Auswahl je (Gruppe, Feld): Gruppen-Override -> globaler Default -> Auto,
+    #    als Tabelle an die Sub-Zeilen gejoint und je Feld per Maske aufgelöst
+    if sub_pairs:
+        sub_cols = [f"{base} Sub" for base in sub_pairs]
+        has_sub_val = ~blank_mask(df[sub_cols])
+        sub_vals = df[sub_cols].to_numpy(dtype=object)
+        if config and group_col and group_col in df.columns:
+            # Mutter als Anker: jede nicht mehrschichtige Zeile
+            gi = GroupIndex.from_flags(~df["Mehrschichtiges Element"], df["Mehrschichtiges Element"])
+            rows = gi.sub_pos
+            defaults = {base: (global_sources_per_pair or {}).get(base, "Auto") for base in sub_pairs}
+            choice_table = pd.DataFrame(
+                [[cfg.get(base, defaults[base]) for base in sub_pairs] for cfg in config.values()],
+                index=pd.Index(list(config.keys()), dtype=object),
+                columns=sub_pairs,
+            )
+            grp = pd.Index(gi.gather(df[group_col], rows), dtype=object)
+            choices = choice_table.reindex(grp).fillna(defaults).to_numpy(dtype=object)
+
+            from_mother = choices == "Mutter"
+            # Sub und Auto: Sub-Wert übernehmen, wenn vorhanden
+            from_sub = ~from_mother & has_sub_val[rows]
+            src = np.where(from_mother, gi.gather_frame(df, sub_pairs, rows), sub_vals[rows])
+            fill_rows(df, sub_pairs, rows, from_mother | from_sub, src)
+        else:
+            # Fallback: Sub-Werte ins Basisfeld, wenn vorhanden
+            rows = np.flatnonzero(df["Mehrschichtiges Element"].to_numpy(dtype=bool))
+            fill_rows(df, sub_pairs, rows, has_sub_val[rows], sub_vals[rows])
 
     # 7) Sub-Spalten entfernen
     df.drop(columns=[c for c in df.columns if c.endswith(" Sub")], inplace=True, errors="ignore")
@@ -235,24 +216,121 @@ def clean_dataframe(
     df.reset_index(drop=True, inplace=True)
 
     # 9) Echte Duplikate (identische GUID-Rekorde) entfernen
+    #    Gruppe je GUID gilt als identisch, wenn jede Spalte hoechstens einen Wert hat
     def remove_exact_duplicates(d: pd.DataFrame) -> pd.DataFrame:
         if "GUID" not in d.columns:
             return d
-        drop = []
-        for guid, grp in d.groupby("GUID"):
-            if len(grp) > 1 and all(n <= 1 for n in grp.nunique().values):
-                drop.extend(grp.index.tolist()[1:])
-        return d.drop(index=drop).reset_index(drop=True)
+        nunique = d.groupby("GUID", sort=False).nunique()
+        identical = nunique.index[(nunique <= 1).all(axis=1)]
+        drop = d["GUID"].isin(identical) & d["GUID"].duplicated(keep="first")
+        return d.loc[~drop.to_numpy(dtype=bool)].reset_index(drop=True)
 
-    df = remove_exact_duplicates(df)
+    raw = df
+    if guid_groups is None:
+        df = remove_exact_duplicates(df)
 
     # 10) Standardisieren & Werte bereinigen
     df = rename_columns_to_standard(df)
-    df = clean_columns_values(df, delete_enabled, custom_chars)
+    df = clean_columns_values(df, delete_enabled, custom_chars, warn_empty=warn_empty)
+
+    if guid_groups is not None and "GUID" in raw.columns:
+        # Werte vor Schritt 10 vergleichen (wie remove_exact_duplicates); Schluessel ist die
+        # ausgegebene GUID, damit stream_clean die Zeilen spaeter zuordnen kann
+        guid_groups.update(df["GUID"].to_numpy(), raw)
 
     return df, stats
 
 
+def stream_clean(
+    file,
+    buffer,
+    header_row: int,
+    columns: list,
+    fmt: str = "xlsx",
+    chunk_size: int = 20000,
+    on_chunk=None,
+    **options,
+) -> Tuple[int, Dict[str, Any], int]:
+    """
+    Streaming-Variante von clean_dataframe fuer Exporte, die nicht in den Speicher passen.
+    - Blatt chunkweise (read-only) lesen, Chunks nur an Muttergrenzen schneiden
+    - Durchgang 1: jeden Chunk mit clean_dataframe bereinigen (ohne Schritt 9) und in eine
+      temporaere Datei auslagern; GUID-Gruppen chunkuebergreifend in GroupIdentity sammeln
+    - Durchgang 2: Schritt 9 ueber die ganze Tabelle anwenden (Folge-Vorkommen identischer
+      GUID-Gruppen entfernen, das erste bleibt) und in den Writer schreiben
+    Promotete Subs stehen am Ende ihres Chunks statt am Ende der Tabelle.
+    Rueckgabe: (geschriebene Zeilen, summierte Stats, entfernte Duplikate).
+    """
+    master_cols = [c for c in MASTER_COLS if c in columns]
+
+    def can_start(chunk: pd.DataFrame) -> np.ndarray:
+        # Nur vor Hauptzeilen ohne Subs schneiden, die Schritt 3/5 sicher ueberstehen:
+        # Subs ab Schritt 6 suchen ihren Anker nie ueber eine solche Zeile hinweg.
+        is_sub = chunk[master_cols].isna().all(axis=1).to_numpy()
+        next_sub = np.append(is_sub[1:], True)
+        stable = ~is_sub & ~next_sub
+        if "eBKP-H" in chunk.columns:
+            stable &= ~chunk["eBKP-H"].eq("Nicht klassifiziert").fillna(False).to_numpy(dtype=bool)
+        return stable
+
+    stats = {"inherited_ebkph": 0, "mothers_dropped": 0, "treppe_subs_dropped": 0}
+    groups = GroupIdentity()
+    removed = 0
+    writer = None
+
+    def open_writer(cols) -> StreamingTableWriter:
+        numeric = [c for c in cols if c in COLUMN_PRESET]
+        return StreamingTableWriter(buffer, list(cols), sheet_name="Sheet1", fmt=fmt, numeric_columns=numeric)
+
+    with tempfile.TemporaryFile() as spill:
+        n_parts = 0
+        chunks = iter_sheet_chunks(file, header_row=header_row, columns=columns, chunk_size=chunk_size)
+        for chunk in iter_group_chunks(chunks, can_start):
+            part, part_stats = clean_dataframe(chunk, warn_empty=False, guid_groups=groups, **options)
+            for k, v in part_stats.items():
+                stats[k] += v
+            pickle.dump(convert_quantity_columns(part), spill, protocol=pickle.HIGHEST_PROTOCOL)
+            n_parts += 1
+
+        spill.seek(0)
+        try:
+            for _ in range(n_parts):
+                part = pickle.load(spill)
+                if "GUID" in part.columns:
+                    dup = groups.drop_mask(part["GUID"].to_numpy())
+                    if dup.any():
+                        removed += int(dup.sum())
+                        part = part.loc[~dup].reset_index(drop=True)
+                if writer is None:
+                    writer = open_writer(part.columns)
+                writer.append(part)
+                if on_chunk is not None:
+                    on_chunk(writer.rows_written)
+            if writer is None:
+                writer = open_writer(columns)
+        finally:
+            if writer is not None:
+                writer.close()
+    return writer.rows_written, stats, removed
+
+
+def _read_preview(file, header_row: int, columns: list, nrows: int = 15) -> pd.DataFrame:
+    """Erste Datenzeilen ohne Vollimport."""
+    chunks = iter_sheet_chunks(file, header_row=header_row, columns=columns, chunk_size=nrows)
+    try:
+        return next(chunks, pd.DataFrame(columns=columns))
+    finally:
+        chunks.close()
+
+
+def _scan_groups(file, header_row: int, columns: list, group_col: str) -> list:
+    """Eindeutige Werte der Gruppierungsspalte in einem Lesedurchlauf (konstanter Speicher)."""
+    values = set()
+    for chunk in iter_sheet_chunks(file, header_row=header_row, columns=columns):
+        values.update(chunk[group_col].dropna().unique().tolist())
+    return sorted(values)
+
+
 def app(supplement_name, delete_enabled, custom_chars):
     st.header("Mehrschichtig Bereinigen")
     st.markdown("""
@@ -266,19 +344,33 @@ def app(supplement_name, delete_enabled, custom_chars):
     if not uploaded_file:
         return
 
+    # Vor dem Vollimport entscheiden: grosse Exporte chunkweise verarbeiten
+    streaming = st.checkbox(
+        "Streaming-Modus (sehr grosse Exporte, ohne Vollimport)",
+        value=False,
+        key="bereinigen_streaming",
+        help="Liest das Blatt chunkweise, schneidet nur an Muttergrenzen und schreibt direkt in die Ausgabe."
+    )
+
+    df = None
     try:
-        df = pd.read_excel(uploaded_file, engine="openpyxl")
+        if streaming:
+            header_row, columns = detect_sheet_header(uploaded_file)
+            df_preview = _read_preview(uploaded_file, header_row, columns)
+        else:
+            df = pd.read_excel(uploaded_file, engine="openpyxl")
+            columns, df_preview = list(df.columns), df.head(15)
     except Exception as e:
         st.error(f"Fehler beim Einlesen: {e}")
         return
 
     st.subheader("Originale Daten (15 Zeilen)")
-    st.dataframe(df.head(15), width="stretch")
+    st.dataframe(df_preview, width="stretch")
 
     # --- Gruppierungsspalte wählen ---
     group_col = st.selectbox(
         "Spalte für Gruppierung wählen",
-        [c for c in df.columns if c != "GUID"],
+        [c for c in columns if c != "GUID"],
         index=0,
         key="group_col_select"
     )
@@ -286,8 +378,8 @@ def app(supplement_name, delete_enabled, custom_chars):
     # --- Paare ermitteln: nur Basisspalten mit '... Sub' ---
     options = ["Auto", "Mutter", "Sub"]
     pair_bases = sorted({
-        base for col in df.columns
-        if col.endswith(" Sub") and (base := col[:-4]) in df.columns and base != "GUID"
+        base for col in columns
+        if col.endswith(" Sub") and (base := col[:-4]) in columns and base != "GUID"
     })
 
     if "config_sources" not in st.session_state:
@@ -324,7 +416,18 @@ def app(supplement_name, delete_enabled, custom_chars):
     # --- Gruppen (Abweichungen) ---
     st.markdown("### Gruppen-Konfigurator (Abweichungen von global)")
     config: Dict[str, Dict[str, str]] = {}
-    groups = sorted(df[group_col].dropna().unique()) if group_col in df.columns else []
+    if group_col not in columns:
+        groups = []
+    elif streaming:
+        # Gruppenwerte je Datei/Spalte nur einmal scannen
+        scan_key = (getattr(uploaded_file, "file_id", uploaded_file.name), group_col)
+        if st.session_state.get("bereinigen_group_scan", (None, None))[0] != scan_key:
+            st.session_state.bereinigen_group_scan = (
+                scan_key, _scan_groups(uploaded_file, header_row, columns, group_col)
+            )
+        groups = st.session_state.bereinigen_group_scan[1]
+    else:
+        groups = sorted(df[group_col].dropna().unique())
     cols_layout = st.columns(2) if len(groups) > 1 else [st]
 
     for gi, group in enumerate(groups):
@@ -372,32 +475,32 @@ def app(supplement_name, delete_enabled, custom_chars):
         value=True
     )
 
+    clean_options = dict(
+        delete_enabled=delete_enabled,
+        custom_chars=custom_chars,
+        match_sub_toggle=use_match,
+        drop_treppe_sub=drop_treppe,
+        config=config,
+        group_col=group_col,
+        inherit_mother_ebkph_if_sub_missing=inherit_mother_ebkph,
+        global_sources_per_pair=st.session_state.global_sources_per_pair,
+    )
+
+    if streaming:
+        formats = ["xlsx", "parquet"] if pq is not None else ["xlsx"]
+        fmt = st.radio("Ausgabeformat", formats, horizontal=True, key="bereinigen_stream_format")
+        if st.button("Streaming-Verarbeitung starten"):
+            _run_stream(uploaded_file, header_row, columns, fmt, supplement_name, overrides, clean_options)
+        return
+
     # --- Verarbeitung starten ---
     if st.button("Verarbeitung starten"):
         with st.spinner("Daten werden bereinigt ..."):
-            df_clean, stats = clean_dataframe(
-                df.copy(),
-                delete_enabled=delete_enabled,
-                custom_chars=custom_chars,
-                match_sub_toggle=use_match,
-                drop_treppe_sub=drop_treppe,
-                config=config,
-                group_col=group_col,
-                inherit_mother_ebkph_if_sub_missing=inherit_mother_ebkph,
-                global_sources_per_pair=st.session_state.global_sources_per_pair,
-            )
+            df_clean, stats = clean_dataframe(df.copy(), **clean_options)
 
         st.subheader("Bereinigte Daten (15 Zeilen)")
         st.dataframe(df_clean.head(15), width="stretch")
-
-        # Log / KPIs
-        col_a, col_b, col_c = st.columns(3)
-        col_a.metric("Vererbte eBKP-H an Subs", stats["inherited_ebkph"])
-        col_b.metric("Gedroppte Mütter", stats["mothers_dropped"])
-        col_c.metric("Gedroppte Treppen-Subs", stats["treppe_subs_dropped"])
-        if overrides:
-            st.markdown("**Abweichungen von globalen Defaults:**")
-            st.dataframe(pd.DataFrame(overrides), width="stretch")
+        _show_stats(stats, overrides)
 
         # Export mit Float-Spalten (Mengen)
         output = io.BytesIO()
@@ -413,3 +516,50 @@ def app(supplement_name, delete_enabled, custom_chars):
             file_name=file_name,
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         )
+
+
+def _show_stats(stats: Dict[str, Any], overrides: list) -> None:
+    """Log / KPIs"""
+    col_a, col_b, col_c = st.columns(3)
+    col_a.metric("Vererbte eBKP-H an Subs", stats["inherited_ebkph"])
+    col_b.metric("Gedroppte Mütter", stats["mothers_dropped"])
+    col_c.metric("Gedroppte Treppen-Subs", stats["treppe_subs_dropped"])
+    if overrides:
+        st.markdown("**Abweichungen von globalen Defaults:**")
+        st.dataframe(pd.DataFrame(overrides), width="stretch")
+
+
+def _run_stream(uploaded_file, header_row, columns, fmt, supplement_name, overrides, clean_options) -> None:
+    """Streaming-Verarbeitung mit Fortschrittsanzeige und Download."""
+    status = st.empty()
+    output = io.BytesIO()
+    try:
+        with st.spinner("Daten werden chunkweise bereinigt ..."):
+            rows, stats, removed = stream_clean(
+                uploaded_file, output, header_row, columns, fmt=fmt,
+                on_chunk=lambda n: status.caption(f"{n} Zeilen geschrieben ..."),
+                **clean_options,
+            )
+    except Exception as e:
+        st.error(f"Fehler bei der Streaming-Verarbeitung: {e}")
+        return
+
+    status.empty()
+    st.success(f"Streaming-Verarbeitung abgeschlossen: {rows} Zeilen.")
+    _show_stats(stats, overrides)
+    if removed:
+        st.info(f"Identische GUID-Rekorde über Chunks entfernt: {removed} Zeilen.")
+
+    output.seek(0)
+    base = (supplement_name or '').strip() or 'default'
+    if fmt == "parquet":
+        file_name, mime = f"{base}_bereinigt.parquet", "application/octet-stream"
+    else:
+        file_name = f"{base}_bereinigt.xlsx"
+        mime = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    st.download_button(
+        "Bereinigte Datei herunterladen",
+        data=output,
+        file_name=file_name,
+        mime=mime
+    )
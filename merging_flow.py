@@ -1,8 +1,17 @@
 import streamlit as st
 import pandas as pd
 import io
-import openpyxl
-from excel_utils import detect_header_row, rename_columns_to_standard
+from excel_utils import (
+    apply_column_schema,
+    detect_sheet_header,
+    iter_sheet_chunks,
+    unwanted_tokens_pattern,
+    remove_unwanted_tokens,
+    coalesce_measures,
+    rename_columns_to_standard,
+    iter_parallel,
+    get_worker_count,
+)
 
 
 def app(supplement_name, delete_enabled, custom_chars):
@@ -57,11 +66,17 @@ def app(supplement_name, delete_enabled, custom_chars):
         if st.button("Spaltennamen laden", key="flow_load_columns"):
             cols = []
             exclude = ["Teilprojekt", "Geschoss", "Gebäude", "Baufeld", "eBKP-H", "Unter Terrain"]
-            for key, (f, sheet) in st.session_state.flow_file_sheets.items():
-                df_raw = pd.read_excel(f, sheet_name=sheet, header=None, engine="openpyxl")
-                hr = detect_header_row(df_raw)
-                df = pd.read_excel(f, sheet_name=sheet, header=hr, engine="openpyxl")
-                cols.extend(df.columns.tolist())
+            items = list(st.session_state.flow_file_sheets.items())
+            progress = st.progress(0)
+            jobs = [(f.getvalue(), sheet) for _, (f, sheet) in items]
+            for idx, sheet_cols, err in iter_parallel(
+                _read_sheet_columns, jobs, get_worker_count(),
+                on_progress=lambda done, n: progress.progress(done / n)
+            ):
+                if err is not None:
+                    st.error(f"Fehler bei {items[idx][0]}: {err}")
+                    continue
+                cols.extend(sheet_cols)
             # Einzigartig und ausschliessen
             unique = [c for c in dict.fromkeys(cols) if c not in exclude]
             st.session_state.flow_all_columns = unique
@@ -79,36 +94,22 @@ def app(supplement_name, delete_enabled, custom_chars):
 
         # Schritt 4: Merge und Master-Tabelle per Button
         if st.button("Flow Merge & Download", key="flow_run_merge"):
-            merged_data = []
-            for identifier, (f, sheet) in st.session_state.flow_file_sheets.items():
-                wb = openpyxl.load_workbook(f, data_only=True)
-                ws = wb[sheet]
-                headers = [cell.value for cell in ws[1]]
-                for row in ws.iter_rows(min_row=2, values_only=True):
-                    rd = dict(zip(headers, row))
-                    # Werte bereinigen & mergen
-                    for k, v in list(rd.items()):
-                        rd[k] = _clean_value(v, delete_enabled, custom_chars)
-                    for m, cols in hierarchies.items():
-                        if not cols:
-                            continue
-                        val = next((rd.get(c) for c in cols if rd.get(c) not in (None, "", 0, 0.0)), None)
-                        name = {
-                            "Flaeche": "Fläche (m2)",
-                            "Laenge": "Länge (m)",
-                            "Dicke": "Dicke (m)",
-                            "Hoehe": "Höhe (m)",
-                            "Volumen": "Volumen (m3)"
-                        }[m]
-                        rd[name] = val
-                    # Ursprungs-Spalten entfernen
-                    used = [c for cols in hierarchies.values() for c in cols]
-                    for u in used:
-                        rd.pop(u, None)
-                    merged_data.append(rd)
+            frames = []
+            items = list(st.session_state.flow_file_sheets.items())
+            progress = st.progress(0)
+            jobs = [(f.getvalue(), sheet, hierarchies, delete_enabled, custom_chars) for _, (f, sheet) in items]
+            for idx, df_sheet, err in iter_parallel(
+                _read_flow_frame, jobs, get_worker_count(),
+                on_progress=lambda done, n: progress.progress(done / n)
+            ):
+                if err is not None:
+                    st.error(f"Fehler bei {items[idx][0]}: {err}")
+                    continue
+                frames.append(df_sheet)
 
-            # Master DataFrame und Download
-            df_master = pd.DataFrame(merged_data)
+            # Master DataFrame (einmal concat) und Download
+            df_master = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+            frames.clear()
             df_master = rename_columns_to_standard(df_master)
             out = io.BytesIO()
             with pd.ExcelWriter(out, engine="openpyxl") as writer:
@@ -122,17 +123,50 @@ def app(supplement_name, delete_enabled, custom_chars):
             )
 
 
-def _clean_value(value, delete_enabled, custom_chars):
-    if isinstance(value, str):
-        unwanted = [" m2", " m3", " m", "Nicht klassifiziert", "---"]
-        if delete_enabled and custom_chars.strip():
-            unwanted += [x.strip() for x in custom_chars.split(',') if x.strip()]
-        for u in unwanted:
-            value = value.replace(u, "")
-    try:
-        num = float(value)
-        if num == 0.0:
-            return None
-        return num
-    except:
-        return value
+def _read_sheet_columns(data, sheet):
+    """Worker: Spaltennamen eines Blatts; liest read-only nur die ersten Zeilen."""
+    _, columns = detect_sheet_header(io.BytesIO(data), sheet)
+    return columns
+
+
+def _clean_flow_frame(df, pattern):
+    """
+    Spaltenweise wie früher pro Zelle: Tokens aus Texten entfernen,
+    numerisch lesbare Werte als float, 0 ⇒ None, Rest unverändert.
+    """
+    df = remove_unwanted_tokens(df, pattern)
+    for col in df.columns:
+        s = df[col]
+        if pd.api.types.is_numeric_dtype(s.dtype) and not pd.api.types.is_bool_dtype(s.dtype):
+            df[col] = s.astype(float).mask(s.eq(0))
+            continue
+        if not (pd.api.types.is_object_dtype(s.dtype) or pd.api.types.is_string_dtype(s.dtype)):
+            continue
+        num = pd.to_numeric(s, errors="coerce")
+        if num.isna().all() and not s.isna().all():
+            continue
+        out = s.astype(object).where(num.isna(), num)
+        df[col] = out.mask(num.eq(0), None).infer_objects()
+    return df
+
+
+def _read_flow_frame(data, sheet, hierarchies, delete_enabled, custom_chars):
+    """
+    Worker: Blatt mit erkanntem Header chunkweise (read-only) lesen,
+    spaltenweise bereinigen, Mengen je Hierarchie zusammenführen und
+    Quellspalten entfernen. Rückgabe: DataFrame des Blatts.
+    """
+    pattern = unwanted_tokens_pattern(delete_enabled, custom_chars)
+    used = [c for cols in hierarchies.values() for c in cols]
+    header_row, columns = detect_sheet_header(io.BytesIO(data), sheet)
+    parts = []
+    for chunk in iter_sheet_chunks(io.BytesIO(data), sheet, header_row=header_row, columns=columns):
+        # Mengen aus den Rohwerten (Einheiten noch vorhanden) zusammenführen
+        merged = coalesce_measures(chunk, hierarchies)
+        chunk = _clean_flow_frame(chunk.drop(columns=used, errors="ignore"), pattern)
+        for name in merged.columns:
+            chunk[name] = merged[name]
+        parts.append(chunk)
+    if not parts:
+        return pd.DataFrame()
+    return apply_column_schema(pd.concat(parts, ignore_index=True))
@@ -2,14 +2,75 @@ import streamlit as st
 import pandas as pd
 import io
 from excel_utils import (
-    detect_header_row,
     apply_preset_hierarchy,
     prepend_values_cleaning,
     rename_columns_to_standard,
-    convert_size_to_m,
-    convert_quantity_columns
+    coalesce_measures,
+    convert_quantity_columns,
+    iter_parallel,
+    get_worker_count,
+    WorkbookModel,
 )
 
+def _merge_values_sheet(df_sheet, is_selected, hierarchies, delete_enabled, custom_chars):
+    """
+    Worker: Blatt aus dem Arbeitsmappen-Modell exportfertig machen.
+    Beim gewählten (bereits grundbereinigten) Blatt werden die
+    Mengenspalten gemergt. Rückgabe: export-fertiges DataFrame.
+    """
+    df_sheet = df_sheet.copy()
+    if is_selected:
+        # 4.x) optionale Custom-Chars in den Quell-Spalten löschen
+        if delete_enabled and custom_chars:
+            for hierarchy in hierarchies.values():
+                for src in hierarchy:
+                    if src in df_sheet.columns:
+                        for ch in custom_chars.split(","):
+                            df_sheet[src] = (
+                                df_sheet[src]
+                                .astype(str)
+                                .str.replace(ch, "", regex=False)
+                            )
+
+        # 4.1) Quellen einmal parsen (0 ⇒ leer) und je Mass zusammenführen
+        merged = coalesce_measures(df_sheet, hierarchies)
+        for new_name in merged.columns:
+            df_sheet[new_name] = merged[new_name]
+
+        # 4.2) Reorder: neue Spalten am kleinsten Index der Quellen einfügen
+        cols_before = list(df_sheet.columns)
+        src_cols = [
+            src for hierarchy in hierarchies.values()
+            for src in hierarchy if src in cols_before
+        ]
+        indices = [cols_before.index(c) for c in src_cols] if src_cols else []
+        if indices:
+            insert_at = min(indices)
+            merged_names = [
+                name for name in
+                ("Fläche (m2)", "Länge (m)", "Dicke (m)", "Höhe (m)", "Volumen (m3)")
+                if name in df_sheet.columns
+            ]
+            # Drop aller Quell-Spalten
+            df_sheet.drop(columns=src_cols, inplace=True)
+            # Neuordnung
+            cols_after = list(df_sheet.columns)
+            for name in merged_names:
+                cols_after.remove(name)
+            for i, name in enumerate(merged_names):
+                cols_after.insert(insert_at + i, name)
+            df_sheet = df_sheet[cols_after]
+        else:
+            # Drop, wenn keine Quellen
+            df_sheet.drop(
+                columns=[c for cols in hierarchies.values() for c in cols
+                         if c in df_sheet.columns],
+                inplace=True
+            )
+
+    return convert_quantity_columns(df_sheet.copy())
+
+
 def app(supplement_name, delete_enabled, custom_chars):
     # Datei-Supplement aus main.py übernehmen, sonst Sheet- oder Dateiname
     state = st.session_state
@@ -29,14 +90,20 @@ def app(supplement_name, delete_enabled, custom_chars):
     # Session-State initialisieren
     if "uploaded_file_values" not in state:
         state.uploaded_file_values = None
+    if "workbook_values" not in state:
+        state.workbook_values = None
     if "sheet_names_values" not in state:
         state.sheet_names_values = []
     if "selected_sheet_values" not in state:
         state.selected_sheet_values = None
     if "header_row_values" not in state:
         state.header_row_values = None
+    if "df_original_values" not in state:
+        state.df_original_values = None
     if "df_values" not in state:
         state.df_values = None
+    if "clean_params_values" not in state:
+        state.clean_params_values = None
     if "all_columns_values" not in state:
         state.all_columns_values = []
     if "hierarchies_values" not in state:
@@ -49,52 +116,48 @@ def app(supplement_name, delete_enabled, custom_chars):
     if not uploaded_file:
         return
 
-    # Bei neuem Upload State zurücksetzen
-    if state.uploaded_file_values is not uploaded_file:
+    # Bei neuem Upload: Arbeitsmappe einmal parsen, State zurücksetzen
+    file_id = getattr(uploaded_file, "file_id", uploaded_file.name)
+    if state.get("uploaded_file_id_values") != file_id:
+        state.uploaded_file_id_values = file_id
         state.uploaded_file_values = uploaded_file
-        xls = pd.ExcelFile(uploaded_file, engine="openpyxl")
-        state.sheet_names_values = xls.sheet_names
+        state.workbook_values = WorkbookModel.load(uploaded_file)
+        state.sheet_names_values = state.workbook_values.sheet_names
         state.selected_sheet_values = None
+        state.df_original_values = None
         state.df_values = None
         state.all_columns_values = []
         state.hierarchies_values = {"Dicke": [], "Flaeche": [], "Volumen": [], "Laenge": [], "Hoehe": []}
+    model = state.workbook_values
 
     # Sheet wählen
     selected_sheet = st.selectbox(
         "Arbeitsblatt wählen", state.sheet_names_values, key="values_sheet_select"
     )
-    if not selected_sheet or selected_sheet == state.selected_sheet_values:
+    if not selected_sheet:
         return
-    state.selected_sheet_values = selected_sheet
-
-    # 1) Original einlesen
-    df_raw = pd.read_excel(
-        state.uploaded_file_values,
-        sheet_name=selected_sheet,
-        header=None,
-        engine="openpyxl"
-    )
-    header_row = detect_header_row(df_raw)
-    df_original = pd.read_excel(
-        state.uploaded_file_values,
-        sheet_name=selected_sheet,
-        header=header_row,
-        engine="openpyxl"
-    )
-    state.header_row_values = header_row
+
+    # 1) Original aus dem Modell (nur bei Blattwechsel neu aufbauen)
+    if selected_sheet != state.selected_sheet_values:
+        state.selected_sheet_values = selected_sheet
+        state.header_row_values = model.header_rows[selected_sheet]
+        state.df_original_values = model.frame(selected_sheet, state.header_row_values)
+        state.clean_params_values = None
+
+    # 2) Grund-Bereinigung (neu nur bei geänderten Bereinigungs-Optionen)
+    clean_params = (delete_enabled, custom_chars)
+    if state.clean_params_values != clean_params:
+        state.clean_params_values = clean_params
+        state.df_values = prepend_values_cleaning(state.df_original_values, delete_enabled, custom_chars)
+        state.all_columns_values = list(state.df_values.columns)
+        state.hierarchies_values = apply_preset_hierarchy(state.df_values, state.hierarchies_values)
 
     st.subheader("Originale Daten (5 Zeilen)")
-    st.markdown(f"**Erkannter Header:** Zeile {header_row+1}")
-    st.dataframe(df_original.head(5))
+    st.markdown(f"**Erkannter Header:** Zeile {state.header_row_values+1}")
+    st.dataframe(state.df_original_values.head(5))
 
-    # 2) Grund-Bereinigung
-    df_clean = prepend_values_cleaning(df_original, delete_enabled, custom_chars)
     st.subheader("Bereinigte Daten (5 Zeilen)")
-    st.dataframe(df_clean.head(5))
-
-    state.df_values = df_clean
-    state.all_columns_values = list(df_clean.columns)
-    state.hierarchies_values = apply_preset_hierarchy(df_clean, state.hierarchies_values)
+    st.dataframe(state.df_values.head(5))
 
     # 3) Hierarchie-Auswahl
     st.markdown("### Hierarchie der Hauptmengenspalten festlegen")
@@ -122,85 +185,30 @@ def app(supplement_name, delete_enabled, custom_chars):
 
     # 4) Merge & Download
     if st.button("Merge und Download", key="values_merge_button"):
+        # Blätter unabhängig voneinander (parallel) aus dem Modell verarbeiten
+        sheets = state.sheet_names_values
+        jobs = [
+            (state.df_values if sheet == state.selected_sheet_values else model.frame(sheet, 0),
+             sheet == state.selected_sheet_values,
+             state.hierarchies_values, delete_enabled, custom_chars)
+            for sheet in sheets
+        ]
+        progress = st.progress(0)
+        results = iter_parallel(
+            _merge_values_sheet, jobs, get_worker_count(),
+            on_progress=lambda done, n: progress.progress(done / n)
+        )
+
+        # Ergebnisse in Blatt-Reihenfolge schreiben, Frames für die Vorschau behalten
+        merged_frames = []
         out = io.BytesIO()
         with pd.ExcelWriter(out, engine="openpyxl") as writer:
-            for sheet in state.sheet_names_values:
-                df_sheet = pd.read_excel(
-                    state.uploaded_file_values,
-                    sheet_name=sheet,
-                    header=state.header_row_values if sheet == state.selected_sheet_values else 0,
-                    engine="openpyxl"
-                )
-                if sheet == state.selected_sheet_values:
-                    # Grund-Bereinigung auf das Sheet
-                    df_sheet = prepend_values_cleaning(df_sheet, delete_enabled, custom_chars)
-
-
-                    # 4.x) Quell-Spalten säubern & konvertieren, bevor das Merging startet
-                    for measure, hierarchy in state.hierarchies_values.items():
-                        for src in hierarchy:
-                            if src in df_sheet.columns:
-                                # optionale Custom-Chars löschen
-                                if delete_enabled and custom_chars:
-                                    for ch in custom_chars.split(","):
-                                        df_sheet[src] = (
-                                            df_sheet[src]
-                                            .astype(str)
-                                            .str.replace(ch, "", regex=False)
-                                        )
-                                # Einheitserkennung & -konvertierung (0 mm ⇒ pd.NA)
-                                df_sheet[src] = df_sheet[src].apply(convert_size_to_m)
-                    
-                    # 4.1) Erzeugen und konvertieren der gemergten Spalten
-                    for measure, hierarchy in state.hierarchies_values.items():
-                        if hierarchy:
-                            col0 = df_sheet[hierarchy[0]]
-                            for c in hierarchy[1:]:
-                                col0 = col0.combine_first(df_sheet[c])
-                            new_name = {
-                                "Flaeche": "Fläche (m2)",
-                                "Laenge":  "Länge (m)",
-                                "Dicke":   "Dicke (m)",
-                                "Hoehe":   "Höhe (m)",
-                                "Volumen": "Volumen (m3)"
-                            }[measure]
-                            # direkt mit convert_size_to_m sauber machen
-                            df_sheet[new_name] = col0.apply(convert_size_to_m)
-
-
-                    # 4.2) Reorder: neue Spalten am kleinsten Index der Quellen einfügen
-                    cols_before = list(df_sheet.columns)
-                    src_cols = [
-                        src for hierarchy in state.hierarchies_values.values()
-                        for src in hierarchy if src in cols_before
-                    ]
-                    indices = [cols_before.index(c) for c in src_cols] if src_cols else []
-                    if indices:
-                        insert_at = min(indices)
-                        merged_names = [
-                            name for name in
-                            ("Fläche (m2)", "Länge (m)", "Dicke (m)", "Höhe (m)", "Volumen (m3)")
-                            if name in df_sheet.columns
-                        ]
-                        # Drop aller Quell-Spalten
-                        df_sheet.drop(columns=src_cols, inplace=True)
-                        # Neuordnung
-                        cols_after = list(df_sheet.columns)
-                        for name in merged_names:
-                            cols_after.remove(name)
-                        for i, name in enumerate(merged_names):
-                            cols_after.insert(insert_at + i, name)
-                        df_sheet = df_sheet[cols_after]
-                    else:
-                        # Drop, wenn keine Quellen
-                        df_sheet.drop(
-                            columns=[c for cols in state.hierarchies_values.values() for c in cols
-                                     if c in df_sheet.columns],
-                            inplace=True
-                        )
-                        
-                df_sheet_export = convert_quantity_columns(df_sheet.copy())
-                df_sheet_export.to_excel(writer, sheet_name=sheet, index=False)
+            for i, df_sheet_export, err in results:
+                if err is not None:
+                    st.error(f"Fehler in '{sheets[i]}': {err}")
+                    continue
+                df_sheet_export.to_excel(writer, sheet_name=sheets[i], index=False)
+                merged_frames.append((sheets[i], df_sheet_export))
 
         out.seek(0)
         st.download_button(
@@ -211,8 +219,6 @@ def app(supplement_name, delete_enabled, custom_chars):
         )
 
         st.subheader("Merge-Vorschau")
-        merged_xl = pd.ExcelFile(out, engine="openpyxl")
-        for sh in merged_xl.sheet_names:
-            df_prev = pd.read_excel(merged_xl, sheet_name=sh, nrows=5, engine="openpyxl")
+        for sh, df_prev in merged_frames:
             st.markdown(f"**Sheet: {sh}**")
-            st.dataframe(df_prev)
+            st.dataframe(df_prev.head(5))
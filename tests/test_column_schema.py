@@ -0,0 +1,26 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from excel_utils import WorkbookModel, apply_column_schema
+
+
+def test_measure_columns_from_plain_numbers_become_float():
+    df = pd.DataFrame({
+        "Fläche (m2)": pd.Series([1, 2.5, None], dtype=object),
+        "Volumen (m3)": pd.Series(["1,5 m3", 2.0, None], dtype=object),
+        "Material": pd.Series(["Beton", "Holz", None], dtype=object),
+    })
+    apply_column_schema(df)
+    assert df["Fläche (m2)"].dtype == np.float64
+    assert df["Volumen (m3)"].dtype == object  # Einheiten parst convert_quantity_columns
+    assert pd.api.types.is_string_dtype(df["Material"].dtype) and df["Material"].dtype != object
+
+
+def test_workbook_model_frame_is_typed():
+    buf = io.BytesIO()
+    pd.DataFrame({"GUID": ["A", "B"], "Länge (m)": [1, 2]}).to_excel(buf, index=False)
+    frame = WorkbookModel.load(io.BytesIO(buf.getvalue())).frame("Sheet1")
+    assert frame["GUID"].dtype != object
+    assert frame["Länge (m)"].dtype == np.float64
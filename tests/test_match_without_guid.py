@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+from compare_files import BLOCK_COLS, MATCH_MEASURE_COLS, match_elements_without_guid
+
+
+def _elements(n, **measures):
+    df = pd.DataFrame({"Geschoss": "EG", "eBKP-H": "C02.01 Wand", "Material": "Beton"}, index=range(n))
+    for col in MATCH_MEASURE_COLS:
+        df[col] = measures.get(col, np.nan)
+    return df
+
+
+def _match(old, new):
+    return match_elements_without_guid(old, new, BLOCK_COLS, MATCH_MEASURE_COLS)
+
+
+def test_identical_elements_all_matched():
+    # 20 gleiche Tueren: Gleichstand in allen Mengen
+    old = _elements(20, **{"Volumen (m3)": 0.1, "Fläche (m2)": 2.0, "Höhe (m)": 2.1})
+    new = _elements(20, **{"Volumen (m3)": 0.1, "Fläche (m2)": 2.0, "Höhe (m)": 2.1})
+    old_pos, conf = _match(old, new)
+    assert sorted(old_pos) == list(range(20))
+    assert np.allclose(conf, 1.0)
+
+
+def test_tie_on_first_measure_uses_remaining_measures():
+    # gleiches Volumen, Hoehe unterscheidet; neue Werte leicht veraendert (kein exaktes Paar)
+    heights = np.linspace(2.0, 3.0, 20)
+    old = _elements(20, **{"Volumen (m3)": 0.1})
+    old["Höhe (m)"] = heights
+    new = _elements(20, **{"Volumen (m3)": 0.1})
+    new["Höhe (m)"] = heights[::-1] * 1.001
+    old_pos, conf = _match(old, new)
+    assert list(old_pos) == list(range(19, -1, -1))
+    assert (conf > 0.99).all()
+
+
+def test_missing_first_measure():
+    # Flaechenelemente ohne Volumen: Sortierung nach erster vorhandener Menge
+    areas = np.arange(1, 21, dtype=float)
+    old = _elements(20)
+    old["Fläche (m2)"] = areas
+    new = _elements(20)
+    new["Fläche (m2)"] = areas[::-1] * 1.001
+    old_pos, _ = _match(old, new)
+    assert list(old_pos) == list(range(19, -1, -1))
+
+
+def test_missing_first_measure_with_ties():
+    old = _elements(20, **{"Fläche (m2)": 5.0})
+    new = _elements(20, **{"Fläche (m2)": 5.001})
+    old_pos, conf = _match(old, new)
+    assert sorted(old_pos) == list(range(20))
+    assert (conf > 0.99).all()
+
+
+def test_blocks_are_respected():
+    old = _elements(3, **{"Fläche (m2)": 5.0})
+    new = _elements(3, **{"Fläche (m2)": 5.0})
+    new.loc[2, "Material"] = "Holz"
+    old_pos, conf = _match(old, new)
+    assert sorted(old_pos[:2]) == [0, 1]
+    assert old_pos[2] == -1 and conf[2] == 0.0
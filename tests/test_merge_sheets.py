@@ -0,0 +1,58 @@
+import glob
+import io
+import os
+import tempfile
+
+import openpyxl
+import pandas as pd
+import pytest
+
+import advanced_excel_merge_sheets as ms
+
+
+class _Upload:
+    def __init__(self, name: str, df: pd.DataFrame):
+        buf = io.BytesIO()
+        df.to_excel(buf, index=False)
+        self.name, self._data = name, buf.getvalue()
+
+    def getvalue(self):
+        return self._data
+
+
+class _Progress:
+    def progress(self, *args):
+        pass
+
+
+def _run(monkeypatch, files, workers):
+    shown = {"error": [], "download": []}
+    monkeypatch.setattr(ms.st, "file_uploader", lambda *a, **k: files)
+    monkeypatch.setattr(ms.st, "progress", lambda *a, **k: _Progress())
+    monkeypatch.setattr(ms.st, "error", lambda msg, *a, **k: shown["error"].append(msg))
+    for name in ("header", "markdown", "success"):
+        monkeypatch.setattr(ms.st, name, lambda *a, **k: None)
+    monkeypatch.setattr(ms.st, "download_button", lambda label, data, **k: shown["download"].append(data.getvalue()))
+    monkeypatch.setattr(ms, "get_worker_count", lambda: workers)
+    ms.app("Test", False, "")
+    wb = openpyxl.load_workbook(io.BytesIO(shown["download"][0]))
+    return shown["error"], {ws.title: list(ws.values) for ws in wb}
+
+
+def _files():
+    return [
+        _Upload("a.xlsx", pd.DataFrame({"GUID": [f"A{i}" for i in range(30)], "Name": "Wand"})),
+        _Upload("b.xlsx", pd.DataFrame({"GUID": ["B1"], "Menge": [1.5]})),
+    ]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_merge_to_sheets(monkeypatch, workers):
+    monkeypatch.setattr(ms, "SPILL_BATCH_ROWS", 7)
+    spills = os.path.join(tempfile.gettempdir(), "*.rows")
+    before = set(glob.glob(spills))
+    errors, sheets = _run(monkeypatch, _files(), workers)
+    assert errors == []
+    assert list(sheets) == ["a", "b"]
+    assert len(sheets["a"]) == 31 and sheets["b"] == [("GUID", "Menge"), ("B1", 1.5)]
+    assert set(glob.glob(spills)) == before
@@ -0,0 +1,13 @@
+import excel_utils
+from excel_utils import convert_size_to_m, iter_parallel
+
+
+def test_worker_warnings_reach_main_process(monkeypatch):
+    shown = []
+    monkeypatch.setattr(excel_utils.st, "warning", lambda msg, *a, **k: shown.append(msg))
+    jobs = [("12 mm",), ("abc",), ("3 m",)]
+    results = list(iter_parallel(convert_size_to_m, jobs, max_workers=2))
+    assert [i for i, _, _ in results] == [0, 1, 2]
+    assert [err for _, _, err in results] == [None, None, None]
+    assert results[0][1] == 0.012 and results[2][1] == 3.0
+    assert shown == ["Ungültiges Format in Zelle: 'abc'"]
@@ -0,0 +1,51 @@
+import pandas as pd
+
+import excel_utils
+import vererbung_mengen as vm
+
+
+def test_cache_hit_replays_warnings(monkeypatch):
+    shown = []
+    monkeypatch.setattr(excel_utils.st, "warning", lambda msg, *a, **k: shown.append(msg))
+    monkeypatch.setitem(vm.st.session_state, "process_cache", excel_utils.LRUCache(maxsize=8))
+    df = pd.DataFrame({
+        "Teilprojekt": ["TP1"], "Gebäude": ["G1"], "Geschoss": ["EG"], "eBKP-H": ["C02.01 Wand"],
+        "GUID": ["A"], "Fläche (m2)": ["abc m2"], "Volumen (m3)": [None],
+    })
+    fp = vm.frame_fingerprint(df)
+
+    first = vm._cached_process(df, fp, [], [])
+    miss_warnings = list(shown)
+    second = vm._cached_process(df, fp, [], [])
+
+    assert vm._process_cache().hits == 1
+    assert "Ungültiges Format in Zelle: 'abc m2'" in miss_warnings
+    assert shown[len(miss_warnings):] == miss_warnings
+    pd.testing.assert_frame_equal(first, second)
+
+
+def test_collect_warnings_is_isolated_per_thread(monkeypatch):
+    import threading
+
+    shown = []
+    monkeypatch.setattr(excel_utils.st, "warning", lambda msg, *a, **k: shown.append(msg))
+    original = excel_utils.st.warning
+    inside, results = threading.Barrier(2), {}
+
+    def run(name):
+        with excel_utils.collect_warnings(show=False) as collected:
+            inside.wait()
+            excel_utils.show_warning(name)
+            inside.wait()
+        results[name] = collected
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in ("a", "b")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    excel_utils.show_warning("danach")
+    assert results == {"a": ["a"], "b": ["b"]}
+    assert shown == ["danach"]
+    assert excel_utils.st.warning is original
@@ -0,0 +1,65 @@
+import io
+
+import pandas as pd
+import pytest
+
+from mehrschichtig_bereinigen import clean_dataframe, convert_quantity_columns, detect_sheet_header, stream_clean
+
+
+def _xlsx(df: pd.DataFrame) -> bytes:
+    buf = io.BytesIO()
+    df.to_excel(buf, index=False)
+    return buf.getvalue()
+
+
+def _rows(df: pd.DataFrame) -> list:
+    """Zeilen als sortierbare Tupel (Reihenfolge der promoteten Subs weicht im Streaming ab)."""
+    return sorted(tuple("" if pd.isna(v) else str(v) for v in row) for row in df.itertuples(index=False))
+
+
+def _mother(guid, material, dicke, name="N"):
+    return {"Teilprojekt": "TP1", "Gebäude": "G1", "Geschoss": "EG", "eBKP-H": "C02.01 Wand",
+            "Material": material, "Dicke": dicke, "Name": name, "GUID": guid}
+
+
+def _compare(raw: pd.DataFrame, chunk_size: int):
+    data = _xlsx(raw)
+    full, _ = clean_dataframe(pd.read_excel(io.BytesIO(data)))
+    full = convert_quantity_columns(full)
+    header_row, columns = detect_sheet_header(io.BytesIO(data))
+    out = io.BytesIO()
+    rows, _, removed = stream_clean(io.BytesIO(data), out, header_row, columns, chunk_size=chunk_size)
+    streamed = pd.read_excel(io.BytesIO(out.getvalue()))
+    expected = pd.read_excel(io.BytesIO(_xlsx(full)))
+    assert rows == len(expected)
+    assert removed == len(raw) - len(expected)
+    assert _rows(streamed) == _rows(expected)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 100])
+def test_split_guid_group_not_identical(chunk_size):
+    # GUID A ist nicht identisch (Holz/2.0) – alle drei Zeilen bleiben, auch ueber Chunkgrenzen
+    raw = pd.DataFrame([
+        _mother("A", "Beton", 1.0),
+        _mother("A", "Beton", 1.0),
+        _mother("A", "Holz", 2.0),
+        _mother("B", "Beton", 1.0),
+    ])
+    _compare(raw, chunk_size)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 100])
+def test_split_guid_group_identical(chunk_size):
+    # identische Gruppen: nur das erste Vorkommen bleibt; leere Werte zaehlen nicht als Abweichung
+    raw = pd.DataFrame([
+        _mother("A", "Beton", 1.0),
+        _mother("B", "Holz", 2.0),
+        _mother("A", "Beton", 1.0),
+        _mother("C", "Holz", None),
+        _mother("A", "Beton", 1.0),
+        _mother("C", "Holz", 3.0),
+        _mother("B", "Holz", 2.5),
+        _mother(None, "Beton", 1.0),
+        _mother(None, "Beton", 1.0),
+    ])
+    _compare(raw, chunk_size)
@@ -0,0 +1,76 @@
+import io
+
+import pandas as pd
+import pytest
+
+import advanced_excel_merge_table as mt
+from excel_utils import StreamingTableWriter
+
+
+class _Upload(io.BytesIO):
+    def __init__(self, name: str, df: pd.DataFrame):
+        super().__init__()
+        df.to_excel(self, index=False)
+        self.seek(0)
+        self.name = name
+
+
+class _Progress:
+    def progress(self, *args):
+        pass
+
+
+def _stub_streamlit(monkeypatch):
+    shown = {"error": [], "download": []}
+    monkeypatch.setattr(mt.st, "progress", lambda *a, **k: _Progress())
+    monkeypatch.setattr(mt.st, "error", lambda msg, *a, **k: shown["error"].append(msg))
+    for name in ("success", "info", "warning"):
+        monkeypatch.setattr(mt.st, name, lambda *a, **k: None)
+    monkeypatch.setattr(mt.st, "download_button", lambda *a, **k: shown["download"].append(k))
+    return shown
+
+
+def _files():
+    df = pd.DataFrame({"GUID": [f"G{i}" for i in range(5)], "Name": "Wand"})
+    return [_Upload("a.xlsx", df), _Upload("b.xlsx", df)]
+
+
+def test_row_limit_aborts_merge(monkeypatch):
+    shown = _stub_streamlit(monkeypatch)
+    monkeypatch.setattr(StreamingTableWriter, "XLSX_MAX_ROWS", 8)
+    mt._stream_merge(_files(), "Test", False, "", "xlsx")
+    assert shown["download"] == []
+    assert len(shown["error"]) == 1 and shown["error"][0].startswith("Merge abgebrochen")
+
+
+def test_merge_within_limit_offers_download(monkeypatch):
+    shown = _stub_streamlit(monkeypatch)
+    mt._stream_merge(_files(), "Test", False, "", "xlsx")
+    assert shown["error"] == []
+    assert len(shown["download"]) == 1
+
+
+def test_failing_file_leaves_no_rows_or_guids(monkeypatch):
+    pytest.importorskip("pyarrow")
+    shown = _stub_streamlit(monkeypatch)
+    files = [
+        _Upload("a.xlsx", pd.DataFrame({"GUID": ["A1", "A2"], "Name": "Wand"})),
+        _Upload("b.xlsx", pd.DataFrame({"GUID": ["B1", "B2", "B3"], "Name": "Decke"})),
+        _Upload("c.xlsx", pd.DataFrame({"GUID": ["B1", "C1"], "Name": "Stütze"})),
+    ]
+    original = mt.iter_sheet_chunks
+
+    def flaky(file, **kwargs):
+        kwargs["chunk_size"] = 1
+        for i, chunk in enumerate(original(file, **kwargs)):
+            if file.name == "b.xlsx" and i == 2:
+                raise RuntimeError("Datei beschaedigt")
+            yield chunk
+
+    monkeypatch.setattr(mt, "iter_sheet_chunks", flaky)
+    mt._stream_merge(files, "Test", False, "", "parquet")
+
+    assert len(shown["error"]) == 1 and "b.xlsx" in shown["error"][0]
+    out = pd.read_parquet(io.BytesIO(shown["download"][0]["data"].getvalue()))
+    assert out["GUID"].tolist() == ["A1", "A2", "B1", "C1"]
+    assert not out["GUID-Duplikat"].any()
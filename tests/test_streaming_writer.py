@@ -0,0 +1,26 @@
+import io
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from excel_utils import StreamingTableWriter
+
+
+def test_highlighted_dates_keep_date_format():
+    df = pd.DataFrame({
+        "Name": ["a", "b", "c"],
+        "Datum": pd.to_datetime(["2024-01-02", "2024-01-03", "2024-01-04"]),
+    })
+    cells = np.array([[False, False], [False, False], [False, True]])
+    buf = io.BytesIO()
+    with StreamingTableWriter(buf, list(df.columns), "Sheet1") as w:
+        w.append(df, row_mask=[False, True, False], cell_mask=cells)
+
+    ws = openpyxl.load_workbook(io.BytesIO(buf.getvalue())).active
+    for row in (2, 3, 4):
+        cell = ws.cell(row=row, column=2)
+        assert cell.is_date, (row, cell.number_format)
+        assert cell.value.date() == df["Datum"][row - 2].date()
+    assert ws.cell(row=3, column=2).fill.fgColor.rgb.endswith("FFFF00")
+    assert ws.cell(row=4, column=2).fill.fgColor.rgb.endswith("FFFF00")
@@ -0,0 +1,34 @@
+import io
+
+import pandas as pd
+
+import vererbung_mengen as vm
+
+
+def _export(n_groups: int) -> bytes:
+    rows = []
+    for g in range(n_groups):
+        rows.append({"Teilprojekt": "TP1", "Gebäude": "G1", "Geschoss": "EG", "eBKP-H": "C02.01 Wand",
+                     "Material": "Beton", "GUID": f"M{g}", "Fläche A": "abc", "Fläche B": 2.0})
+        rows.append({"Material Sub": "Putz", "GUID Sub": f"S{g}", "Dicke Sub": 0.01})
+    buf = io.BytesIO()
+    pd.DataFrame(rows).reindex(columns=[
+        "Teilprojekt", "Gebäude", "Geschoss", "eBKP-H", "Material", "Material Sub",
+        "Fläche A", "Fläche B", "Dicke Sub", "GUID", "GUID Sub",
+    ]).to_excel(buf, index=False)
+    return buf.getvalue()
+
+
+def test_stream_warnings_once_and_fixed_columns(monkeypatch):
+    shown = []
+    monkeypatch.setattr(vm.st, "warning", lambda msg, *a, **k: shown.append(msg))
+    data = _export(40)
+    header_row, columns = vm.detect_sheet_header(io.BytesIO(data))
+    out = io.BytesIO()
+    stats = vm._stream_process(io.BytesIO(data), out, header_row, columns, [], [], [], chunk_size=4)
+
+    assert shown, "Testdaten sollten Warnungen ausloesen"
+    assert len(shown) == len(set(shown))
+    result = pd.read_excel(io.BytesIO(out.getvalue()))
+    assert list(result.columns) == stats["columns"]
+    assert stats["rows"] == len(result) == 40
@@ -2,15 +2,39 @@ import io
 import re
 import json
 import unicodedata
+from collections import Counter
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Optional, List, Dict, Any
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 
 # Eigene Utilities (muessen vorhanden sein)
-from excel_utils import clean_columns_values, rename_columns_to_standard, convert_quantity_columns
+from excel_utils import (
+    clean_columns_values,
+    rename_columns_to_standard,
+    convert_quantity_columns,
+    write_highlighted_excel,
+    render_duplicate_review,
+    GroupIndex,
+    blank_mask,
+    fill_rows,
+    LRUCache,
+    collect_warnings,
+    frame_fingerprint,
+    drop_duplicate_rows,
+    detect_sheet_header,
+    iter_sheet_chunks,
+    iter_group_chunks,
+    row_fingerprints,
+    hash_values,
+    SeenHashes,
+    StreamingTableWriter,
+    COLUMN_PRESET,
+    pq,
+)
 
 
 # ========= Text-Normalisierung (Diakritik & Schweizer 'ss') =========
@@ -336,9 +360,26 @@ def _export_rules_debug_xlsx(df_before: pd.DataFrame,
 
 
 # ========= Kernverarbeitung (vektorisiert) =========
+# Master-Kontext: mind. ein Wert ⇒ Mutter, alle leer ⇒ Sub
+MASTER_COLS = ["Teilprojekt", "Gebaeude", "Baufeld", "Geschoss", "Umbaustatus", "Unter Terrain", "Typ"]
+
+
+@dataclass
+class _Inherited:
+    """Zwischenstand nach der Vererbung; Basis fuer Promotion/Sub-Drop (Schritt 1 und 2)."""
+    df: pd.DataFrame
+    cols: pd.Index
+    is_mother: pd.Series
+    is_sub: pd.Series
+    grp_id: pd.Series
+    gi: GroupIndex
+    mother_guid_map: pd.Series
+
+
 def _process_df(
     df: pd.DataFrame,
     drop_sub_values: Optional[List[str]] = None,  # eBKP-H exakte Werte: nur Sub-Zeilen droppen
+    warn_empty: bool = True,
 ) -> pd.DataFrame:
     """
     Ablauf:
@@ -350,11 +391,15 @@ def _process_df(
     - GUID-Logik bereinigt: nur 'GUID' (eigene ID; bei Subs aus 'GUID Sub') und 'GUID Gruppe' (immer Mutter-GUID).
     - Standardisieren & Werte bereinigen.
     """
-    drop_set = {str(v).strip().lower() for v in (drop_sub_values or []) if str(v).strip()}
+    return _promote_stage(_inherit_stage(df), drop_sub_values, warn_empty)
+
+
+def _inherit_stage(df: pd.DataFrame) -> _Inherited:
+    """Stufe 1: Gruppen bilden und Mutterwerte an Subs vererben (unabhaengig vom Sub-Drop)."""
     cols = pd.Index(df.columns)
 
     # Master-Kontext & Sub-Paare
-    master_cols = [c for c in ["Teilprojekt", "Gebaeude", "Baufeld", "Geschoss", "Umbaustatus", "Unter Terrain", "Typ"] if c in cols]
+    master_cols = [c for c in MASTER_COLS if c in cols]
     sub_pairs = sorted({c[:-4] for c in cols if c.endswith(" Sub") and c[:-4] in cols and c[:-4] != "GUID"})
 
     # Mutter/Sub-Flags (robust)
@@ -367,9 +412,9 @@ def _process_df(
         is_mother = pd.Series(False, index=df.index)
         is_sub = pd.Series(False, index=df.index)
 
-    # Gruppen-IDs (laufende Nummern ueber Muetter)
-    grp_id = is_mother.cumsum()
-    grp_id = grp_id.mask(grp_id.eq(0))  # vor erster Mutter -> NA
+    # Gruppen (einmal aufgebaut); grp_id = laufende Nummer ab 1, vor erster Mutter NA
+    gi = GroupIndex.from_flags(is_mother, is_sub)
+    grp_id = pd.Series(np.where(gi.codes >= 0, gi.codes + 1, np.nan), index=df.index)
 
     # Meta-Spalten
     df["Mehrschichtiges Element"] = is_sub
@@ -379,7 +424,7 @@ def _process_df(
 
     # Mutter-GUID je Gruppe
     if "GUID" in cols:
-        mother_guid_map = df.loc[is_mother, ["GUID"]].assign(grp=grp_id[is_mother]).set_index("grp")["GUID"]
+        mother_guid_map = pd.Series(df["GUID"].to_numpy()[gi.mother_pos], index=np.arange(1, gi.n_groups + 1, dtype=float))
         # Mutter: GUID Gruppe = eigene GUID
         df.loc[is_mother, "GUID Gruppe"] = df.loc[is_mother, "GUID"]
     else:
@@ -389,14 +434,13 @@ def _process_df(
     if not grp_id.isna().all():
         # Master-Kontext fuer echte Subs (alle Master leer)
         if master_cols:
-            mother_ctx = df.loc[is_mother, master_cols].assign(grp=grp_id[is_mother]).set_index("grp")
-            for c in master_cols:
-                df.loc[is_sub, c] = grp_id[is_sub].map(mother_ctx[c])
+            sub_rows = np.flatnonzero(is_sub.to_numpy())
+            mother_ctx = gi.gather_frame(df, master_cols, sub_rows, fill=np.nan)
+            for j, c in enumerate(master_cols):
+                df.loc[is_sub, c] = pd.Series(mother_ctx[:, j], index=df.index[sub_rows]).infer_objects()
 
         # eBKP-H der Mutter an ALLE Nicht-Muetter, wenn Zeilen-eBKP-H undefiniert
         if "eBKP-H" in cols:
-            mother_ebkp_map = df.loc[is_mother, ["eBKP-H"]].assign(grp=grp_id[is_mother]).set_index("grp")["eBKP-H"]
-
             ebkp_sub = df["eBKP-H Sub"] if "eBKP-H Sub" in cols else pd.Series(pd.NA, index=df.index)
             ebkp_row = ebkp_sub.where(ebkp_sub.astype(str).str.strip().ne(""), df.get("eBKP-H", pd.Series(pd.NA, index=df.index)))
 
@@ -407,38 +451,48 @@ def _process_df(
             )
 
             eligible = (~is_mother) & grp_id.notna() & undef_row
-            df.loc[eligible, "eBKP-H"] = grp_id[eligible].map(mother_ebkp_map)
+            df.loc[eligible, "eBKP-H"] = gi.gather(df["eBKP-H"], np.flatnonzero(eligible.to_numpy()))
 
     # ---------- (2) Werte uebernehmen: Sub bevorzugen, sonst Mutter ----------
+    # Alle Spalten als Block: Mutterzeile je Gruppe per take auf die Ziel-Zeilen
     tgt = (~is_mother) & grp_id.notna()
-
-    for base in sub_pairs:
-        sub_col = f"{base} Sub"
-
-        has_sub_val = df[sub_col].notna() & df[sub_col].astype(str).str.strip().ne("")
-        if not grp_id.isna().all():
-            mother_base_map = df.loc[is_mother, [base]].assign(grp=grp_id[is_mother]).set_index("grp")[base]
-            mother_vals = grp_id.map(mother_base_map)
-        else:
-            mother_vals = pd.Series(pd.NA, index=df.index)
-
-        need_fill = df[base].isna() | df[base].astype(str).str.strip().eq("")
-
-        # 1) Sub-Wert uebernehmen, wenn vorhanden
-        df.loc[tgt & has_sub_val & need_fill, base] = df.loc[tgt & has_sub_val & need_fill, sub_col]
-        # 2) sonst Mutterwert
-        df.loc[tgt & ~has_sub_val & need_fill, base] = mother_vals[tgt & ~has_sub_val & need_fill]
+    tgt_rows = np.flatnonzero(tgt.to_numpy())
+    tgt_mother = gi.mother_of(tgt_rows)
+
+    if sub_pairs and len(tgt_rows):
+        sub_cols = [f"{base} Sub" for base in sub_pairs]
+        base_vals = df[sub_pairs].to_numpy(dtype=object)
+        sub_vals = df[sub_cols].to_numpy(dtype=object)[tgt_rows]
+        has_sub_val = ~blank_mask(df[sub_cols])[tgt_rows]
+        # 1) Sub-Wert, wenn vorhanden; 2) sonst Mutterwert
+        src = np.where(has_sub_val, sub_vals, base_vals[tgt_mother])
+        need_fill = blank_mask(df[sub_pairs])[tgt_rows]
+        fill_rows(df, sub_pairs, tgt_rows, need_fill, src)
 
     # ---------- (2b) Hauptspalten ohne Pendant '... Sub' vor 'Einzelteile' vererben ----------
     cols_list = list(df.columns)
     boundary = cols_list.index("Einzelteile") if "Einzelteile" in cols_list else len(cols_list)
     inherit_cols = [c for c in cols_list[:boundary] if c != "GUID" and f"{c} Sub" not in df.columns]
 
-    if inherit_cols and not grp_id.isna().all():
-        for base in inherit_cols:
-            mother_map = df.loc[is_mother, [base]].assign(grp=grp_id[is_mother]).set_index("grp")[base]
-            need_fill = df[base].isna() | df[base].astype(str).str.strip().eq("")
-            df.loc[tgt & need_fill, base] = grp_id[tgt & need_fill].map(mother_map)
+    if inherit_cols and len(tgt_rows):
+        src = df[inherit_cols].to_numpy(dtype=object)[tgt_mother]
+        need_fill = blank_mask(df[inherit_cols])[tgt_rows]
+        fill_rows(df, inherit_cols, tgt_rows, need_fill, src)
+
+    return _Inherited(df, cols, is_mother, is_sub, grp_id, gi, mother_guid_map)
+
+
+def _promote_stage(
+    inherited: _Inherited,
+    drop_sub_values: Optional[List[str]] = None,
+    warn_empty: bool = True,
+) -> pd.DataFrame:
+    """Stufe 2: Sub-Drop, Promotion, GUID-Logik und Bereinigung; der Zwischenstand bleibt unveraendert."""
+    drop_set = {str(v).strip().lower() for v in (drop_sub_values or []) if str(v).strip()}
+    df = inherited.df.copy()
+    cols, gi = inherited.cols, inherited.gi
+    is_mother, is_sub, grp_id = inherited.is_mother, inherited.is_sub, inherited.grp_id
+    mother_guid_map = inherited.mother_guid_map
 
     # ---------- (3) Sub-Drop gem. eBKP-H + Promotion ----------
     if "eBKP-H Sub" in cols:
@@ -474,10 +528,7 @@ def _process_df(
 
     # 3) Mutter-GUID an Subs als 'GUID Gruppe' vererben
     if "GUID" in cols:
-        mother_guid_map = df.loc[is_mother, ["GUID"]].assign(grp=grp_id[is_mother]).set_index("grp")["GUID"]
-        promoted["GUID Gruppe"] = grp_id[keep_sub_mask].map(mother_guid_map).values
-    else:
-        mother_guid_map = pd.Series(dtype=object)
+        promoted["GUID Gruppe"] = gi.gather(df["GUID"], np.flatnonzero(keep_sub_mask.to_numpy()))
 
     # 4) Muetter/Subs droppen und Promoted anhaengen
     to_drop_idx = df.index[drop_mother_mask | drop_sub_mask]
@@ -518,7 +569,7 @@ def _process_df(
 
     # ---------- (6) Standardisieren & Werte bereinigen ----------
     df = rename_columns_to_standard(df)
-    df = clean_columns_values(df, delete_enabled=True, custom_chars="")
+    df = clean_columns_values(df, delete_enabled=True, custom_chars="", warn_empty=warn_empty)
 
     # Sicherheit: Nur 'GUID' + 'GUID Gruppe' als GUID-Spalten behalten
     guid_like = [c for c in df.columns if c.lower().startswith("guid")]
@@ -529,13 +580,296 @@ def _process_df(
     return df
 
 
+# ========= Schritt 2/3: Filter und Finalisierung =========
+# Zielspalten (in dieser Reihenfolge anzeigen, soweit vorhanden)
+TARGET_COLS = [
+    "Teilprojekt","Geschoss","eBKP-H","Material","Unter Terrain","Ergaenzungen","Typ","Umbaustatus",
+    "Flaeche (m2)","Dicke (m)","Volumen (m3)","Anzahl","Laenge (m)","Hoehe (m)","GUID"
+]
+# Zentrale Pflichtfelder fuer Qualitaetscheck
+CENTRAL_KEYS = ["Teilprojekt","Geschoss","eBKP-H","Material","GUID"]
+# Meta-Spalten, die beim Element-Dedup nicht zaehlen
+EXCLUDE_META = {"Mehrschichtiges Element","Promoted","GUID Gruppe"}
+
+
+def _filter_materials(df: pd.DataFrame, materials: List[str]) -> pd.DataFrame:
+    """Zeilen mit diesen effektiven Material-Werten entfernen."""
+    if not materials:
+        return df
+    mat_eff = df.get("Material", pd.Series("", index=df.index)).astype(str).str.strip()
+    return df.loc[~mat_eff.isin(set(materials))].reset_index(drop=True)
+
+
+def _central_empties(df: pd.DataFrame) -> Dict[str, int]:
+    """Anzahl leerer Werte je zentraler Spalte (nur Spalten mit Leerwerten)."""
+    empties = {}
+    for c in CENTRAL_KEYS:
+        s = df[c]
+        if pd.api.types.is_numeric_dtype(s):
+            cnt = int(s.isna().sum())
+        else:
+            cnt = int(s.isna().sum() + s.astype(str).str.strip().eq("").sum())
+        if cnt > 0:
+            empties[c] = cnt
+    return empties
+
+
+def _order_final_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Zielspalten zuerst, dann der Rest; 'GUID Gruppe' entfernen."""
+    ordered_cols = [c for c in TARGET_COLS if c in df.columns]
+    the_rest = [c for c in df.columns if c not in ordered_cols and c != "GUID Gruppe"]
+    return df[ordered_cols + the_rest]
+
+
+# ========= Ergebnis-Cache fuer Schritt 1/2 =========
+# Bei Aenderungen an der Pipeline erhoehen ⇒ alte Cache-Eintraege greifen nicht mehr
+PIPELINE_VERSION = 2
+
+
+def _process_cache() -> LRUCache:
+    if "process_cache" not in st.session_state:
+        st.session_state["process_cache"] = LRUCache(maxsize=8)
+    return st.session_state["process_cache"]
+
+
+def _inherited_for(df_raw: pd.DataFrame, fingerprint: str) -> _Inherited:
+    """Vererbter Zwischenstand fuer genau diesen Rohstand (aus session_state oder neu)."""
+    cached = st.session_state.get("df_inherited")
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+    inherited = _inherit_stage(df_raw.copy())
+    st.session_state["df_inherited"] = (fingerprint, inherited)
+    return inherited
+
+
+def _cached_process(
+    df_raw: pd.DataFrame,
+    fingerprint: str,
+    drop_sub_values: List[str],
+    materials: List[str],
+) -> pd.DataFrame:
+    """
+    _process_df + Mengenkonvertierung + Material-Filter, gecacht nach
+    (Fingerprint, Drop-Werte, Materialien, PIPELINE_VERSION). Gibt eine Kopie zurueck.
+    Warnungen (Einheiten, leere Mengenspalten) werden mitgecacht und bei jedem Aufruf angezeigt.
+    """
+    key = (fingerprint, frozenset(drop_sub_values), frozenset(materials), PIPELINE_VERSION)
+
+    def compute():
+        with collect_warnings(show=False) as warnings:
+            df = _promote_stage(_inherited_for(df_raw, fingerprint), drop_sub_values)
+            df = _filter_materials(convert_quantity_columns(df), materials)
+        return df, warnings
+
+    df, warnings = _process_cache().get_or_compute(key, compute)
+    for msg in warnings:
+        st.warning(msg)
+    return df.copy()
+
+
+def _cache_caption() -> None:
+    cache = _process_cache()
+    st.caption(
+        f"Cache: {cache.hits} Treffer, {cache.misses} Berechnungen, "
+        f"{len(cache)}/{cache.maxsize} Eintraege."
+    )
+
+
+# ========= Streaming-Modus (sehr grosse Exporte) =========
+def _stream_process(
+    file,
+    buffer,
+    header_row: int,
+    columns: List[str],
+    drop_sub_values: List[str],
+    materials: List[str],
+    rules: List[Dict[str, Any]],
+    first_match_wins: bool = False,
+    fmt: str = "xlsx",
+    chunk_size: int = 20000,
+    on_chunk=None,
+) -> Dict[str, Any]:
+    """
+    Schritte 1-3 chunkweise ohne Vollimport:
+    - Blatt read-only lesen, Chunks nur vor Mutterzeilen schneiden (Gruppen bleiben ganz)
+    - je Chunk: Vererbung/Promotion, Mengen, Material-Filter, Regeln
+    - Element-Dedup ueber Chunks: Set aus Zeilen-Fingerprints
+    - Doppelte GUIDs: Set aus GUID-Hashes, Folge-Vorkommen werden markiert
+    - Ausgabespalten vorab aus `columns` (leerer Durchlauf); jeder Chunk muss sie liefern
+    - Warnungen (Umbenennung, Einheiten) je Meldung nur einmal, nicht pro Chunk
+    Rueckgabe: Kennzahlen (Zeilen, entfernte Duplikate, markierte GUIDs, Leerwerte, Spalten).
+    """
+    master_cols = [c for c in MASTER_COLS if c in columns]
+
+    def can_start(chunk: pd.DataFrame) -> np.ndarray:
+        if not master_cols:
+            return np.ones(len(chunk), dtype=bool)
+        return chunk[master_cols].notna().any(axis=1).to_numpy()
+
+    stats = {"rows": 0, "removed_exact": 0, "dup_guids": 0, "empties": Counter(), "columns": []}
+    seen_rows = SeenHashes()
+    seen_guids = SeenHashes()
+    shown_warnings = set()
+
+    def process(chunk: pd.DataFrame) -> pd.DataFrame:
+        with collect_warnings(show=False) as warnings:
+            part = _process_df(chunk, drop_sub_values, warn_empty=False)
+            part = _filter_materials(convert_quantity_columns(part), materials)
+            if rules:
+                part = apply_materialization_rules(part, rules, first_match_wins=first_match_wins)
+        for msg in warnings:
+            if msg not in shown_warnings:
+                shown_warnings.add(msg)
+                st.warning(msg)
+        return part
+
+    out_cols = list(_order_final_columns(process(pd.DataFrame(columns=columns))).columns)
+    numeric = [c for c in out_cols if c in COLUMN_PRESET]
+    writer = StreamingTableWriter(buffer, out_cols, sheet_name="Final_Step3", fmt=fmt,
+                                  mark_column="GUID-Duplikat", numeric_columns=numeric)
+
+    try:
+        chunks = iter_sheet_chunks(file, header_row=header_row, columns=columns, chunk_size=chunk_size)
+        for chunk in iter_group_chunks(chunks, can_start):
+            part = process(chunk)
+
+            subset_cols = [c for c in part.columns if c not in EXCLUDE_META]
+            dup = seen_rows.mark(row_fingerprints(part, subset_cols, dtype_stable=True))
+            part = part.loc[~dup].reset_index(drop=True)
+            stats["removed_exact"] += int(dup.sum())
+
+            if all(c in part.columns for c in CENTRAL_KEYS):
+                stats["empties"].update(_central_empties(part))
+            part = _order_final_columns(part)
+            if set(part.columns) != set(out_cols):
+                raise ValueError(
+                    "Chunk liefert andere Spalten als erwartet: "
+                    f"fehlend {sorted(set(out_cols) - set(part.columns))}, "
+                    f"zusaetzlich {sorted(set(part.columns) - set(out_cols))}"
+                )
+
+            guid_dup = None
+            if "GUID" in part.columns:
+                guid_dup = seen_guids.mark(hash_values(part["GUID"]), valid=part["GUID"].notna().to_numpy())
+                stats["dup_guids"] += int(guid_dup.sum())
+
+            writer.append(part, row_mask=guid_dup)
+            if on_chunk is not None:
+                on_chunk(writer.rows_written)
+    finally:
+        writer.close()
+    stats["rows"] = writer.rows_written
+    stats["columns"] = writer.columns
+    return stats
+
+
+def _scan_stream_options(file, header_row: int, columns: List[str]):
+    """eBKP-H-Optionen und Material-Labels (mit Anzahl) in einem Lesedurchlauf."""
+    ebkp = set()
+    counts = Counter()
+    for chunk in iter_sheet_chunks(file, header_row=header_row, columns=columns):
+        for c in ("eBKP-H", "eBKP-H Sub"):
+            if c in chunk.columns:
+                ebkp.update(chunk[c].dropna().astype(str).str.strip().unique().tolist())
+        for c in ("Material", "Material Sub"):
+            if c in chunk.columns:
+                s = chunk[c].dropna().astype(str).str.strip()
+                counts.update(s[s != ""].value_counts().to_dict())
+    materials_map = {val: f"{val} ({n})" for val, n in counts.most_common()}
+    return sorted(ebkp), materials_map
+
+
+def _streaming_app(uploaded_file) -> None:
+    """Schritte 1-3 in einem chunkweisen Durchlauf (ohne Vorschau, Regel-Debug und Duplikat-Review)."""
+    try:
+        header_row, columns = detect_sheet_header(uploaded_file)
+        # Optionen je Datei nur einmal scannen
+        scan_key = getattr(uploaded_file, "file_id", uploaded_file.name)
+        if st.session_state.get("stream_scan", (None, None))[0] != scan_key:
+            st.session_state["stream_scan"] = (
+                scan_key, _scan_stream_options(uploaded_file, header_row, columns)
+            )
+        ebkp_options, materials_map = st.session_state["stream_scan"][1]
+    except Exception as e:
+        st.error(f"Fehler beim Einlesen: {e}")
+        return
+
+    st.markdown("""
+**Streaming-Modus**  
+Schritte 1-3 laufen in einem Durchlauf chunkweise; Mutter und Subs bleiben im selben Chunk.  
+Doppelte GUIDs werden ab dem zweiten Vorkommen markiert.
+    """)
+    materials_labels = [materials_map[k] for k in sorted(materials_map.keys(), key=lambda x: x.lower())]
+    materials_inv = {v: k for k, v in materials_map.items()}
+
+    with st.form(key="form_stream"):
+        sel_drop_values = st.multiselect(
+            "Subs ignorieren (droppen), wenn eBKP-H exakt gleich ist",
+            options=ebkp_options,
+            default=[],
+        )
+        sel_material_labels = st.multiselect(
+            "Material zum Entfernen (Material & Material Sub zusammengefasst)",
+            options=materials_labels,
+            default=[],
+        )
+        apply_rules = st.checkbox("Regeln (rules.json) anwenden", value=True)
+        first_match_wins = st.checkbox("Materialisierungs-Regeln: erste Regel gewinnt (Stop nach Match)", value=False)
+        formats = ["xlsx", "parquet"] if pq is not None else ["xlsx"]
+        fmt = st.radio("Ausgabeformat", formats, horizontal=True)
+        btn_stream = st.form_submit_button("Streaming-Verarbeitung starten")
+    if not btn_stream:
+        return
+
+    rules = load_rules_from_repo("rules.json") if apply_rules else []
+    status = st.empty()
+    out = io.BytesIO()
+    try:
+        with st.spinner("Verarbeitung laeuft chunkweise ..."):
+            stats = _stream_process(
+                uploaded_file, out, header_row, columns,
+                sel_drop_values, [materials_inv[lbl] for lbl in sel_material_labels],
+                rules, first_match_wins=bool(first_match_wins), fmt=fmt,
+                on_chunk=lambda n: status.caption(f"{n} Zeilen geschrieben ..."),
+            )
+    except Exception as e:
+        st.error(f"Fehler bei der Streaming-Verarbeitung: {e}")
+        return
+
+    status.empty()
+    missing_central = [c for c in CENTRAL_KEYS if c not in stats["columns"]]
+    if missing_central:
+        st.error(f"Zentrale Spalten fehlen: {missing_central}. Bitte Mapping/Standardisierung pruefen.")
+    elif stats["empties"]:
+        st.warning(f"Leere Werte in zentralen Spalten: {dict(stats['empties'])}")
+    if stats["removed_exact"]:
+        st.info(f"Exakte Element-Duplikate entfernt: {stats['removed_exact']} Zeilen.")
+    if stats["dup_guids"]:
+        st.warning(f"Doppelte GUIDs: {stats['dup_guids']} Folge-Zeilen markiert.")
+    st.success(f"Streaming-Verarbeitung abgeschlossen: {stats['rows']} Zeilen.")
+
+    out.seek(0)
+    if fmt == "parquet":
+        file_name, mime = "export_final_step3.parquet", "application/octet-stream"
+    else:
+        file_name = "export_final_step3.xlsx"
+        mime = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    st.download_button(
+        "Download: Final (Streaming)",
+        data=out,
+        file_name=file_name,
+        mime=mime,
+        key="dl_final_stream"
+    )
+
+
 # ========= Streamlit App (3 Schritte) =========
 def app(supplement_name: str, delete_enabled: bool, custom_chars: str):
     st.set_page_config(page_title="Vererbung & Regeln", layout="wide")
     st.header("Vererbung & Mengenuebernahme")
 
     # Session-State
-    for key in ("df_raw", "df_step1", "df_step2", "df_final"):
+    for key in ("df_raw", "df_inherited", "df_step1", "df_step2", "df_final"):
         if key not in st.session_state:
             st.session_state[key] = None
 
@@ -544,6 +878,17 @@ def app(supplement_name: str, delete_enabled: bool, custom_chars: str):
     if not uploaded_file:
         st.stop()
 
+    # Vor dem Vollimport entscheiden: grosse Exporte chunkweise verarbeiten
+    streaming = st.checkbox(
+        "Streaming-Modus (sehr grosse Exporte, ohne Vollimport)",
+        value=False,
+        key="vererbung_streaming",
+        help="Liest das Blatt chunkweise, schneidet nur vor Mutterzeilen und schreibt direkt in die Ausgabe."
+    )
+    if streaming:
+        _streaming_app(uploaded_file)
+        st.stop()
+
     try:
         df_raw = pd.read_excel(uploaded_file, engine="openpyxl")
         st.session_state["df_raw"] = df_raw.copy()
@@ -564,12 +909,13 @@ def app(supplement_name: str, delete_enabled: bool, custom_chars: str):
         btn_step1 = st.form_submit_button("Schritt 1 starten (Bereinigung)")
     if btn_step1:
         with st.spinner("Schritt 1 laeuft ..."):
-            df_step1 = _process_df(df_raw.copy(), drop_sub_values=[])   # kein Sub-Drop hier
-            df_step1 = convert_quantity_columns(df_step1)
-        st.session_state["df_step1"] = df_step1.copy()
+            # kein Sub-Drop, kein Material-Filter hier
+            df_step1 = _cached_process(df_raw, frame_fingerprint(df_raw), [], [])
+        st.session_state["df_step1"] = df_step1
         st.session_state["df_step2"] = None
         st.session_state["df_final"] = None
         st.success("Schritt 1 abgeschlossen.")
+        _cache_caption()
 
     if st.session_state["df_step1"] is None:
         st.info("Bitte Schritt 1 ausfuehren.")
@@ -630,19 +976,14 @@ def app(supplement_name: str, delete_enabled: bool, custom_chars: str):
         btn_step2 = st.form_submit_button("Schritt 2 starten (ohne Regeln)")
     if btn_step2:
         with st.spinner("Schritt 2 laeuft ..."):
-            df_after_subdrop = _process_df(df_raw.copy(), drop_sub_values=sel_drop_values)
-            df_after_subdrop = convert_quantity_columns(df_after_subdrop)
-
+            # nur Promotion/Sub-Drop + Material-Filter neu (Vererbung und Ergebnisse gecacht)
             selected_materials = [materials_inv[lbl] for lbl in sel_material_labels]
-            if selected_materials:
-                mat_eff = df_after_subdrop.get("Material", pd.Series("", index=df_after_subdrop.index)).astype(str).str.strip()
-                df_step2 = df_after_subdrop.loc[~mat_eff.isin(set(selected_materials))].reset_index(drop=True)
-            else:
-                df_step2 = df_after_subdrop
+            df_step2 = _cached_process(df_raw, frame_fingerprint(df_raw), sel_drop_values, selected_materials)
 
-        st.session_state["df_step2"] = df_step2.copy()
+        st.session_state["df_step2"] = df_step2
         st.session_state["df_final"] = None
         st.success("Schritt 2 abgeschlossen (ohne Regeln).")
+        _cache_caption()
 
     if st.session_state["df_step2"] is None:
         st.info("Bitte Schritt 2 ausfuehren.")
@@ -691,74 +1032,29 @@ def app(supplement_name: str, delete_enabled: bool, custom_chars: str):
     
         # --- 3.c Finale Spalten-Pruefung & robuste Deduplication (NACH allen Regeln) ---
     
-        # 1) Zielspalten (in dieser Reihenfolge anzeigen, soweit vorhanden)
-        target_cols = [
-            "Teilprojekt","Geschoss","eBKP-H","Material","Unter Terrain","Ergaenzungen","Typ","Umbaustatus",
-            "Flaeche (m2)","Dicke (m)","Volumen (m3)","Anzahl","Laenge (m)","Hoehe (m)","GUID"
-        ]
-        
-        # 2) Zentrale Pflichtfelder fuer Qualitaetscheck
-        central_keys = ["Teilprojekt","Geschoss","eBKP-H","Material","GUID"]
-        
-        missing_central = [c for c in central_keys if c not in df_final.columns]
+        # 1) + 2) Zentrale Pflichtfelder pruefen
+        missing_central = [c for c in CENTRAL_KEYS if c not in df_final.columns]
         if missing_central:
             st.error(f"Zentrale Spalten fehlen: {missing_central}. Bitte Mapping/Standardisierung pruefen.")
         else:
-            empties = {}
-            for c in central_keys:
-                s = df_final[c]
-                if pd.api.types.is_numeric_dtype(s):
-                    cnt = int(s.isna().sum())
-                else:
-                    cnt = int(s.isna().sum() + s.astype(str).str.strip().eq("").sum())
-                if cnt > 0:
-                    empties[c] = cnt
+            empties = _central_empties(df_final)
             if empties:
                 st.warning(f"Leere Werte in zentralen Spalten: {empties}")
         
-        # 3) Robuste Kanonisierung fuer exaktes Element-Dedup
-        exclude_meta = {"Mehrschichtiges Element","Promoted","GUID Gruppe"}
-        subset_cols = [c for c in df_final.columns if c not in exclude_meta]
-        
-        df_norm = df_final[subset_cols].copy()
-        
-        # Strings normieren
-        obj_cols = [c for c in subset_cols if df_norm[c].dtype == "object"]
-        for c in obj_cols:
-            s = df_norm[c].astype(str).fillna("")
-            s = s.str.replace(r"\s+", " ", regex=True).str.strip()
-            df_norm[c] = s
-        
-        # Numerik runden
-        num_cols = [c for c in subset_cols if pd.api.types.is_numeric_dtype(df_norm[c])]
-        for c in num_cols:
-            df_norm[c] = pd.to_numeric(df_norm[c], errors="coerce").round(6)
-        
-        # Dedup
-        keep_mask = ~df_norm.duplicated(keep="first")
-        removed_exact = int((~keep_mask).sum())
-        df_final = df_final.loc[keep_mask].reset_index(drop=True)
+        # 3) Exaktes Element-Dedup ueber normierte Zeilen-Fingerprints
+        subset_cols = [c for c in df_final.columns if c not in EXCLUDE_META]
+        df_final, removed_exact = drop_duplicate_rows(df_final, subset_cols)
         if removed_exact > 0:
             st.info(f"Exakte Element-Duplikate entfernt: {removed_exact} Zeilen.")
         
-        # 4) Reihenfolge der Spalten fuer Ausgabe
-        ordered_cols = [c for c in target_cols if c in df_final.columns]
-        the_rest = [c for c in df_final.columns if c not in ordered_cols]
-        df_final = df_final[ordered_cols + the_rest]
-    
-        # 5) GUID Gruppe optional entfernen
-        if "GUID Gruppe" in df_final.columns:
-            df_final.drop(columns=["GUID Gruppe"], inplace=True, errors="ignore")
+        # 4) + 5) Reihenfolge der Spalten fuer Ausgabe, GUID Gruppe entfernen
+        df_final = _order_final_columns(df_final)
     
         # 6) Doppelte GUIDs markieren
         if "GUID" in df_final.columns:
-            dup_mask = df_final["GUID"].duplicated(keep=False)
+            dup_mask = df_final["GUID"].notna() & df_final["GUID"].duplicated(keep=False)
             if dup_mask.any():
-                st.warning(f"Doppelte GUIDs gefunden: {dup_mask.sum()} Zeilen")
-                st.dataframe(df_final.style.apply(
-                    lambda s: ["background-color: yellow" if dup_mask.iloc[i] else "" for i in range(len(s))],
-                    axis=0
-                ), width="stretch")
+                st.warning(f"Doppelte GUIDs gefunden: {dup_mask.sum()} Zeilen (siehe Duplikat-Review unten)")
     
         # Debug-Export
         if debug_rules:
@@ -781,9 +1077,19 @@ def app(supplement_name: str, delete_enabled: bool, custom_chars: str):
         df_final = st.session_state["df_final"]
         st.markdown("**Finalisiert (Top 15)**")
         st.dataframe(df_final.head(15), width="stretch")
+        render_duplicate_review(df_final, "GUID", key="final_dup_review")
+        # Doppelte GUIDs beim Schreiben gelb markieren
+        dup_final = (
+            df_final["GUID"].notna() & df_final["GUID"].duplicated(keep=False)
+            if "GUID" in df_final.columns else None
+        )
         out_final = io.BytesIO()
-        with pd.ExcelWriter(out_final, engine="openpyxl") as writer:
-            df_final.to_excel(writer, index=False, sheet_name="Final_Step3")
+        write_highlighted_excel(
+            df_final,
+            out_final,
+            sheet_name="Final_Step3",
+            row_mask=dup_final if dup_final is not None and dup_final.any() else None
+        )
         out_final.seek(0)
         st.download_button(
             "Download: Final (nach Regeln)",